@@ -0,0 +1,27 @@
+"""Rolling dialog summary on ai_dialog_state: context_summary, summary_until.
+
+Revision ID: 20261019_dialog_summary
+Revises: 20261019_llm_cache
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261019_dialog_summary"
+down_revision: Union[str, None] = "20261019_llm_cache"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("ai_dialog_state", sa.Column("context_summary", sa.Text(), nullable=True))
+    op.add_column("ai_dialog_state", sa.Column("summary_until", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("ai_dialog_state", "summary_until")
+    op.drop_column("ai_dialog_state", "context_summary")
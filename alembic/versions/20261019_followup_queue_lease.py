@@ -0,0 +1,44 @@
+"""Follow-up queue: lease_owner, lease_expires_at, attempts; index on (status, execute_at).
+
+Revision ID: 20261019_followup_lease
+Revises: 20261019_job_leases
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261019_followup_lease"
+down_revision: Union[str, None] = "20261019_job_leases"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "scheduled_followups",
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default=sa.text("0")),
+    )
+    op.add_column(
+        "scheduled_followups",
+        sa.Column("lease_owner", sa.String(length=255), nullable=True),
+    )
+    op.add_column(
+        "scheduled_followups",
+        sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index(
+        "ix_scheduled_followups_status_execute_at",
+        "scheduled_followups",
+        ["status", "execute_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_scheduled_followups_status_execute_at", table_name="scheduled_followups")
+    op.drop_column("scheduled_followups", "lease_expires_at")
+    op.drop_column("scheduled_followups", "lease_owner")
+    op.drop_column("scheduled_followups", "attempts")
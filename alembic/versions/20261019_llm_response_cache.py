@@ -0,0 +1,48 @@
+"""LLM response cache: per-profile settings on ai_settings and optional persistent table.
+
+Revision ID: 20261019_llm_cache
+Revises: 20261019_profile_user_idx
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261019_llm_cache"
+down_revision: Union[str, None] = "20261019_profile_user_idx"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "ai_settings",
+        sa.Column("response_cache_enabled", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+    op.add_column(
+        "ai_settings",
+        sa.Column("response_cache_ttl_seconds", sa.Integer(), nullable=False, server_default=sa.text("86400")),
+    )
+    op.add_column(
+        "ai_settings",
+        sa.Column("response_cache_context_messages", sa.Integer(), nullable=False, server_default=sa.text("1")),
+    )
+    op.create_table(
+        "llm_response_cache",
+        sa.Column("key", sa.String(64), primary_key=True),
+        sa.Column("model", sa.String(100), nullable=False),
+        sa.Column("response", sa.Text(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_llm_response_cache_expires_at", "llm_response_cache", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_llm_response_cache_expires_at", table_name="llm_response_cache")
+    op.drop_table("llm_response_cache")
+    op.drop_column("ai_settings", "response_cache_context_messages")
+    op.drop_column("ai_settings", "response_cache_ttl_seconds")
+    op.drop_column("ai_settings", "response_cache_enabled")
@@ -0,0 +1,24 @@
+"""Index avito_profiles.user_id: webhook resolves the profile by Avito user_id.
+
+Revision ID: 20261019_profile_user_idx
+Revises: 20261019_webhook_dedup
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "20261019_profile_user_idx"
+down_revision: Union[str, None] = "20261019_webhook_dedup"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_avito_profiles_user_id", "avito_profiles", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_avito_profiles_user_id", table_name="avito_profiles")
@@ -0,0 +1,28 @@
+"""Index for the retention job: ai_dialog_messages (profile_id, created_at).
+
+Revision ID: 20261019_retention
+Revises: 20261019_dialog_summary
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "20261019_retention"
+down_revision: Union[str, None] = "20261019_dialog_summary"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_ai_dialog_messages_profile_created",
+        "ai_dialog_messages",
+        ["profile_id", "created_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ai_dialog_messages_profile_created", table_name="ai_dialog_messages")
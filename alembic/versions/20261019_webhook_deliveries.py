@@ -0,0 +1,31 @@
+"""Webhook deliveries: idempotency keys for Avito webhook retries.
+
+Revision ID: 20261019_webhook_dedup
+Revises: 20261019_followup_lease
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "20261019_webhook_dedup"
+down_revision: Union[str, None] = "20261019_followup_lease"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "webhook_deliveries",
+        sa.Column("key", sa.String(128), primary_key=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.text("CURRENT_TIMESTAMP")),
+    )
+    op.create_index("ix_webhook_deliveries_created_at", "webhook_deliveries", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_webhook_deliveries_created_at", table_name="webhook_deliveries")
+    op.drop_table("webhook_deliveries")
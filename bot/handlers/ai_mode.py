@@ -1,5 +1,4 @@
 """Profile-centric AI mode handlers."""
-import json
 import logging
 import re
 from datetime import datetime, timedelta
@@ -9,7 +8,7 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import desc, func, select
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards import (
@@ -28,7 +27,6 @@ from bot.keyboards import (
 )
 from bot.states import AiSettingsStates, AiSellerStates
 from core.database.models import (
-    AIDialogMessage,
     AIDialogState,
     AISettings,
     AvitoProfile,
@@ -37,7 +35,16 @@ from core.database.models import (
     ScheduledFollowup,
     User,
 )
+from core.database.session import release_connection
+from core.followups import notify_followups_created
 from core.llm.client import LLMClient
+from core.llm.context import load_dialog_context
+from core.llm.response_cache import get_response_cache_stats
+from core.llm.segmenter import sentence_group_size, sentence_groups
+from core.services.dialog_limits import LIMIT_DAILY_DIALOGS, LIMIT_PER_MINUTE, dialog_limiter
+from core.services.message_buffer import dialog_messages
+from core.services.phrase_matcher import get_matcher
+from core.services.profile_cache import invalidate_on_commit
 
 logger = logging.getLogger(__name__)
 router = Router(name="ai_mode")
@@ -52,17 +59,6 @@ def _detect_phone(text: str) -> str | None:
     return re.sub(r"\D", "", m.group(0))[-10:] or None
 
 
-def _detect_negative(text: str, ai: AISettings) -> bool:
-    phrases = ["не интересно", "не надо", "не буду", "не хочу"]
-    if ai.negative_phrases:
-        try:
-            phrases.extend(json.loads(ai.negative_phrases))
-        except Exception:
-            pass
-    low = text.lower()
-    return any(p.lower() in low for p in phrases)
-
-
 async def _get_user(telegram_id: int, session: AsyncSession) -> User | None:
     result = await session.execute(select(User).where(User.telegram_id == telegram_id))
     return result.scalar_one_or_none()
@@ -255,6 +251,7 @@ async def cb_ai_set_toggle(callback: CallbackQuery, session: AsyncSession, state
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     profile, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.is_enabled = not ai.is_enabled
     if not ai.is_enabled:
         r = await session.execute(
@@ -349,6 +346,7 @@ async def ai_set_prompt_text(message: Message, session: AsyncSession, state: FSM
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.system_prompt = (message.text or "").strip()
     await state.clear()
     preview = (ai.system_prompt or "").strip()[:300]
@@ -399,6 +397,7 @@ async def cb_ai_set_prompt_tpl_sel(callback: CallbackQuery, session: AsyncSessio
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     tpl = await session.get(PromptTemplate, tpl_id)
     if tpl and tpl.owner_id == callback.from_user.id:
         ai.system_prompt = tpl.content or ""
@@ -448,6 +447,7 @@ async def ai_set_prompt_file_upload(message: Message, session: AsyncSession, sta
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     f = await message.bot.get_file(message.document.file_id)
     content = await message.bot.download_file(f.file_path)
     text = content.read().decode("utf-8", errors="ignore")
@@ -495,6 +495,7 @@ async def cb_ai_set_ctx_all(callback: CallbackQuery, session: AsyncSession) -> N
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.context_mode = "all"
     await callback.message.edit_text(
         "📚 <b>Контекст диалога</b>\n\nТекущий режим: Весь контекст",
@@ -568,6 +569,7 @@ async def ai_set_context_value(message: Message, session: AsyncSession, state: F
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.context_mode = ctx_type
     ai.context_value = n
     await state.clear()
@@ -609,6 +611,7 @@ async def cb_ai_set_fmt_single(callback: CallbackQuery, session: AsyncSession) -
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.message_mode = "single"
     ai.message_sentences_count = None
     await callback.message.edit_text(
@@ -660,6 +663,7 @@ async def ai_set_message_sentences(message: Message, session: AsyncSession, stat
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.message_mode = "by_sentences"
     ai.message_sentences_count = n
     await state.clear()
@@ -728,6 +732,7 @@ async def ai_set_delay_seconds(message: Message, session: AsyncSession, state: F
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.response_delay_seconds = sec
     await state.clear()
     await message.answer(f"✅ Задержка: {sec} сек.", reply_markup=ai_set_delay_kb(profile_id))
@@ -842,6 +847,7 @@ async def ai_set_limit_value(message: Message, session: AsyncSession, state: FSM
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     if key == "dialog":
         ai.per_dialog_message_limit = n
     elif key == "daily":
@@ -913,6 +919,7 @@ async def ai_set_stop_words_msg(message: Message, session: AsyncSession, state:
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.stop_words = (message.text or "").strip() or None
     await state.clear()
     await message.answer("✅ Стоп-слова сохранены.", reply_markup=ai_set_stopwords_kb(profile_id))
@@ -977,6 +984,7 @@ async def ai_set_notify_forward_done(message: Message, session: AsyncSession, st
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.summary_target_chat_id = chat_id
     await state.clear()
     await message.answer(f"✅ Чат уведомлений: {chat_id}.", reply_markup=ai_set_notify_chat_kb(profile_id))
@@ -1019,6 +1027,7 @@ async def cb_ai_set_handoff_toggle_stop(callback: CallbackQuery, session: AsyncS
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.stop_on_employee_message = not ai.stop_on_employee_message
     await callback.answer(f"✅ {'Вкл' if ai.stop_on_employee_message else 'Выкл'} остановку при сообщении сотрудника.")
     await cb_ai_set_handoff(callback, session)
@@ -1036,6 +1045,7 @@ async def cb_ai_set_handoff_toggle_return(callback: CallbackQuery, session: Asyn
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.auto_return_enabled = not ai.auto_return_enabled
     await callback.answer(f"✅ Авто-возврат: {'вкл' if ai.auto_return_enabled else 'выкл'}.")
     await cb_ai_set_handoff(callback, session)
@@ -1083,6 +1093,7 @@ async def ai_set_auto_return_minutes(message: Message, session: AsyncSession, st
         await message.answer("Профиль не найден.")
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.auto_return_minutes = n
     await state.clear()
     await message.answer(f"✅ Время возврата: {n} мин.", reply_markup=ai_set_handoff_kb(profile_id))
@@ -1099,13 +1110,46 @@ async def cb_ai_set_model(callback: CallbackQuery, session: AsyncSession) -> Non
     if not pair:
         await callback.answer("Профиль не найден.", show_alert=True)
         return
+    _, ai = pair
     await callback.message.edit_text(
-        "🤖 <b>Модель</b>\n\nДоступна только gpt-4o-mini.",
-        reply_markup=ai_set_model_kb(profile_id),
+        _model_screen_text(ai),
+        reply_markup=ai_set_model_kb(profile_id, ai.response_cache_enabled),
     )
     await callback.answer()
 
 
+def _model_screen_text(ai: AISettings) -> str:
+    txt = "🤖 <b>Модель</b>\n\nДоступна только gpt-4o-mini."
+    if ai.response_cache_enabled:
+        st = get_response_cache_stats(ai.profile_id)
+        txt += (
+            f"\n\n⚡ Кэш одинаковых вопросов: попаданий {st['hit']}, промахов {st['miss']} "
+            f"({st['hit_rate']:.0%}) с момента запуска."
+        )
+    return txt
+
+
+@router.callback_query(F.data.startswith("ai_set:cache_toggle:"))
+async def cb_ai_set_cache_toggle(callback: CallbackQuery, session: AsyncSession) -> None:
+    try:
+        profile_id = int(callback.data.split(":")[2])
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка.", show_alert=True)
+        return
+    pair = await _get_profile_ai(callback.from_user.id, profile_id, session)
+    if not pair:
+        await callback.answer("Профиль не найден.", show_alert=True)
+        return
+    _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
+    ai.response_cache_enabled = not ai.response_cache_enabled
+    await callback.answer("✅ Кэш включён." if ai.response_cache_enabled else "Кэш выключен.")
+    await callback.message.edit_text(
+        _model_screen_text(ai),
+        reply_markup=ai_set_model_kb(profile_id, ai.response_cache_enabled),
+    )
+
+
 @router.callback_query(F.data.startswith("ai_set:model_confirm:"))
 async def cb_ai_set_model_confirm(callback: CallbackQuery, session: AsyncSession) -> None:
     try:
@@ -1118,12 +1162,13 @@ async def cb_ai_set_model_confirm(callback: CallbackQuery, session: AsyncSession
         await callback.answer("Профиль не найден.", show_alert=True)
         return
     _, ai = pair
+    invalidate_on_commit(session, ai.profile_id)
     ai.model_alias = "gpt-4o-mini"
     await callback.answer("✅ gpt-4o-mini.")
     try:
         await callback.message.edit_text(
-            "🤖 <b>Модель</b>\n\nДоступна только gpt-4o-mini.",
-            reply_markup=ai_set_model_kb(profile_id),
+            _model_screen_text(ai),
+            reply_markup=ai_set_model_kb(profile_id, ai.response_cache_enabled),
         )
     except Exception as e:
         if "not modified" not in str(e).lower():
@@ -1169,18 +1214,17 @@ async def ai_chat_message(message: Message, session: AsyncSession) -> None:
         return
 
     now = datetime.utcnow()
-    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    daily_count = await session.scalar(select(func.count()).select_from(AIDialogMessage).where(AIDialogMessage.profile_id == profile_id, AIDialogMessage.role == "user", AIDialogMessage.created_at >= day_start))
-    if daily_count and daily_count >= ai.daily_dialog_limit and ai.block_on_limit:
+    dialog_id = "default"
+    found = get_matcher(ai).scan(text)
+    # Стоп-слово квоту не расходует; лимиты на диалог и пауза к единственному диалогу тест-чата не применяются
+    limited = None if found.stop_word else await dialog_limiter.acquire(ai, profile_id, dialog_id, now, dialog_limits=False)
+    if limited == LIMIT_DAILY_DIALOGS:
         return
-
-    per_minute_count = await session.scalar(select(func.count()).select_from(AIDialogMessage).where(AIDialogMessage.profile_id == profile_id, AIDialogMessage.role == "user", AIDialogMessage.created_at >= now - timedelta(minutes=1)))
-    if per_minute_count and per_minute_count >= ai.messages_per_minute_limit:
+    if limited == LIMIT_PER_MINUTE:
         await message.answer("Слишком много сообщений. Подождите немного.")
         return
 
-    dialog_id = "default"
-    session.add(AIDialogMessage(user_id=message.from_user.id, profile_id=profile_id, dialog_id=dialog_id, role="user", content=text, created_at=now))
+    dialog_messages.add(user_id=message.from_user.id, profile_id=profile_id, dialog_id=dialog_id, role="user", content=text, created_at=now)
 
     state_row = await session.get(AIDialogState, {"user_id": message.from_user.id, "profile_id": profile_id, "dialog_id": dialog_id})
     just_started = False
@@ -1194,33 +1238,41 @@ async def ai_chat_message(message: Message, session: AsyncSession) -> None:
     if phone:
         state_row.is_converted = True
         state_row.phone_number = phone
-    if _detect_negative(text, ai):
+    if found.negative:
         state_row.has_negative = True
+    if found.stop_word:
+        # Стоп-слово: сообщение остаётся в истории, ИИ на него не отвечает
+        await message.answer(f"🛑 Стоп-слово «{found.stop_word}» — ИИ не отвечает на это сообщение.")
+        return
 
-    await session.commit()
-
-    context_q = select(AIDialogMessage).where(AIDialogMessage.user_id == message.from_user.id, AIDialogMessage.profile_id == profile_id, AIDialogMessage.dialog_id == dialog_id)
-    if ai.context_retention_days:
-        context_q = context_q.where(AIDialogMessage.created_at >= now - timedelta(days=ai.context_retention_days))
-    context_q = context_q.order_by(desc(AIDialogMessage.created_at))
-    if ai.max_messages_in_context:
-        context_q = context_q.limit(ai.max_messages_in_context)
-    ctx = list(reversed((await session.execute(context_q)).scalars().all()))
-    messages = [{"role": "system", "content": ai.system_prompt or ""}] + [{"role": m.role, "content": m.content} for m in ctx]
+    ctx = await load_dialog_context(session, ai, user_id=message.from_user.id, profile_id=profile_id, dialog_id=dialog_id, now=now, state=state_row)
+    messages = ctx.messages
+    # Ответ модели — секунды: состояние диалога фиксируем, соединение возвращаем в пул
+    await release_connection(session)
 
     llm = LLMClient()
-    answer = await llm.generate_reply(ai, messages)
+    group_size = sentence_group_size(ai)
+    if group_size:
+        # Режим «по предложениям»: каждая группа уходит сразу, как только дописана
+        parts = []
+        async for part in sentence_groups(llm.stream_reply(ai, messages, owner_id=message.from_user.id), group_size):
+            await message.answer(part)
+            parts.append(part)
+        answer = " ".join(parts)
+    else:
+        answer = await llm.generate_reply(ai, messages, owner_id=message.from_user.id)
 
-    session.add(AIDialogMessage(user_id=message.from_user.id, profile_id=profile_id, dialog_id=dialog_id, role="assistant", content=answer, created_at=datetime.utcnow()))
-    await session.commit()
+    dialog_messages.add(user_id=message.from_user.id, profile_id=profile_id, dialog_id=dialog_id, role="assistant", content=answer)
 
     if just_started:
         steps = (await session.execute(select(FollowupStep).where(FollowupStep.profile_id == profile_id, FollowupStep.is_active == True).order_by(FollowupStep.order_index.asc()))).scalars().all()
-        for step in steps:
-            session.add(ScheduledFollowup(user_id=message.from_user.id, profile_id=profile_id, step_id=step.id, dialog_id=dialog_id, execute_at=datetime.utcnow() + timedelta(seconds=step.delay_seconds), status="pending", converted=state_row.is_converted, negative_detected=state_row.has_negative))
+        followups = [ScheduledFollowup(user_id=message.from_user.id, profile_id=profile_id, step_id=step.id, dialog_id=dialog_id, execute_at=datetime.utcnow() + timedelta(seconds=step.delay_seconds), status="pending", converted=state_row.is_converted, negative_detected=state_row.has_negative) for step in steps]
+        session.add_all(followups)
         await session.commit()
+        notify_followups_created(followups)
 
     if ai.summary_mode != "off" and (state_row.is_converted or (ai.stop_on_negative and state_row.has_negative)) and ai.summary_target_chat_id:
         await message.bot.send_message(ai.summary_target_chat_id, f"Сводка: профиль={profile_id} конвертирован={state_row.is_converted} негатив={state_row.has_negative}")
 
-    await message.answer(answer)
+    if not group_size:
+        await message.answer(answer)
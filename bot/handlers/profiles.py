@@ -23,6 +23,8 @@ from bot.keyboards import (
 from bot.states import AddProfileStates, DeleteProfileStates
 from core.avito.auth import AvitoAuth
 from core.database.models import User, AvitoProfile, AISettings, ScheduledFollowup
+from core.database.session import release_connection
+from core.services.profile_cache import invalidate_on_commit
 
 logger = logging.getLogger(__name__)
 router = Router(name="profiles")
@@ -245,6 +247,7 @@ async def cb_profile_delete_confirm(
     if profile and profile.owner_id == callback.from_user.id:
         profile_name = profile.profile_name
         await session.delete(profile)
+        invalidate_on_commit(session, profile_id)
         await callback.message.edit_text(
             f"✅ Профиль <b>{profile_name}</b> удалён."
         )
@@ -275,6 +278,8 @@ async def cb_export_messenger(
         )
         return
 
+    # Дальше — только Avito API и Telegram: соединение с БД на это время не держим
+    await release_connection(session)
     await callback.answer("Формирую выгрузку чатов…")
     status_msg = await callback.message.answer("⏳ Загружаю чаты и сообщения из Avito…")
 
@@ -403,6 +408,7 @@ async def cb_profile_ai_toggle(callback: CallbackQuery, session: AsyncSession) -
         session.add(ai)
     else:
         ai.is_enabled = not ai.is_enabled
+    invalidate_on_commit(session, profile_id)
     if not ai.is_enabled:
         rows = await session.execute(select(ScheduledFollowup).where(ScheduledFollowup.profile_id == profile_id, ScheduledFollowup.status == "pending"))
         for item in rows.scalars().all():
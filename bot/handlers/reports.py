@@ -27,6 +27,7 @@ from bot.keyboards import (
 )
 from bot.states import ConfigureReportStates, HistoricalReportStates
 from core.database.models import AvitoProfile, ReportTask
+from core.database.session import release_connection
 from core.report_runner import run_combined_report_to_chat, run_report_to_chat
 from core.scheduler import sync_scheduler_tasks
 
@@ -148,6 +149,8 @@ async def cmd_stats(message: Message, session: AsyncSession) -> None:
         )
         return
 
+    # Отчёт — долгие запросы к Avito API: соединение с БД на это время не держим
+    await release_connection(session)
     sent = await message.answer("📈 Формирую отчёт за вчера…")
 
     profiles = [task.profile for task in tasks if task.profile]
@@ -218,6 +221,8 @@ async def cb_report_now(
         select(ReportTask).where(ReportTask.profile_id == profile_id)
     )
     task = result.scalar_one_or_none()
+    # Отчёт — долгие запросы к Avito API: соединение с БД на это время не держим
+    await release_connection(session)
 
     # Отправляем в чат, указанный в настройках отчёта; если не указан — в текущий (ЛС) с предупреждением
     if task and task.chat_id:
@@ -638,6 +643,7 @@ async def process_historical_end_date(
             pass
 
     await state.clear()
+    await release_connection(session)
     sent = await message.answer(f"📈 Формирую исторический отчёт за период {start} – {end}…")
 
     if message.bot:
@@ -507,9 +507,11 @@ def ai_set_handoff_kb(profile_id: int) -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
-def ai_set_model_kb(profile_id: int) -> InlineKeyboardMarkup:
+def ai_set_model_kb(profile_id: int, cache_enabled: bool = False) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="🤖 gpt-4o-mini (единственный)", callback_data=f"ai_set:model_confirm:{profile_id}"))
+    cache_text = "⚡ Кэш ответов: вкл" if cache_enabled else "⚡ Кэш ответов: выкл"
+    b.row(InlineKeyboardButton(text=cache_text, callback_data=f"ai_set:cache_toggle:{profile_id}"))
     b.row(InlineKeyboardButton(text="⬅ Назад", callback_data=f"ai_set:back_hub:{profile_id}"))
     return b.as_markup()
 
@@ -1,14 +1,19 @@
 """
-Middleware: одна сессия БД на один апдейт.
+Middleware: одна сессия БД на один апдейт; метрики запросов к Telegram Bot API.
 """
 import logging
 from typing import Any, Awaitable, Callable
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
 from aiogram.types import TelegramObject
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.database.session import get_session
+from core.metrics import RATE_LIMITED_TOTAL, TELEGRAM_REQUEST_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +22,8 @@ class DbSessionMiddleware(BaseMiddleware):
     """
     Открывает сессию БД на время обработки апдейта и передаёт её в data["session"].
     Все хендлеры получают один и тот же session для запроса.
+    Перед долгим внешним ожиданием (LLM, Avito API) хендлер вызывает release_connection(session):
+    соединение возвращается в пул, следующий запрос сессии возьмёт его заново.
     """
 
     async def __call__(
@@ -28,3 +35,20 @@ class DbSessionMiddleware(BaseMiddleware):
         async with get_session() as session:
             data["session"] = session
             return await handler(event, data)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Латентность каждого вызова Bot API (sendMessage, editMessageText, ...) и ответы 429."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with TELEGRAM_REQUEST_SECONDS.time(method=type(method).__name__):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter:
+                RATE_LIMITED_TOTAL.inc(service="telegram")
+                raise
@@ -8,6 +8,7 @@ import httpx
 
 from core.database.models import AvitoProfile
 from core.database.session import get_session
+from core.services.profile_cache import invalidate_on_commit
 from core.timezone import utc_now
 
 AVITO_TOKEN_URL = "https://api.avito.ru/token"
@@ -101,6 +102,7 @@ class AvitoAuth:
             if profile:
                 profile.user_id = user_id
                 self._profile.user_id = user_id
+                invalidate_on_commit(session, profile.id)
 
         return user_id
 
@@ -0,0 +1,48 @@
+"""
+Последовательная обработка в пределах одного чата.
+
+Одна «полоса» на ключ (profile_id, chat_id): задачи одного чата идут строго по очереди
+(FIFO), разные чаты — параллельно. Задачу выполняет тот, кто открыл полосу: если чат уже
+занят, новая задача встаёт в цепочку полосы и run() сразу возвращается — воркер очереди
+не простаивает в ожидании чужого чата. Полоса удаляется, как только цепочка опустела —
+память ограничена числом активных чатов.
+"""
+from __future__ import annotations
+
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class ChatLanes:
+    def __init__(self) -> None:
+        self._pending: dict[Hashable, deque[Job]] = {}
+
+    async def run(self, key: Hashable, job: Job) -> bool:
+        """
+        Выполнить job в полосе key. True — выполнено здесь (вместе с задачами, вставшими
+        в цепочку за это время), False — полоса занята, job поставлен в её цепочку.
+        Ошибка задачи логируется и не прерывает цепочку.
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.append(job)
+            return False
+        pending = self._pending[key] = deque([job])
+        try:
+            while pending:
+                job = pending.popleft()
+                try:
+                    await job()
+                except Exception:
+                    logger.exception("ChatLanes: job failed for %s", key)
+        finally:
+            del self._pending[key]
+        return True
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -7,6 +7,8 @@ from typing import Any
 
 import httpx
 
+from core.metrics import AVITO_API_SECONDS, RATE_LIMITED_TOTAL, endpoint_label
+
 AVITO_API_BASE = "https://api.avito.ru"
 
 
@@ -29,13 +31,16 @@ class AvitoClient:
     ) -> dict[str, Any]:
         url = f"{AVITO_API_BASE}{path}"
         async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.request(
-                method,
-                url,
-                headers=self._headers,
-                params=params,
-                json=json,
-            )
+            with AVITO_API_SECONDS.time(endpoint=endpoint_label(path), method=method):
+                resp = await client.request(
+                    method,
+                    url,
+                    headers=self._headers,
+                    params=params,
+                    json=json,
+                )
+            if resp.status_code == 429:
+                RATE_LIMITED_TOTAL.inc(service="avito")
             resp.raise_for_status()
             return resp.json() if resp.content else {}
 
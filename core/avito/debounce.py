@@ -0,0 +1,79 @@
+"""
+Debounce входящих сообщений по чату.
+
+Клиент часто пишет несколько коротких сообщений подряд: каждое новое сообщение
+переносит срабатывание окна (response_delay_seconds), по истечении окна все накопленные
+сообщения отдаются одним вызовом on_fire — один вызов LLM и один ответ на всю серию.
+Окно не растягивается дольше max_wait_seconds от первого сообщения серии.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Window:
+    items: list[Any] = field(default_factory=list)
+    first_at: float = 0.0
+    handle: asyncio.TimerHandle | None = None
+
+
+class ChatDebouncer:
+    def __init__(
+        self,
+        on_fire: Callable[[Hashable, list[Any]], Awaitable[None]],
+        max_wait_seconds: float = 60.0,
+    ) -> None:
+        self._on_fire = on_fire
+        self._max_wait = max_wait_seconds
+        self._windows: dict[Hashable, _Window] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, key: Hashable, item: Any, delay_seconds: float) -> None:
+        """Добавить сообщение в окно чата и перезапустить таймер."""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None:
+            window = _Window(first_at=now)
+            self._windows[key] = window
+        window.items.append(item)
+        if window.handle is not None:
+            window.handle.cancel()
+        delay = max(0.0, float(delay_seconds))
+        deadline = window.first_at + self._max_wait
+        delay = min(delay, max(0.0, deadline - now))
+        window.handle = loop.call_later(delay, self._fire, key)
+
+    def _fire(self, key: Hashable) -> None:
+        window = self._windows.pop(key, None)
+        if window is None or not window.items:
+            return
+        task = asyncio.create_task(self._run(key, window.items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, items: list[Any]) -> None:
+        try:
+            await self._on_fire(key, items)
+        except Exception:
+            logger.exception("ChatDebouncer: handler failed for %s", key)
+
+    def pending_count(self) -> int:
+        return len(self._windows)
+
+    async def flush_all(self) -> None:
+        """Сработать все открытые окна немедленно и дождаться обработчиков (при остановке)."""
+        for key in list(self._windows):
+            window = self._windows.get(key)
+            if window and window.handle is not None:
+                window.handle.cancel()
+            self._fire(key)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
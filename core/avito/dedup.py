@@ -0,0 +1,83 @@
+"""
+Идемпотентность Avito webhook: Avito повторяет доставку, повтор не должен давать
+второй записи в БД, второго вызова LLM и второго ответа клиенту.
+
+Ключ — id сообщения (или sha256 payload). Проверка в два уровня:
+TTL/LRU-набор в памяти, затем таблица webhook_deliveries (переживает рестарт).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from core.database.models import WebhookDelivery
+from core.database.session import get_session
+from core.timezone import utc_now
+
+logger = logging.getLogger(__name__)
+
+# Не чаще раза в N секунд удаляем из БД ключи старше TTL
+_PURGE_INTERVAL_SEC = 600
+
+
+def delivery_key(data: dict[str, Any]) -> str:
+    """Ключ доставки: "<user_id>:<message_id>" или хеш исходного payload."""
+    message_id = data.get("message_id")
+    if message_id:
+        return f"{data.get('user_id')}:{message_id}"[:128]
+    raw = json.dumps(data.get("raw"), sort_keys=True, ensure_ascii=False, default=str)
+    return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DeliveryDedup:
+    def __init__(self, ttl_seconds: int, max_items: int) -> None:
+        self._ttl = ttl_seconds
+        self._max_items = max_items
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._last_purge = 0.0
+
+    def _remember(self, key: str, now: float) -> None:
+        self._seen[key] = now + self._ttl
+        self._seen.move_to_end(key)
+        while len(self._seen) > self._max_items:
+            self._seen.popitem(last=False)
+
+    async def check_and_mark(self, key: str) -> bool:
+        """True — доставка новая (и уже помечена), False — повтор."""
+        now = time.monotonic()
+        expires = self._seen.get(key)
+        if expires is not None and expires > now:
+            return False
+        try:
+            async with get_session() as session:
+                session.add(WebhookDelivery(key=key, created_at=utc_now()))
+        except IntegrityError:
+            self._remember(key, now)
+            return False
+        self._remember(key, now)
+        if now - self._last_purge > _PURGE_INTERVAL_SEC:
+            self._last_purge = now
+            await self._purge()
+        return True
+
+    async def forget(self, key: str) -> None:
+        """Снять отметку (доставка не принята, например 503), чтобы повтор Avito прошёл."""
+        self._seen.pop(key, None)
+        async with get_session() as session:
+            await session.execute(delete(WebhookDelivery).where(WebhookDelivery.key == key))
+
+    async def _purge(self) -> None:
+        cutoff = utc_now() - timedelta(seconds=self._ttl)
+        try:
+            async with get_session() as session:
+                await session.execute(delete(WebhookDelivery).where(WebhookDelivery.created_at < cutoff))
+        except Exception as exc:
+            logger.warning("Webhook dedup purge failed: %s", exc)
@@ -5,6 +5,16 @@ Avito Messenger webhook server (aiohttp).
 - принимает webhook от Avito
 - отвечает 200 OK как можно быстрее
 - обрабатывает сообщение асинхронно: сохраняет в БД, генерирует ответ, отправляет его в чат
+
+Приём ограничен очередью AVITO_WEBHOOK_QUEUE_SIZE, которую разбирают AVITO_WEBHOOK_WORKERS
+воркеров. При переполнении отвечаем 503 (Avito повторит доставку), при остановке сервера
+дожидаемся обработки очереди (AVITO_WEBHOOK_DRAIN_TIMEOUT_SEC).
+
+Серия сообщений клиента в одном чате склеивается (окно AISettings.response_delay_seconds,
+см. core.avito.debounce): одно сообщение → запись в историю, окно закрылось → один ответ.
+Повторные доставки Avito отсекаются до постановки в очередь (core.avito.dedup).
+
+На том же приложении: GET /metrics (Prometheus, core.metrics) и GET /healthz.
 """
 from __future__ import annotations
 
@@ -15,17 +25,41 @@ from datetime import datetime
 from typing import Any
 
 from aiohttp import web
-from sqlalchemy import select
+from sqlalchemy import text
 
 from core.avito.auth import AvitoAuth
+from core.avito.chat_lanes import ChatLanes
 from core.avito.client import AvitoClient
+from core.avito.debounce import ChatDebouncer
+from core.avito.dedup import DeliveryDedup, delivery_key
 from core.config import settings
-from core.database.models import AIDialogMessage, AISettings, AvitoProfile
+from core.database.models import AvitoProfile
 from core.database.session import get_session
+from core.followups import refresh_followup_backlog
+from core.metrics import (
+    WEBHOOK_EVENTS_TOTAL,
+    WEBHOOK_QUEUE_CAPACITY,
+    WEBHOOK_QUEUE_DEPTH,
+    render_metrics,
+)
 from core.llm.client import LLMClient
+from core.llm.context import load_dialog_context
+from core.llm.segmenter import sentence_group_size, sentence_groups
+from core.services.dialog_limits import dialog_limiter
+from core.services.message_buffer import dialog_messages
+from core.services.phrase_matcher import get_matcher
+from core.services.profile_cache import get_webhook_profile
 
 logger = logging.getLogger(__name__)
 
+_queue: asyncio.Queue | None = None
+_workers: list[asyncio.Task] = []
+_stats: dict[str, int] = {"accepted": 0, "rejected": 0, "duplicates": 0, "processed": 0, "failed": 0}
+# /healthz и /metrics не должны зависать вместе с БД
+_HEALTH_DB_TIMEOUT_SEC = 2
+_lanes = ChatLanes()
+_dedup = DeliveryDedup(settings.AVITO_WEBHOOK_DEDUP_TTL_SEC, settings.AVITO_WEBHOOK_DEDUP_MAX_ITEMS)
+
 
 def _extract_payload(request_json: dict[str, Any]) -> dict[str, Any]:
     """
@@ -46,6 +80,7 @@ def _extract_payload(request_json: dict[str, Any]) -> dict[str, Any]:
     msg_type = message.get("type") or message.get("content", {}).get("type")
     direction = message.get("direction")  # in/out
     flow_id = message.get("flow_id")
+    message_id = message.get("id") if message is not data else None
 
     content = message.get("content") or {}
     text = message.get("text") or content.get("text")
@@ -57,12 +92,27 @@ def _extract_payload(request_json: dict[str, Any]) -> dict[str, Any]:
         "msg_type": msg_type,
         "direction": direction,
         "flow_id": flow_id,
+        "message_id": message_id,
         "raw": request_json,
     }
 
 
+def _merge_consecutive(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Склеить подряд идущие сообщения одной роли (серия сообщений клиента = одна реплика)."""
+    merged: list[dict[str, Any]] = []
+    for m in messages:
+        if merged and merged[-1]["role"] == m["role"] and m["role"] != "system":
+            merged[-1] = {"role": m["role"], "content": f"{merged[-1]['content']}\n{m['content']}"}
+        else:
+            merged.append(dict(m))
+    return merged
+
+
 async def _process_message(payload: dict[str, Any]) -> None:
-    """Обработать входящее сообщение Avito и отправить AI-ответ."""
+    """
+    Принять входящее сообщение Avito: сохранить его в историю и поставить чат в окно
+    debounce (AISettings.response_delay_seconds). Ответ генерирует _reply_turn.
+    """
     user_id = payload.get("user_id")
     chat_id = payload.get("chat_id")
     text = (payload.get("text") or "").strip()
@@ -78,77 +128,161 @@ async def _process_message(payload: dict[str, Any]) -> None:
     if msg_type == "system" or flow_id:
         return
 
+    cached = await get_webhook_profile(int(user_id))
+    if cached is None:
+        logger.warning("Webhook: профиль не найден для user_id=%s", user_id)
+        return
+    ai = cached.ai
+    if not ai or not ai.is_enabled:
+        logger.info("Webhook: AI отключён для profile_id=%s", cached.profile_id)
+        return
+
+    # Стоп-слово проверяем до лимитов: такое сообщение не расходует квоту
+    stop_word = get_matcher(ai).scan(text).stop_word
+    limited = None if stop_word else await dialog_limiter.acquire(ai, cached.profile_id, str(chat_id))
+    if limited:
+        # Сверх лимита сообщение не сохраняется: счётчик диалога в БД считает строки role="user"
+        logger.info("Webhook: limit %s for profile_id=%s chat=%s", limited, cached.profile_id, chat_id)
+        return
+
+    # Сохраняем входящее сообщение (write-behind, см. core.services.message_buffer)
+    dialog_messages.add(
+        user_id=cached.owner_id,
+        profile_id=cached.profile_id,
+        dialog_id=str(chat_id),
+        role="user",
+        content=text,
+    )
+    if stop_word:
+        # В историю сообщение попадает, но ответа на него не будет
+        logger.info("Webhook: stop word %r for profile_id=%s chat=%s", stop_word, cached.profile_id, chat_id)
+        return
+    profile_id = cached.profile_id
+    delay = ai.response_delay_seconds or 0
+
+    _debouncer.submit((profile_id, str(chat_id)), text, delay)
+
+
+async def _reply_turn(job: dict[str, Any]) -> None:
+    """
+    Один ответ на серию сообщений чата: история → LLM → отправка в Avito → сохранение.
+    Ответы одного чата сериализуются (ChatLanes), чтобы следующий строился на актуальной истории.
+    Если чат уже отвечает, ответ встаёт в его цепочку и воркер сразу свободен: цепочку
+    дорабатывает воркер, который держит чат (его элемент очереди закрывается после неё).
+    """
+    await _lanes.run((job["profile_id"], job["chat_id"]), lambda: _reply_turn_locked(job))
+
+
+async def _reply_turn_locked(job: dict[str, Any]) -> None:
+    profile_id = job["profile_id"]
+    chat_id = job["chat_id"]
+    # Сессия — только на чтение профиля и истории: на время Avito API и LLM соединение в пуле
     async with get_session() as session:
-        r = await session.execute(
-            select(AvitoProfile).where(AvitoProfile.user_id == int(user_id))
-        )
-        profile = r.scalar_one_or_none()
-        if not profile:
-            logger.warning("Webhook: профиль не найден для user_id=%s", user_id)
+        # Профиль нужен ORM-объектом (AvitoAuth обновляет токен), настройки ИИ — из кэша
+        profile = await session.get(AvitoProfile, profile_id)
+        if not profile or not profile.user_id:
             return
-        ai = await session.get(AISettings, profile.id)
+        cached = await get_webhook_profile(int(profile.user_id))
+        ai = cached.ai if cached is not None and cached.profile_id == profile_id else None
         if not ai or not ai.is_enabled:
-            logger.info("Webhook: AI отключён для profile_id=%s", profile.id)
             return
 
-        # Сохраняем входящее сообщение
-        session.add(
-            AIDialogMessage(
-                user_id=profile.owner_id,
-                profile_id=profile.id,
-                dialog_id=str(chat_id),
-                role="user",
-                content=text,
-            )
+        # Контекст для LLM: окно context_mode/context_value, бюджет токенов, резюме старого
+        ctx = await load_dialog_context(
+            session, ai, user_id=profile.owner_id, profile_id=profile.id, dialog_id=str(chat_id)
         )
+    messages = _merge_consecutive(ctx.messages)
+    user_id = profile.user_id
 
-        # Контекст для LLM (последние N)
-        limit = ai.context_value or 20
-        hist_result = await session.execute(
-            select(AIDialogMessage)
-            .where(
-                AIDialogMessage.profile_id == profile.id,
-                AIDialogMessage.dialog_id == str(chat_id),
-            )
-            .order_by(AIDialogMessage.created_at.desc())
-            .limit(limit)
-        )
-        history = list(reversed(hist_result.scalars().all()))
-        messages: list[dict[str, Any]] = []
-        if ai.system_prompt:
-            messages.append({"role": "system", "content": ai.system_prompt})
-        for m in history:
-            messages.append({"role": m.role, "content": m.content})
+    try:
+        token = await AvitoAuth(profile).ensure_token()
+    except Exception as exc:
+        logger.exception("Webhook: failed to get Avito token (profile_id=%s): %s", profile.id, exc)
+        return
+    client = AvitoClient(token)
+
+    # Генерируем и отправляем ответ в Avito
+    llm = LLMClient()
+    group_size = sentence_group_size(ai)
+    sent: list[str] = []
+    try:
+        if group_size:
+            # Режим «по предложениям»: первая группа уходит, пока модель пишет остальное
+            async for part in sentence_groups(llm.stream_reply(ai, messages, owner_id=profile.owner_id), group_size):
+                await client.send_message_text(int(user_id), chat_id, part)
+                sent.append(part)
+        else:
+            reply = await llm.generate_reply(ai, messages, owner_id=profile.owner_id)
+            await client.send_message_text(int(user_id), chat_id, reply)
+            sent.append(reply)
+        await client.mark_chat_read(int(user_id), chat_id)
+    except Exception as exc:
+        logger.exception("Webhook: failed to send reply (profile_id=%s): %s", profile.id, exc)
+        if not sent:
+            return
+
+    # Сохраняем ответ (в истории — одним сообщением, как его видит модель; write-behind, без сессии)
+    dialog_messages.add(
+        user_id=profile.owner_id,
+        profile_id=profile.id,
+        dialog_id=str(chat_id),
+        role="assistant",
+        content=" ".join(sent),
+    )
+    logger.info(
+        "Webhook: reply sent (profile_id=%s, chat_id=%s, merged=%s, ts=%s)",
+        profile.id,
+        chat_id,
+        job.get("merged", 1),
+        datetime.utcnow().isoformat(),
+    )
 
-        llm = LLMClient()
-        reply = await llm.generate_reply(ai, messages)
 
-        # Отправляем ответ в Avito
+async def _enqueue_reply(key: tuple[int, str], texts: list[Any]) -> None:
+    """Окно debounce закрылось: поставить ответ в общую очередь (ждём место, не теряем)."""
+    profile_id, chat_id = key
+    job = {"kind": "reply", "profile_id": profile_id, "chat_id": chat_id, "merged": len(texts)}
+    if _queue is None:
+        await _reply_turn(job)
+        return
+    await _queue.put(job)
+
+
+_debouncer = ChatDebouncer(_enqueue_reply, max_wait_seconds=settings.AVITO_DEBOUNCE_MAX_WAIT_SEC)
+
+WEBHOOK_QUEUE_DEPTH.set_function(lambda: _queue.qsize() if _queue is not None else 0)
+WEBHOOK_QUEUE_CAPACITY.set_function(lambda: settings.AVITO_WEBHOOK_QUEUE_SIZE)
+WEBHOOK_EVENTS_TOTAL.set_function(lambda: {(outcome,): n for outcome, n in _stats.items()})
+
+
+async def _worker(worker_no: int) -> None:
+    """Воркер очереди: входящие сообщения и ответы по чатам; ошибки не останавливают цикл."""
+    assert _queue is not None
+    while True:
+        data = await _queue.get()
         try:
-            token = await AvitoAuth(profile).ensure_token()
-            client = AvitoClient(token)
-            await client.send_message_text(int(user_id), chat_id, reply)
-            await client.mark_chat_read(int(user_id), chat_id)
+            if data.get("kind") == "reply":
+                await _reply_turn(data)
+            else:
+                await _process_message(data)
+            _stats["processed"] += 1
         except Exception as exc:
-            logger.exception("Webhook: failed to send reply (profile_id=%s): %s", profile.id, exc)
-            return
+            _stats["failed"] += 1
+            logger.exception("Webhook worker %s: processing failed: %s", worker_no, exc)
+        finally:
+            _queue.task_done()
 
-        # Сохраняем ответ
-        session.add(
-            AIDialogMessage(
-                user_id=profile.owner_id,
-                profile_id=profile.id,
-                dialog_id=str(chat_id),
-                role="assistant",
-                content=reply,
-            )
-        )
-        logger.info(
-            "Webhook: reply sent (profile_id=%s, chat_id=%s, ts=%s)",
-            profile.id,
-            chat_id,
-            datetime.utcnow().isoformat(),
-        )
+
+def get_webhook_queue_stats() -> dict[str, int]:
+    """Глубина очереди и счётчики приёма (для логов/метрик)."""
+    return {
+        "depth": _queue.qsize() if _queue is not None else 0,
+        "capacity": settings.AVITO_WEBHOOK_QUEUE_SIZE,
+        "workers": len(_workers),
+        "debounce_windows": _debouncer.pending_count(),
+        "chat_lanes": len(_lanes),
+        **_stats,
+    }
 
 
 async def handle_avito_webhook(request: web.Request) -> web.Response:
@@ -166,10 +300,69 @@ async def handle_avito_webhook(request: web.Request) -> web.Response:
             return web.json_response({"ok": False, "error": "invalid_secret"}, status=403)
 
     data = _extract_payload(payload)
-    asyncio.create_task(_process_message(data))
+    if _queue is None:
+        return web.json_response({"ok": False, "error": "not_ready"}, status=503)
+    if _queue.full():
+        return _overloaded()
+
+    # Повторная доставка Avito: подтверждаем 200, но не обрабатываем
+    key = delivery_key(data)
+    try:
+        is_new = await _dedup.check_and_mark(key)
+    except Exception as exc:
+        logger.warning("Webhook: dedup check failed, processing anyway: %s", exc)
+        is_new = True
+    if not is_new:
+        _stats["duplicates"] += 1
+        return web.json_response({"ok": True, "duplicate": True})
+
+    try:
+        _queue.put_nowait(data)
+    except asyncio.QueueFull:
+        try:
+            await _dedup.forget(key)
+        except Exception as exc:
+            logger.warning("Webhook: dedup forget failed: %s", exc)
+        return _overloaded()
+    _stats["accepted"] += 1
     return web.json_response({"ok": True})
 
 
+async def handle_metrics(request: web.Request) -> web.Response:
+    """GET /metrics — текстовый формат Prometheus."""
+    try:
+        await asyncio.wait_for(refresh_followup_backlog(), timeout=_HEALTH_DB_TIMEOUT_SEC)
+    except Exception as exc:
+        logger.warning("Metrics: follow-up backlog query failed: %s", exc)
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """GET /healthz — 200, если БД отвечает и воркеры очереди живы; иначе 503."""
+    checks: dict[str, Any] = {}
+    try:
+        async with get_session() as session:
+            await asyncio.wait_for(session.execute(text("SELECT 1")), timeout=_HEALTH_DB_TIMEOUT_SEC)
+        checks["db"] = "ok"
+    except Exception as exc:
+        checks["db"] = f"error: {exc.__class__.__name__}"
+    alive = sum(1 for task in _workers if not task.done())
+    checks["workers"] = alive
+    checks["queue"] = get_webhook_queue_stats()
+    ok = checks["db"] == "ok" and alive > 0
+    return web.json_response({"ok": ok, **checks}, status=200 if ok else 503)
+
+
+def _overloaded() -> web.Response:
+    _stats["rejected"] += 1
+    logger.warning("Webhook: queue full (%s), delivery rejected with 503", settings.AVITO_WEBHOOK_QUEUE_SIZE)
+    return web.json_response(
+        {"ok": False, "error": "overloaded"},
+        status=503,
+        headers={"Retry-After": "5"},
+    )
+
+
 async def start_webhook_server() -> web.AppRunner | None:
     """Запуск aiohttp сервера для Avito webhook."""
     if not settings.AVITO_WEBHOOK_ENABLED:
@@ -181,8 +374,15 @@ async def start_webhook_server() -> web.AppRunner | None:
             port = int(env_port)
         except ValueError:
             pass
+    global _queue, _workers
+    _queue = asyncio.Queue(maxsize=max(1, settings.AVITO_WEBHOOK_QUEUE_SIZE))
+    _workers = [
+        asyncio.create_task(_worker(n)) for n in range(max(1, settings.AVITO_WEBHOOK_WORKERS))
+    ]
     app = web.Application()
     app.router.add_post(settings.AVITO_WEBHOOK_PATH, handle_avito_webhook)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/healthz", handle_healthz)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, settings.AVITO_WEBHOOK_HOST, port)
@@ -197,7 +397,32 @@ async def start_webhook_server() -> web.AppRunner | None:
 
 
 async def stop_webhook_server(runner: web.AppRunner | None) -> None:
+    """
+    Остановка по шагам: перестать принимать webhook → дождаться входящих из очереди (они
+    открывают окна debounce) → закрыть все окна → дождаться ответов → остановить воркеров.
+    На оба ожидания — общий таймаут AVITO_WEBHOOK_DRAIN_TIMEOUT_SEC.
+    """
+    global _queue, _workers
     if runner is None:
         return
     await runner.cleanup()
+    if _queue is not None:
+        queue = _queue
+
+        async def drain() -> None:
+            await queue.join()
+            # Открытые окна debounce отвечаем сразу, чтобы не потерять сообщения клиентов;
+            # ответы встают в ту же очередь, воркеры ещё работают
+            await _debouncer.flush_all()
+            await queue.join()
+
+        try:
+            await asyncio.wait_for(drain(), timeout=settings.AVITO_WEBHOOK_DRAIN_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook: drain timeout, %s message(s) dropped", queue.qsize())
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers = []
+    _queue = None
     logger.info("Avito webhook server stopped.")
@@ -22,6 +22,54 @@ class Settings(BaseSettings):
     ADMIN_CHAT_ID: int | None = None
     LLM_API_KEY: str = ""
     OPENAI_API_KEY: str = ""  # альтернатива LLM_API_KEY (стандартное имя в OpenAI)
+    # Общий HTTP-пул клиента OpenAI (один на API-ключ на процесс)
+    LLM_TIMEOUT_SEC: float = 60.0
+    LLM_CONNECT_TIMEOUT_SEC: float = 5.0
+    LLM_MAX_RETRIES: int = 2
+    LLM_MAX_CONNECTIONS: int = 50
+    LLM_KEEPALIVE_SEC: float = 120.0
+    # Кэш ответов LLM (включается per-profile в AISettings.response_cache_enabled)
+    LLM_CACHE_MAX_ITEMS: int = 10000
+    LLM_CACHE_PERSIST: bool = False
+    # Контекст диалога: бюджет токенов (оценка), потолок строк из БД, свёртка старого в резюме
+    LLM_CONTEXT_TOKEN_BUDGET: int = 3000
+    LLM_CONTEXT_MAX_ROWS: int = 200
+    LLM_SUMMARY_MIN_TURNS: int = 6
+    LLM_SUMMARY_MAX_CHARS: int = 1500
+    # Кэш последних реплик диалогов (core.services.dialog_history)
+    DIALOG_CACHE_TURNS: int = 64
+    DIALOG_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    DIALOG_CACHE_IDLE_SEC: int = 3600
+    # Планировщик LLM: общий лимит параллельных запросов, потолок фоновой полосы
+    # (фоллоу-апы, резюме) и квота на владельца (0 = без квоты)
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_BACKGROUND_MAX_CONCURRENCY: int = 8
+    LLM_OWNER_MAX_CONCURRENCY: int = 8
+    # Маршрутизация по задержке: после дедлайна (rolling p95 модели) — запасной запрос
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_DEFAULT_DEADLINE_SEC: float = 8.0  # пока по модели мало замеров
+    LLM_HEDGE_MIN_DEADLINE_SEC: float = 1.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_LATENCY_WINDOW: int = 200
+    LLM_FALLBACK_MODEL: str = "gpt-4o-mini"
+    # Провайдер LLM: auto | openai | echo | simulated (см. core.llm.providers);
+    # LLM_BASE_URL — OpenAI-совместимый сервер вместо api.openai.com
+    LLM_PROVIDER: str = "auto"
+    LLM_BASE_URL: str = ""
+    # Имитация LLM (LLM_PROVIDER=simulated или scripts/llm_sim_server.py)
+    LLM_SIM_LATENCY_MS: float = 800.0  # медиана времени до первого токена
+    LLM_SIM_LATENCY_DISTRIBUTION: str = "lognormal"  # fixed | uniform | lognormal
+    LLM_SIM_LATENCY_SPREAD: float = 0.5
+    LLM_SIM_MODEL_LATENCY_MS: dict[str, float] = {}  # JSON: {"gpt-4.1": 2500}
+    LLM_SIM_TOKENS_PER_SEC: float = 40.0
+    LLM_SIM_REPLY_TOKENS: int = 60
+    LLM_SIM_ERROR_RATE: float = 0.0
+    LLM_SIM_TIMEOUT_RATE: float = 0.0
+    LLM_SIM_CANNED_FILE: str = ""
+    LLM_SIM_SEED: int | None = None
+
+    # Лимиты ИИ-продавца в памяти (core.services.dialog_limits): счётчиков диалогов до вытеснения
+    LIMITER_MAX_DIALOGS: int = 100000
 
     # Worker: retry и таймауты (опционально через env)
     WORKER_STARTUP_TIMEOUT_SEC: int = 60
@@ -30,12 +78,53 @@ class Settings(BaseSettings):
     WORKER_RETRY_BACKOFF_BASE_SEC: int = 5
     WORKER_RETRY_BACKOFF_MAX_SEC: int = 300
 
+    # Несколько реплик worker'а: leases в БД (job_leases) и партиционирование по profile_id
+    WORKER_ID: str = ""  # пусто = hostname:pid
+    WORKER_HEARTBEAT_SEC: int = 15
+    WORKER_LEASE_TTL_SEC: int = 45
+    REPORT_LEASE_TTL_SEC: int = 600
+
+    # Фоллоу-апы ИИ: диспетчер по таймеру (heap) + редкий страховочный опрос БД
+    FOLLOWUP_BATCH_SIZE: int = 100
+    FOLLOWUP_SAFETY_POLL_SEC: int = 300
+    FOLLOWUP_HEAP_HORIZON_SEC: int = 3600
+    FOLLOWUP_HEAP_MAX_ITEMS: int = 50000
+    FOLLOWUP_LLM_CONCURRENCY: int = 8
+    FOLLOWUP_LLM_BATCH_ITEMS: int = 20  # фоллоу-апов одного шага в одном запросе к LLM (1 = без пакетов)
+    FOLLOWUP_SEND_CONCURRENCY: int = 20
+    # Очередь фоллоу-апов: аренда строки, повторы с backoff, dead-letter
+    FOLLOWUP_LEASE_SEC: int = 300
+    FOLLOWUP_MAX_ATTEMPTS: int = 5
+    FOLLOWUP_RETRY_BASE_SEC: int = 60
+    FOLLOWUP_RETRY_MAX_SEC: int = 3600
+
     # Avito webhook server (messenger)
     AVITO_WEBHOOK_ENABLED: bool = False
     AVITO_WEBHOOK_HOST: str = "0.0.0.0"
     AVITO_WEBHOOK_PORT: int = 8000
     AVITO_WEBHOOK_PATH: str = "/avito/webhook"
     AVITO_WEBHOOK_SECRET: str | None = None
+    AVITO_WEBHOOK_QUEUE_SIZE: int = 1000
+    AVITO_WEBHOOK_WORKERS: int = 8
+    AVITO_WEBHOOK_DRAIN_TIMEOUT_SEC: int = 30
+    AVITO_DEBOUNCE_MAX_WAIT_SEC: int = 60  # окно склейки сообщений не дольше N сек от первого
+    AVITO_WEBHOOK_DEDUP_TTL_SEC: int = 86400
+    AVITO_WEBHOOK_DEDUP_MAX_ITEMS: int = 100000
+    # Кэш профиля + AISettings для webhook (TTL — страховка, основная инвалидация явная)
+    PROFILE_CACHE_TTL_SEC: int = 300
+    # Write-behind для ai_dialog_messages: сброс раз в N мс или при N строк
+    DIALOG_BUFFER_FLUSH_MS: int = 200
+    DIALOG_BUFFER_MAX_ROWS: int = 200
+    # Хранение (core.retention): раз в сутки удаляем старые строки пачками, с архивом в gzip JSONL.
+    # Выключено по умолчанию: включённое — безвозвратно удаляет историю диалогов старше
+    # AISettings.context_retention_days (срок не только обрезает контекст LLM)
+    RETENTION_ENABLED: bool = False
+    RETENTION_HOUR: int = 4  # Europe/Moscow
+    RETENTION_DIALOG_DAYS: int = 0  # срок для профилей без context_retention_days; 0 = их не трогать
+    RETENTION_FOLLOWUP_DAYS: int = 30  # sent / canceled / failed / dead; 0 = хранить всё
+    RETENTION_BATCH_SIZE: int = 1000
+    RETENTION_ARCHIVE_DIR: str = "data/archive"  # пусто = удалять без архива
+    RETENTION_PARTITION_MONTHS_AHEAD: int = 2  # PostgreSQL, если ai_dialog_messages партиционирована
 
     @field_validator("ADMIN_CHAT_ID", mode="before")
     @classmethod
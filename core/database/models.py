@@ -6,7 +6,7 @@ Async SQLAlchemy 2.0 models: User, AvitoProfile, ReportTask.
 from datetime import date, datetime, time
 from typing import Optional
 
-from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, Integer, String, Text, Time
+from sqlalchemy import BigInteger, Boolean, Date, DateTime, ForeignKey, Index, Integer, String, Text, Time
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -36,7 +36,7 @@ class AvitoProfile(Base):
     profile_name: Mapped[str] = mapped_column(String(255))
     client_id: Mapped[str] = mapped_column(String(255))
     client_secret: Mapped[str] = mapped_column(String(255))
-    user_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
     access_token: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     token_expires_at: Mapped[Optional[datetime]] = mapped_column(
         DateTime, nullable=True
@@ -137,6 +137,7 @@ class AISettings(Base):
     is_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
     system_prompt: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     model_alias: Mapped[str] = mapped_column(String(40), default="gpt-4o-mini")
+    # Окно контекста LLM; при RETENTION_ENABLED строки старше удаляются из БД (core.retention)
     context_retention_days: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     max_messages_in_context: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
@@ -172,11 +173,19 @@ class AISettings(Base):
     auto_return_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
     auto_return_minutes: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
+    # Кэш ответов LLM по точному совпадению (core.llm.response_cache), выключен по умолчанию
+    response_cache_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
+    response_cache_ttl_seconds: Mapped[int] = mapped_column(Integer, default=86400)
+    response_cache_context_messages: Mapped[int] = mapped_column(Integer, default=1)
+
     profile: Mapped["AvitoProfile"] = relationship("AvitoProfile", back_populates="ai_settings")
 
 
 class AIDialogMessage(Base):
     __tablename__ = "ai_dialog_messages"
+    __table_args__ = (
+        Index("ix_ai_dialog_messages_profile_created", "profile_id", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
@@ -208,6 +217,9 @@ class FollowupStep(Base):
 
 class ScheduledFollowup(Base):
     __tablename__ = "scheduled_followups"
+    __table_args__ = (
+        Index("ix_scheduled_followups_status_execute_at", "status", "execute_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(
@@ -221,9 +233,14 @@ class ScheduledFollowup(Base):
     )
     dialog_id: Mapped[str] = mapped_column(String(255))
     execute_at: Mapped[datetime] = mapped_column(DateTime)
+    # pending | processing | sent | canceled | failed | dead
     status: Mapped[str] = mapped_column(String(20), default="pending")
     converted: Mapped[bool] = mapped_column(Boolean, default=False)
     negative_detected: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Аренда в очереди (см. core.followups): кто обрабатывает и до какого момента (UTC)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    lease_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
 
 class AIDialogState(Base):
@@ -241,6 +258,9 @@ class AIDialogState(Base):
     phone_number: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
     last_client_message_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     ai_paused: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Скользящее резюме старой части диалога (core.llm.context) и до какого сообщения оно доведено
+    context_summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    summary_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
 
 
 class TelegramTarget(Base):
@@ -273,3 +293,34 @@ class TelegramBusinessConnection(Base):
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
     )
+
+
+class JobLease(Base):
+    """
+    Аренда (lease) для нескольких реплик worker'а.
+
+    name = "worker:<id>" — участник кластера (heartbeat), остальное — блокировки джобов.
+    """
+    __tablename__ = "job_leases"
+
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    owner: Mapped[str] = mapped_column(String(255))
+    expires_at: Mapped[datetime] = mapped_column(DateTime)  # UTC
+
+
+class WebhookDelivery(Base):
+    """Ключи уже принятых доставок Avito webhook (идемпотентность между рестартами)."""
+    __tablename__ = "webhook_deliveries"
+
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class LLMResponseCacheEntry(Base):
+    """Сохранённые ответы кэша LLM (LLM_CACHE_PERSIST), переживают рестарт процесса."""
+    __tablename__ = "llm_response_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(100))
+    response: Mapped[str] = mapped_column(Text)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
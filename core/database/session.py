@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_asyn
 
 from core.config import settings
 from core.database.models import Base
+from core.metrics import DB_POOL_CHECKED_OUT, DB_SESSION_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -57,15 +58,37 @@ async_session_factory = async_sessionmaker(
 
 @asynccontextmanager
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_factory() as session:
-        try:
-            yield session
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            raise
-        finally:
-            await session.close()
+    with DB_SESSION_SECONDS.time():
+        async with async_session_factory() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+            finally:
+                await session.close()
+
+
+async def release_connection(session: AsyncSession) -> None:
+    """
+    Зафиксировать изменения сессии и вернуть соединение в пул перед долгим внешним
+    ожиданием (LLM, Avito API), чтобы медленные диалоги не держали пул.
+
+    Загруженные объекты остаются доступны (expire_on_commit=False); следующий запрос
+    через эту сессию возьмёт соединение заново. Ленивые relationship после этого не
+    загружать — как и везде в async.
+    """
+    if session.in_transaction():
+        await session.commit()
+
+
+def _pool_checked_out() -> float:
+    checkedout = getattr(async_engine.pool, "checkedout", None)
+    return float(checkedout()) if callable(checkedout) else 0.0
+
+
+DB_POOL_CHECKED_OUT.set_function(_pool_checked_out)
 
 
 async def init_db() -> None:
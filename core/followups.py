@@ -0,0 +1,561 @@
+"""
+Фоллоу-апы ИИ-продавца: обработка ScheduledFollowup и диспетчер по таймеру.
+
+- process_followups(): берёт пачку наступивших pending-строк (с учётом партиции реплики),
+  генерирует/отправляет сообщения и проставляет статусы.
+- scheduled_followups — очередь с арендой: взятая строка получает status="processing",
+  lease_owner (токен пачки) и lease_expires_at (FOLLOWUP_LEASE_SEC; пока пачка в работе,
+  аренда продлевается каждые FOLLOWUP_LEASE_SEC/3). Строки с истёкшей арендой
+  (реплика упала посреди пачки) забираются заново. Ошибка → повтор с экспоненциальной задержкой
+  (FOLLOWUP_RETRY_BASE_SEC..FOLLOWUP_RETRY_MAX_SEC), после FOLLOWUP_MAX_ATTEMPTS попыток —
+  status="dead". Строка, чья аренда истекла после FOLLOWUP_MAX_ATTEMPTS взятий (реплика
+  падает на ней раз за разом), тоже уходит в "dead", а не берётся снова. Доставка at-least-once: падение между отправкой и записью статуса даст повтор.
+- FollowupDispatcher: min-heap ближайших execute_at в памяти. Загружается из БД при старте,
+  пополняется через notify() при создании фоллоу-апов и просыпается ровно к ближайшему сроку,
+  выбирая все наступившие строки пачками. Heap перечитывается из БД не реже раза в
+  FOLLOWUP_SAFETY_POLL_SEC и сразу после смены партиции (reload()) — страховка для строк,
+  созданных другими репликами, пропущенных heap'ом или перешедших к нам при перебалансировке.
+"""
+import asyncio
+import heapq
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, func, insert, or_, select, update
+
+from core.config import settings
+from core.database.models import AIDialogMessage, AIDialogState, AISettings, FollowupStep, ScheduledFollowup
+from core.database.session import get_session
+from core.leases import WORKER_ID, owns_profile, profile_partition_clause
+from core.llm.client import LLMClient
+from core.metrics import FOLLOWUP_BACKLOG, FOLLOWUP_DISPATCHER_HEAP, RETRIES_TOTAL
+from core.services.dialog_history import dialog_history
+from core.timezone import utc_now
+
+logger = logging.getLogger(__name__)
+
+
+def _lease_expired(now: datetime):
+    return and_(
+        ScheduledFollowup.status == "processing",
+        or_(ScheduledFollowup.lease_expires_at.is_(None), ScheduledFollowup.lease_expires_at <= now),
+    )
+
+
+def _claimable(now: datetime):
+    """Наступившие pending-строки и строки, чья аренда истекла (или не была выставлена), с запасом попыток."""
+    return or_(
+        and_(ScheduledFollowup.status == "pending", ScheduledFollowup.execute_at <= now),
+        and_(_lease_expired(now), ScheduledFollowup.attempts < settings.FOLLOWUP_MAX_ATTEMPTS),
+    )
+
+
+async def _dead_letter_expired(session, now: datetime) -> None:
+    """Аренда истекла, а попытки исчерпаны: результат так и не был записан — в "dead"."""
+    stmt = (
+        update(ScheduledFollowup)
+        .where(_lease_expired(now), ScheduledFollowup.attempts >= settings.FOLLOWUP_MAX_ATTEMPTS)
+        .values(status="dead", lease_owner=None, lease_expires_at=None)
+    )
+    partition = profile_partition_clause(ScheduledFollowup.profile_id)
+    if partition is not None:
+        stmt = stmt.where(partition)
+    dead = (await session.execute(stmt)).rowcount
+    if dead:
+        RETRIES_TOTAL.inc(dead, component="followup_dead")
+        logger.warning("process_followups: dead-lettered %s row(s) with expired lease", dead)
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    """Экспоненциальная задержка повтора с потолком."""
+    seconds = settings.FOLLOWUP_RETRY_BASE_SEC * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, settings.FOLLOWUP_RETRY_MAX_SEC))
+
+
+def _claim_query(now: datetime):
+    """
+    Один запрос на пачку: фоллоу-ап + шаг + настройки ИИ + состояние диалога (outer join).
+    На PostgreSQL строки scheduled_followups блокируются FOR UPDATE SKIP LOCKED.
+    """
+    stmt = (
+        select(ScheduledFollowup, FollowupStep, AISettings, AIDialogState)
+        .outerjoin(FollowupStep, FollowupStep.id == ScheduledFollowup.step_id)
+        .outerjoin(AISettings, AISettings.profile_id == ScheduledFollowup.profile_id)
+        .outerjoin(
+            AIDialogState,
+            and_(
+                AIDialogState.user_id == ScheduledFollowup.user_id,
+                AIDialogState.profile_id == ScheduledFollowup.profile_id,
+                AIDialogState.dialog_id == ScheduledFollowup.dialog_id,
+            ),
+        )
+        .where(_claimable(now))
+        .order_by(ScheduledFollowup.execute_at.asc())
+        .limit(settings.FOLLOWUP_BATCH_SIZE)
+    )
+    partition = profile_partition_clause(ScheduledFollowup.profile_id)
+    if partition is not None:
+        stmt = stmt.where(partition)
+    if settings.DATABASE_URL.startswith("postgresql"):
+        stmt = stmt.with_for_update(skip_locked=True, of=ScheduledFollowup)
+    return stmt
+
+
+async def _save_results(
+    token: str,
+    updates: list[tuple[int, str, int]],
+    assistant_messages: list[dict[str, object]],
+) -> list[tuple[int, datetime]]:
+    """
+    Завершить аренду пачки: один UPDATE ... WHERE id IN (...) на итоговый статус (или на номер
+    попытки для повторов), ответы — один multi-row INSERT. Строки, чью аренду уже забрала
+    другая реплика (lease_owner != token), не трогаем. Возвращает (id, execute_at) повторов.
+    """
+    now = utc_now()
+    final: dict[str, list[int]] = defaultdict(list)
+    retries: dict[int, list[int]] = defaultdict(list)
+    for item_id, status, attempts in updates:
+        if status != "retry":
+            final[status].append(item_id)
+        elif attempts >= settings.FOLLOWUP_MAX_ATTEMPTS:
+            final["dead"].append(item_id)
+        else:
+            retries[attempts].append(item_id)
+
+    rescheduled: list[tuple[int, datetime]] = []
+    async with get_session() as session:
+        for status, ids in final.items():
+            await session.execute(
+                update(ScheduledFollowup)
+                .where(ScheduledFollowup.id.in_(ids), ScheduledFollowup.lease_owner == token)
+                .values(status=status, lease_owner=None, lease_expires_at=None)
+            )
+        for attempts, ids in retries.items():
+            execute_at = now + _retry_delay(attempts)
+            await session.execute(
+                update(ScheduledFollowup)
+                .where(ScheduledFollowup.id.in_(ids), ScheduledFollowup.lease_owner == token)
+                .values(status="pending", execute_at=execute_at, lease_owner=None, lease_expires_at=None)
+            )
+            rescheduled.extend((item_id, execute_at) for item_id in ids)
+        if assistant_messages:
+            await session.execute(insert(AIDialogMessage), assistant_messages)
+    # get_session() закоммитил при выходе из блока: в кэш — только записанные строки
+    for m in assistant_messages:
+        dialog_history.append(
+            (m["user_id"], m["profile_id"], m["dialog_id"]), (m["created_at"], m["role"], m["content"])
+        )
+    if rescheduled:
+        RETRIES_TOTAL.inc(len(rescheduled), component="followup")
+    if final.get("dead"):
+        RETRIES_TOTAL.inc(len(final["dead"]), component="followup_dead")
+        logger.warning("process_followups: dead-lettered ids=%s", final["dead"])
+    return rescheduled
+
+
+async def _keep_lease(token: str, ids: list[int]) -> None:
+    """
+    Продлевать аренду взятых строк, пока пачка в работе: медленная волна (LLM, лимиты Telegram)
+    не должна пережить lease_expires_at, иначе строку заберёт другая реплика и отправит повторно.
+    Продлеваются только ещё не закрытые строки этой пачки (status="processing", lease_owner=token).
+    """
+    interval = max(1.0, settings.FOLLOWUP_LEASE_SEC / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with get_session() as session:
+                await session.execute(
+                    update(ScheduledFollowup)
+                    .where(
+                        ScheduledFollowup.id.in_(ids),
+                        ScheduledFollowup.lease_owner == token,
+                        ScheduledFollowup.status == "processing",
+                    )
+                    .values(lease_expires_at=utc_now() + timedelta(seconds=settings.FOLLOWUP_LEASE_SEC))
+                )
+        except Exception:
+            logger.exception("process_followups: failed to extend lease %s", token)
+
+
+_llm_slots: Optional[asyncio.Semaphore] = None
+_send_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_slots() -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+    """Отдельные лимиты параллельности: вызовы LLM и отправки в Telegram."""
+    global _llm_slots, _send_slots
+    if _llm_slots is None:
+        _llm_slots = asyncio.Semaphore(max(1, settings.FOLLOWUP_LLM_CONCURRENCY))
+    if _send_slots is None:
+        _send_slots = asyncio.Semaphore(max(1, settings.FOLLOWUP_SEND_CONCURRENCY))
+    return _llm_slots, _send_slots
+
+
+class _ResultWriter:
+    """
+    Запись результатов по мере готовности: каждый завершившийся элемент вызывает flush(),
+    а всё, что накопилось за время текущей записи, уходит следующей пачкой (_save_results).
+    """
+
+    def __init__(self, token: str) -> None:
+        self._token = token
+        self._updates: list[tuple[int, str, int]] = []
+        self._messages: list[dict[str, object]] = []
+        self._lock = asyncio.Lock()
+
+    def add(self, item_id: int, status: str, attempts: int, message: Optional[dict[str, object]]) -> None:
+        self._updates.append((item_id, status, attempts))
+        if message is not None:
+            self._messages.append(message)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._updates:
+                return
+            updates, self._updates = self._updates, []
+            messages, self._messages = self._messages, []
+            try:
+                rescheduled = await _save_results(self._token, updates, messages)
+            except Exception:
+                # Вернуть несохранённое в начало: запишется следующим flush()
+                self._updates[:0] = updates
+                self._messages[:0] = messages
+                raise
+        if rescheduled:
+            followup_dispatcher.notify(rescheduled)
+
+
+def _skip_status(item: dict[str, object]) -> Optional[str]:
+    """Статус, с которым элемент закрывается без отправки (нет шага/настроек, не выполнено условие)."""
+    step = item["step"]
+    if step is None or item["ai_settings"] is None:
+        return "failed"
+    converted = bool(item["converted"])
+    negative = bool(item["negative"])
+    if step.send_mode == "if_not_converted" and converted:
+        return "canceled"
+    if step.send_mode == "if_not_converted_and_no_negative" and (converted or negative):
+        return "canceled"
+    return None
+
+
+class _LLMTexts:
+    """
+    Тексты LLM-шагов пачки. Элементы группируются по (профиль, шаг, модель); группа
+    генерируется одним вызовом generate_followups (пакетные запросы, core.llm.batching)
+    при первом обращении любого её элемента.
+    """
+
+    def __init__(self, items: Iterable[dict[str, object]], llm: LLMClient) -> None:
+        self._llm = llm
+        self._groups: dict[tuple[int, int, str], list[dict[str, object]]] = defaultdict(list)
+        self._group_of: dict[int, tuple[int, int, str]] = {}
+        self._tasks: dict[tuple[int, int, str], asyncio.Task] = {}
+        for item in items:
+            if _skip_status(item) is not None or item["step"].content_type != "llm":
+                continue
+            key = (int(item["profile_id"]), int(item["step_id"]), llm.resolve_model(item["ai_settings"].model_alias))
+            self._groups[key].append(item)
+            self._group_of[int(item["id"])] = key
+
+    async def get(self, item: dict[str, object]) -> str:
+        """Текст элемента; ошибка LLM пробрасывается — строка уходит в повтор (run_one)."""
+        key = self._group_of[int(item["id"])]
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.create_task(self._generate(self._groups[key]))
+        # shield: отмена одного элемента не должна отменять генерацию всей группы
+        text = (await asyncio.shield(task))[int(item["id"])]
+        if isinstance(text, BaseException):
+            raise text
+        return text
+
+    async def _generate(self, group: list[dict[str, object]]) -> dict[int, str | BaseException]:
+        llm_slots, _ = _get_slots()
+        first = group[0]
+        contexts = [
+            {
+                "user_id": item["user_id"],
+                "profile_id": item["profile_id"],
+                "step_id": item["step_id"],
+                "dialog_id": item["dialog_id"],
+            }
+            for item in group
+        ]
+        # Слот FOLLOWUP_LLM_CONCURRENCY — на каждый запрос к LLM внутри группы (пакет или повтор)
+        texts = await self._llm.generate_followups(
+            first["ai_settings"],
+            first["step"].content_text or "",
+            contexts,
+            owner_id=int(first["user_id"]),
+            limit=llm_slots,
+        )
+        return {int(item["id"]): text for item, text in zip(group, texts)}
+
+
+async def _execute_item(item: dict[str, object], texts: _LLMTexts, bot) -> tuple[str, Optional[dict[str, object]]]:
+    """Проверить условие шага, получить текст и отправить. Возвращает (статус, ответ для истории)."""
+    skip = _skip_status(item)
+    if skip is not None:
+        return skip, None
+
+    step = item["step"]
+    _, send_slots = _get_slots()
+    text = step.content_text or ""
+    if step.content_type == "llm":
+        text = await texts.get(item)
+
+    async with send_slots:
+        await bot.send_message(chat_id=int(item["user_id"]), text=text)
+    return "sent", {
+        "user_id": int(item["user_id"]),
+        "profile_id": int(item["profile_id"]),
+        "dialog_id": str(item["dialog_id"]),
+        "role": "assistant",
+        "content": text,
+        "created_at": datetime.utcnow(),
+    }
+
+
+async def process_followups() -> int:
+    """
+    Обработать одну пачку наступивших фоллоу-апов. Возвращает число взятых строк
+    (после условного UPDATE — строки, ушедшие другой реплике, не считаются).
+
+    Элементы пачки выполняются параллельно (FOLLOWUP_LLM_CONCURRENCY / FOLLOWUP_SEND_CONCURRENCY),
+    так что медленный LLM-шаг не задерживает текстовые; статус пишется сразу по завершении.
+    LLM-тексты одного шага генерируются пакетными запросами (_LLMTexts).
+    """
+    from core.report_runner import _current_bot
+
+    bot = _current_bot
+    if not bot:
+        return 0
+
+    now = datetime.utcnow()
+    token = f"{WORKER_ID}/{uuid.uuid4().hex[:12]}"
+    items_data: list[dict[str, object]] = []
+
+    async with get_session() as session:
+        await _dead_letter_expired(session, now)
+        rows = (await session.execute(_claim_query(now))).all()
+        if not rows:
+            return 0
+        candidate_ids = [item.id for item, _, _, _ in rows]
+        # Условный UPDATE: без FOR UPDATE (SQLite) строку получит только одна реплика
+        await session.execute(
+            update(ScheduledFollowup)
+            .where(ScheduledFollowup.id.in_(candidate_ids), _claimable(now))
+            .values(
+                status="processing",
+                lease_owner=token,
+                lease_expires_at=now + timedelta(seconds=settings.FOLLOWUP_LEASE_SEC),
+                attempts=ScheduledFollowup.attempts + 1,
+            )
+        )
+        claimed = dict((await session.execute(
+            select(ScheduledFollowup.id, ScheduledFollowup.attempts)
+            .where(ScheduledFollowup.id.in_(candidate_ids), ScheduledFollowup.lease_owner == token)
+        )).all())
+        for item, step, ai_settings, state in rows:
+            if item.id not in claimed:
+                continue
+            items_data.append({
+                "id": item.id,
+                "attempts": claimed[item.id],
+                "user_id": item.user_id,
+                "profile_id": item.profile_id,
+                "step_id": item.step_id,
+                "dialog_id": item.dialog_id,
+                "converted": state.is_converted if state else item.converted,
+                "negative": state.has_negative if state else item.negative_detected,
+                "step": step,
+                "ai_settings": ai_settings,
+            })
+
+    if not items_data:
+        return 0
+
+    texts = _LLMTexts(items_data, LLMClient())
+    writer = _ResultWriter(token)
+    heartbeat = asyncio.create_task(_keep_lease(token, list(claimed)))
+
+    async def run_one(item: dict[str, object]) -> None:
+        item_id = int(item["id"])
+        try:
+            status, message = await _execute_item(item, texts, bot)
+        except Exception:
+            logger.exception("process_followups failed for id=%s (attempt %s)", item_id, item["attempts"])
+            status, message = "retry", None
+        writer.add(item_id, status, int(item["attempts"]), message)
+        try:
+            await writer.flush()
+        except Exception:
+            # Аренда истечёт, и строку заберут повторно
+            logger.exception("process_followups: failed to save results (last id=%s)", item_id)
+
+    try:
+        await asyncio.gather(*(run_one(item) for item in items_data))
+        await writer.flush()
+    finally:
+        heartbeat.cancel()
+    return len(items_data)
+
+
+class FollowupDispatcher:
+    """
+    Таймер фоллоу-апов: heap из (execute_at, id) + одно событие пробуждения.
+
+    Heap — только подсказка «когда проснуться»; сами строки забирает process_followups()
+    из БД, поэтому дубликаты и устаревшие записи в heap безопасны.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[datetime, int]] = []
+        self._wakeup = asyncio.Event()
+        self._drain_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # monotonic-время последней загрузки heap из БД; None — нужна перезагрузка
+        self._loaded_at: Optional[float] = None
+
+    def notify(self, items: Iterable[tuple[int, datetime]]) -> None:
+        """Добавить новые фоллоу-апы (id, execute_at UTC naive); будит цикл, если срок раньше текущего."""
+        head = self._heap[0][0] if self._heap else None
+        earliest: Optional[datetime] = None
+        for followup_id, execute_at in items:
+            heapq.heappush(self._heap, (execute_at, followup_id))
+            if earliest is None or execute_at < earliest:
+                earliest = execute_at
+        if earliest is not None and (head is None or earliest < head):
+            self._wakeup.set()
+
+    async def load(self) -> int:
+        """Перезагрузить heap из БД: pending-строки нашей партиции в пределах горизонта."""
+        horizon = utc_now() + timedelta(seconds=settings.FOLLOWUP_HEAP_HORIZON_SEC)
+        stmt = (
+            select(ScheduledFollowup.id, ScheduledFollowup.execute_at)
+            .where(ScheduledFollowup.status == "pending")
+            .where(ScheduledFollowup.execute_at <= horizon)
+            .order_by(ScheduledFollowup.execute_at.asc())
+            .limit(settings.FOLLOWUP_HEAP_MAX_ITEMS)
+        )
+        partition = profile_partition_clause(ScheduledFollowup.profile_id)
+        if partition is not None:
+            stmt = stmt.where(partition)
+        async with get_session() as session:
+            rows = (await session.execute(stmt)).all()
+        self._heap = [(execute_at, followup_id) for followup_id, execute_at in rows]
+        heapq.heapify(self._heap)
+        self._loaded_at = time.monotonic()
+        self._wakeup.set()
+        return len(self._heap)
+
+    def reload(self) -> None:
+        """Перечитать heap из БД на следующем шаге цикла (сменилась партиция реплики)."""
+        self._loaded_at = None
+        self._wakeup.set()
+
+    def _load_due(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= settings.FOLLOWUP_SAFETY_POLL_SEC
+
+    async def drain(self) -> int:
+        """Выбрать все наступившие фоллоу-апы пачками по FOLLOWUP_BATCH_SIZE."""
+        total = 0
+        async with self._drain_lock:
+            while True:
+                claimed = await process_followups()
+                total += claimed
+                if claimed < settings.FOLLOWUP_BATCH_SIZE:
+                    break
+        return total
+
+    def _pop_due(self, now: datetime) -> int:
+        due = 0
+        while self._heap and self._heap[0][0] <= now:
+            heapq.heappop(self._heap)
+            due += 1
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if self._load_due():
+                try:
+                    await self.load()
+                except Exception:
+                    logger.exception("FollowupDispatcher: reload failed")
+                    self._loaded_at = time.monotonic()  # повторим через FOLLOWUP_SAFETY_POLL_SEC
+            now = utc_now()
+            if self._pop_due(now):
+                try:
+                    await self.drain()
+                except Exception:
+                    logger.exception("FollowupDispatcher: drain failed")
+                continue
+            # Проснуться к ближайшему сроку или к следующей перезагрузке heap
+            timeout = settings.FOLLOWUP_SAFETY_POLL_SEC
+            if self._loaded_at is not None:
+                timeout = max(self._loaded_at + timeout - time.monotonic(), 0.0)
+            if self._heap:
+                timeout = min(timeout, max((self._heap[0][0] - now).total_seconds(), 0.0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self._task and not self._task.done():
+            return
+        try:
+            loaded = await self.load()
+            logger.info("FollowupDispatcher: loaded %s pending follow-up(s).", loaded)
+        except Exception:
+            logger.exception("FollowupDispatcher: initial load failed")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+followup_dispatcher = FollowupDispatcher()
+FOLLOWUP_DISPATCHER_HEAP.set_function(lambda: len(followup_dispatcher))
+
+
+def notify_followups_created(rows: Iterable[ScheduledFollowup]) -> None:
+    """Сообщить диспетчеру о только что созданных (и закоммиченных) ScheduledFollowup своей партиции."""
+    followup_dispatcher.notify(
+        (row.id, row.execute_at) for row in rows if row.id is not None and owns_profile(row.profile_id)
+    )
+
+
+async def run_followup_safety_poll() -> None:
+    """Страховочный опрос БД (джоб каждой реплики): обновить heap и добрать наступившие."""
+    await followup_dispatcher.load()
+    await followup_dispatcher.drain()
+
+
+async def refresh_followup_backlog() -> int:
+    """Число наступивших, но не отправленных фоллоу-апов (для /metrics)."""
+    async with get_session() as session:
+        backlog = (await session.execute(
+            select(func.count()).select_from(ScheduledFollowup).where(
+                ScheduledFollowup.status == "pending",
+                ScheduledFollowup.execute_at <= utc_now(),
+            )
+        )).scalar_one()
+    FOLLOWUP_BACKLOG.set(backlog)
+    return backlog
@@ -0,0 +1,131 @@
+"""
+DB-backed leases для нескольких реплик worker'а.
+
+- try_acquire_lease(name, ttl): атомарный захват строки job_leases (условный UPDATE,
+  затем INSERT). Работает одинаково на PostgreSQL и SQLite, без advisory locks.
+- Участники кластера: каждая реплика продлевает lease "worker:<WORKER_ID>" (heartbeat).
+  Живые участники сортируются по id → (index, count) этой реплики.
+- Партиционирование по profile_id: реплика обрабатывает профили, где
+  profile_id % count == index (см. owns_profile / profile_partition_clause).
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Any, Optional
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from core.config import settings
+from core.database.models import JobLease
+from core.database.session import get_session
+from core.timezone import utc_now
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = (settings.WORKER_ID or "").strip() or f"{socket.gethostname()}:{os.getpid()}"
+MEMBER_LEASE_PREFIX = "worker:"
+LEADER_LEASE = "leader"
+
+# (index, count) текущей реплики; до первого heartbeat — обрабатываем всё
+_partition: tuple[int, int] = (0, 1)
+
+
+async def try_acquire_lease(name: str, ttl_seconds: int, owner: str = WORKER_ID) -> bool:
+    """
+    Захватить или продлить lease. True — lease наш до now + ttl_seconds.
+    Чужой неистёкший lease не перехватывается.
+    """
+    now = utc_now()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    async with get_session() as session:
+        result = await session.execute(
+            update(JobLease)
+            .where(JobLease.name == name)
+            .where(or_(JobLease.owner == owner, JobLease.expires_at <= now))
+            .values(owner=owner, expires_at=expires_at)
+        )
+        if result.rowcount:
+            return True
+        exists = await session.scalar(select(JobLease.name).where(JobLease.name == name))
+        if exists is not None:
+            return False
+    try:
+        async with get_session() as session:
+            session.add(JobLease(name=name, owner=owner, expires_at=expires_at))
+    except IntegrityError:
+        # Другая реплика вставила строку раньше нас
+        return False
+    return True
+
+
+async def release_lease(name: str, owner: str = WORKER_ID) -> None:
+    """Отпустить lease, если он принадлежит owner."""
+    async with get_session() as session:
+        await session.execute(
+            delete(JobLease).where(JobLease.name == name, JobLease.owner == owner)
+        )
+
+
+async def heartbeat() -> tuple[int, int]:
+    """
+    Продлить членство этой реплики и пересчитать партицию.
+    Вызывается планировщиком каждые WORKER_HEARTBEAT_SEC.
+    """
+    global _partition
+    await try_acquire_lease(f"{MEMBER_LEASE_PREFIX}{WORKER_ID}", settings.WORKER_LEASE_TTL_SEC)
+    now = utc_now()
+    async with get_session() as session:
+        rows = await session.execute(
+            select(JobLease.owner)
+            .where(JobLease.name.like(f"{MEMBER_LEASE_PREFIX}%"))
+            .where(JobLease.expires_at > now)
+        )
+        members = sorted({owner for owner in rows.scalars().all()})
+    if WORKER_ID not in members:
+        members = sorted(members + [WORKER_ID])
+    new_partition = (members.index(WORKER_ID), len(members))
+    if new_partition != _partition:
+        logger.info(
+            "Worker %s: partition %s/%s (members: %s)",
+            WORKER_ID,
+            new_partition[0],
+            new_partition[1],
+            ", ".join(members),
+        )
+    _partition = new_partition
+    return _partition
+
+
+async def leave_cluster() -> None:
+    """Снять членство при остановке, чтобы остальные реплики сразу забрали профили."""
+    global _partition
+    try:
+        await release_lease(f"{MEMBER_LEASE_PREFIX}{WORKER_ID}")
+    except Exception as exc:
+        logger.warning("leave_cluster failed: %s", exc)
+    _partition = (0, 1)
+
+
+def get_partition() -> tuple[int, int]:
+    return _partition
+
+
+def owns_profile(profile_id: int) -> bool:
+    """Принадлежит ли profile_id партиции этой реплики."""
+    index, count = _partition
+    return count <= 1 or profile_id % count == index
+
+
+def profile_partition_clause(column: Any) -> Optional[Any]:
+    """SQL-условие для колонки profile_id (None — одна реплика, фильтр не нужен)."""
+    index, count = _partition
+    if count <= 1:
+        return None
+    return column % count == index
+
+
+async def is_leader() -> bool:
+    """Лидер кластера — владелец lease "leader" (для джобов, которые должны идти в одном месте)."""
+    return await try_acquire_lease(LEADER_LEASE, settings.WORKER_LEASE_TTL_SEC)
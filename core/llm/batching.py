@@ -0,0 +1,51 @@
+"""
+Пакетная генерация фоллоу-апов: N диалогов одного шага — один запрос к LLM.
+
+Модели уходит промпт шага и список элементов [{"id": i, "context": {...}}]; ответ —
+JSON {"items": [{"id": i, "text": "..."}]}. Разбор поэлементный: элемент без валидного
+текста (битый JSON, пропущенный id, пустой текст) генерируется отдельным запросом.
+"""
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Sequence
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+BATCH_INSTRUCTION = (
+    "Сгенерируй отдельное сообщение для каждого элемента из списка пользователя, "
+    "учитывая его контекст. Ответь только JSON без пояснений: "
+    '{"items": [{"id": <id элемента>, "text": "<сообщение>"}]} — по одному объекту на каждый id.'
+)
+
+
+def build_batch_messages(content_text: str, contexts: Sequence[dict[str, Any]]) -> list[dict[str, str]]:
+    items = [{"id": idx, "context": ctx} for idx, ctx in enumerate(contexts)]
+    return [
+        {"role": "system", "content": f"{content_text or 'Сгенерируй follow-up'}\n\n{BATCH_INSTRUCTION}"},
+        {"role": "user", "content": json.dumps({"items": items}, ensure_ascii=False, default=str)},
+    ]
+
+
+def parse_batch_reply(raw: str, count: int) -> dict[int, str]:
+    """{id: текст} для элементов 0..count-1, которые удалось разобрать; остальные отсутствуют."""
+    try:
+        data = json.loads(_FENCE.sub("", raw.strip()))
+    except (TypeError, ValueError):
+        return {}
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return {}
+    result: dict[int, str] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            idx = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        text = item.get("text")
+        if 0 <= idx < count and idx not in result and isinstance(text, str) and text.strip():
+            result[idx] = text.strip()
+    return result
@@ -3,65 +3,263 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import logging
-from typing import Any, Sequence
+import time
+from typing import Any, AsyncIterator, Callable, Hashable, Sequence
 
 from core.config import LLM_MODEL_MAP, get_llm_api_key, settings
 from core.database.models import AISettings
+from core.llm.batching import build_batch_messages, parse_batch_reply
+# close_llm_clients / get_openai_client исторически импортируются отсюда
+from core.llm.providers import (  # noqa: F401
+    EchoProvider,
+    LLMProvider,
+    close_llm_clients,
+    get_openai_client,
+    get_provider,
+)
+from core.llm.response_cache import cache_key, response_cache
+from core.llm.routing import BackupSlot, hedged_call, hedged_stream
+from core.llm.scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, llm_scheduler
+from core.metrics import LLM_BATCH_ITEMS_TOTAL, LLM_ERRORS_TOTAL, LLM_REQUEST_SECONDS, RATE_LIMITED_TOTAL
 
 logger = logging.getLogger(__name__)
 
 
 class LLMClient:
-    def __init__(self, api_key: str | None = None) -> None:
+    def __init__(self, api_key: str | None = None, provider: LLMProvider | None = None) -> None:
         self.api_key = (api_key or get_llm_api_key()).strip()
+        self.provider = provider or get_provider(self.api_key)
 
     def resolve_model(self, model_alias: str) -> str:
         if model_alias == "gpt-4o-mini":
             return "gpt-4o-mini"
         return LLM_MODEL_MAP.get(model_alias, "gpt-4o-mini")
 
-    async def _stub_call(self, model: str, messages: Sequence[dict[str, Any]]) -> str:
-        await asyncio.sleep(0)
-        last_user = ""
-        for m in reversed(messages):
-            if m.get("role") == "user":
-                last_user = str(m.get("content", ""))
-                break
-        return f"[{model}] {last_user}\n\n(stub LLM response)"
-
-    async def _openai_call(self, model: str, messages: Sequence[dict[str, Any]]) -> str:
-        from openai import AsyncOpenAI
-        client = AsyncOpenAI(api_key=self.api_key)
-        resp = await client.chat.completions.create(
-            model=model,
-            messages=[{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in messages],
+    @staticmethod
+    def _count_error(model: str, exc: Exception) -> None:
+        LLM_ERRORS_TOTAL.inc(model=model)
+        if getattr(exc, "status_code", None) == 429:
+            RATE_LIMITED_TOTAL.inc(service="llm")
+
+    async def _call(self, model: str, messages: Sequence[dict[str, Any]]) -> str:
+        try:
+            with LLM_REQUEST_SECONDS.time(model=model):
+                return await self.provider.complete(model, messages)
+        except Exception as exc:
+            self._count_error(model, exc)
+            raise
+
+    async def _stream(self, model: str, messages: Sequence[dict[str, Any]]) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        try:
+            async for delta in self.provider.stream(model, messages):
+                yield delta
+        except Exception as exc:
+            self._count_error(model, exc)
+            raise
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, model=model)
+
+    @staticmethod
+    def _owner(ai_settings: AISettings, owner_id: int | None) -> Hashable:
+        """Ключ квоты в планировщике: владелец профиля, если известен, иначе сам профиль."""
+        return owner_id if owner_id is not None else ("profile", ai_settings.profile_id)
+
+    @staticmethod
+    def _backup_slot(owner: Hashable, lane: str) -> BackupSlot:
+        """Запасной hedged-запрос — в отдельном слоте планировщика того же владельца."""
+        def take() -> Callable[[], None] | None:
+            if not llm_scheduler.try_acquire(owner, lane):
+                return None
+            return lambda: llm_scheduler.release(owner, lane)
+        return take
+
+    @staticmethod
+    def _cache_key(ai_settings: AISettings, model: str, messages: Sequence[dict[str, Any]]) -> str | None:
+        if not getattr(ai_settings, "response_cache_enabled", False):
+            return None
+        return cache_key(
+            ai_settings.profile_id, model, messages, getattr(ai_settings, "response_cache_context_messages", 1) or 1
         )
-        if not resp.choices:
-            return "⚠️ Пустой ответ от модели."
-        return (resp.choices[0].message.content or "").strip()
 
-    async def generate_reply(self, ai_settings: AISettings, messages: Sequence[dict[str, Any]]) -> str:
+    async def _cache_put(self, ai_settings: AISettings, key: str | None, model: str, reply: str) -> None:
+        if key is not None:
+            ttl = getattr(ai_settings, "response_cache_ttl_seconds", 0) or 0
+            await response_cache.put(key, model, reply, ttl)
+
+    async def generate_reply(
+        self,
+        ai_settings: AISettings,
+        messages: Sequence[dict[str, Any]],
+        owner_id: int | None = None,
+    ) -> str:
         model = self.resolve_model(ai_settings.model_alias)
+        key = self._cache_key(ai_settings, model, messages)
+        if key is not None:
+            cached = await response_cache.get(key, ai_settings.profile_id, model)
+            if cached is not None:
+                return cached
+        owner = self._owner(ai_settings, owner_id)
         try:
-            if self.api_key:
-                return await self._openai_call(model, messages)
-            logger.warning("LLM_API_KEY не задан, используется stub для профиля %s", ai_settings.profile_id)
-            return await self._stub_call(model, messages)
+            async with llm_scheduler.slot(owner, LANE_INTERACTIVE):
+                # Не уложились в p95 модели — запасной запрос (в своём слоте), ответ берётся от первого
+                reply = await hedged_call(
+                    model, lambda m: self._call(m, messages), self._backup_slot(owner, LANE_INTERACTIVE)
+                )
         except Exception as exc:
             logger.exception("generate_reply failed for profile_id=%s: %s", ai_settings.profile_id, exc)
             return "⚠️ Не удалось получить ответ от LLM."
+        await self._cache_put(ai_settings, key, model, reply)
+        return reply
+
+    async def stream_reply(
+        self,
+        ai_settings: AISettings,
+        messages: Sequence[dict[str, Any]],
+        owner_id: int | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Ответ по частям (дельты текста) по мере генерации. Ошибка до первой дельты даёт
+        то же сообщение-заглушку, что generate_reply; ошибка посреди ответа — обрыв потока.
+        """
+        model = self.resolve_model(ai_settings.model_alias)
+        key = self._cache_key(ai_settings, model, messages)
+        if key is not None:
+            cached = await response_cache.get(key, ai_settings.profile_id, model)
+            if cached is not None:
+                yield cached
+                return
+        owner = self._owner(ai_settings, owner_id)
+        stream = hedged_stream(
+            model, lambda m: self._stream(m, messages), self._backup_slot(owner, LANE_INTERACTIVE)
+        )
+        parts: list[str] = []
+        try:
+            # Слот занят, пока идёт поток
+            async with llm_scheduler.slot(owner, LANE_INTERACTIVE):
+                async for delta in stream:
+                    parts.append(delta)
+                    yield delta
+        except Exception as exc:
+            logger.exception("stream_reply failed for profile_id=%s: %s", ai_settings.profile_id, exc)
+            if not parts:
+                yield "⚠️ Не удалось получить ответ от LLM."
+            return
+        await self._cache_put(ai_settings, key, model, "".join(parts).strip())
 
-    async def generate_followup(self, ai_settings: AISettings, content_text: str, context_data: dict[str, Any]) -> str:
+    async def summarize_dialog(
+        self,
+        ai_settings: AISettings,
+        previous_summary: str | None,
+        turns: Sequence[tuple[str, str]],
+        max_chars: int,
+        owner_id: int | None = None,
+    ) -> str | None:
+        """Свернуть старые реплики (role, content) в резюме диалога; None при ошибке."""
+        model = self.resolve_model(ai_settings.model_alias)
+        transcript = "\n".join(
+            f"{'Клиент' if role == 'user' else 'Продавец'}: {content}" for role, content in turns
+        )
+        if isinstance(self.provider, EchoProvider):
+            # Без модели — механическое резюме: хвост переписки в пределах лимита
+            text = f"{previous_summary}\n{transcript}" if previous_summary else transcript
+            return text[-max_chars:]
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "Сожми переписку продавца с клиентом в краткое резюме "
+                    f"(не больше {max_chars} символов): что спрашивал клиент, что ему ответили, "
+                    "договорённости, контакты. Только факты, без вступлений."
+                ),
+            },
+            {
+                "role": "user",
+                "content": (f"Предыдущее резюме:\n{previous_summary}\n\n" if previous_summary else "")
+                + f"Новые сообщения:\n{transcript}",
+            },
+        ]
+        try:
+            async with llm_scheduler.slot(self._owner(ai_settings, owner_id), LANE_BACKGROUND):
+                summary = await self._call(model, messages)
+        except Exception as exc:
+            logger.exception("summarize_dialog failed for profile_id=%s: %s", ai_settings.profile_id, exc)
+            return None
+        return summary[:max_chars] or None
+
+    async def generate_followup(
+        self,
+        ai_settings: AISettings,
+        content_text: str,
+        context_data: dict[str, Any],
+        owner_id: int | None = None,
+        raise_on_error: bool = False,
+    ) -> str:
+        """raise_on_error=True — ошибка LLM пробрасывается (очередь фоллоу-апов уводит строку в повтор)."""
         model = self.resolve_model(ai_settings.model_alias)
         messages = [
             {"role": "system", "content": content_text or "Сгенерируй follow-up"},
             {"role": "user", "content": f"Контекст: {context_data!r}"},
         ]
         try:
-            if self.api_key:
-                return await self._openai_call(model, messages)
-            return await self._stub_call(model, messages)
+            async with llm_scheduler.slot(self._owner(ai_settings, owner_id), LANE_BACKGROUND):
+                return await self._call(model, messages)
         except Exception as exc:
             logger.exception("generate_followup failed for profile_id=%s: %s", ai_settings.profile_id, exc)
+            if raise_on_error:
+                raise
             return "⚠️ Не удалось сгенерировать follow-up сообщение."
+
+    async def generate_followups(
+        self,
+        ai_settings: AISettings,
+        content_text: str,
+        contexts: Sequence[dict[str, Any]],
+        owner_id: int | None = None,
+        limit: asyncio.Semaphore | None = None,
+    ) -> list[str | BaseException]:
+        """
+        Фоллоу-апы одного шага для нескольких диалогов: по FOLLOWUP_LLM_BATCH_ITEMS в запросе
+        (core.llm.batching). Элементы, которые не удалось разобрать, генерируются по одному.
+        На месте элемента, для которого LLM так и не ответил, — исключение: текст-заглушку
+        клиенту не отправляем, строка уходит в повтор.
+
+        limit — семафор вызывающего (FOLLOWUP_LLM_CONCURRENCY): берётся на каждый запрос
+        к LLM (пакет или одиночный), а не на всю группу.
+        """
+        batch_size = max(1, settings.FOLLOWUP_LLM_BATCH_ITEMS)
+        request_slot = limit if limit is not None else contextlib.nullcontext()
+
+        async def single(ctx: dict[str, Any]) -> str:
+            async with request_slot:
+                return await self.generate_followup(
+                    ai_settings, content_text, ctx, owner_id=owner_id, raise_on_error=True
+                )
+
+        if len(contexts) < 2 or batch_size < 2 or isinstance(self.provider, EchoProvider):
+            return list(await asyncio.gather(*(single(ctx) for ctx in contexts), return_exceptions=True))
+        model = self.resolve_model(ai_settings.model_alias)
+        texts: list[str | BaseException | None] = [None] * len(contexts)
+
+        async def run_batch(start: int) -> None:
+            chunk = contexts[start:start + batch_size]
+            try:
+                async with request_slot, llm_scheduler.slot(self._owner(ai_settings, owner_id), LANE_BACKGROUND):
+                    raw = await self._call(model, build_batch_messages(content_text, chunk))
+            except Exception as exc:
+                logger.warning("generate_followups batch failed for profile_id=%s: %s", ai_settings.profile_id, exc)
+                return
+            for idx, text in parse_batch_reply(raw, len(chunk)).items():
+                texts[start + idx] = text
+
+        await asyncio.gather(*(run_batch(start) for start in range(0, len(contexts), batch_size)))
+        missing = [idx for idx, text in enumerate(texts) if text is None]
+        LLM_BATCH_ITEMS_TOTAL.inc(len(contexts) - len(missing), result="batched")
+        if missing:
+            LLM_BATCH_ITEMS_TOTAL.inc(len(missing), result="fallback")
+            fallback = await asyncio.gather(*(single(contexts[idx]) for idx in missing), return_exceptions=True)
+            for idx, text in zip(missing, fallback):
+                texts[idx] = text
+        return [text if text is not None else "" for text in texts]
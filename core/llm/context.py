@@ -0,0 +1,211 @@
+"""
+Контекст диалога для LLM в пределах бюджета токенов.
+
+Окно истории задаётся AISettings (context_mode: last_n / time_window / all, плюс
+max_messages_in_context и context_retention_days тест-чата). Внутри окна сообщения
+добираются от новых к старым, пока помещаются в LLM_CONTEXT_TOKEN_BUDGET (оценка токенов
+локальная, без токенизатора). Что не поместилось, сворачивается в фоне в резюме диалога
+(AIDialogState.context_summary / summary_until) — оно идёт в промпт вместо старых реплик,
+так что размер промпта не растёт с длиной переписки.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Optional, Sequence
+
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database.models import AIDialogMessage, AIDialogState, AISettings
+from core.database.session import get_session
+from core.leases import get_partition
+from core.llm.client import LLMClient
+from core.services.dialog_history import dialog_history
+from core.services.message_buffer import dialog_messages, merge_rows
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены на сообщение (роль, разделители) в формате chat completions
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+Turn = tuple[datetime, str, str]  # (created_at, role, content)
+DialogKey = tuple[int, int, str]  # (user_id, profile_id, dialog_id)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка сверху: ~4 байта UTF-8 на токен (кириллица ≈ 2 символа на токен)."""
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def _message_tokens(content: str) -> int:
+    return estimate_tokens(content) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def history_window(ai: AISettings, now: datetime) -> tuple[Optional[int], Optional[datetime]]:
+    """(макс. число сообщений, не раньше чем) по настройкам контекста профиля."""
+    limit: Optional[int] = None
+    since: Optional[datetime] = None
+    mode = getattr(ai, "context_mode", None) or "last_n"
+    value = getattr(ai, "context_value", None)
+    if mode == "last_n":
+        limit = value or 20
+    elif mode == "time_window" and value:
+        since = now - timedelta(hours=value)
+    if ai.max_messages_in_context:
+        limit = min(limit, ai.max_messages_in_context) if limit else ai.max_messages_in_context
+    if ai.context_retention_days:
+        retention = now - timedelta(days=ai.context_retention_days)
+        since = max(since, retention) if since else retention
+    return limit, since
+
+
+@dataclass
+class DialogContext:
+    messages: list[dict[str, Any]]
+    tokens: int
+    # Реплики окна, не вошедшие в бюджет (старые → новые): кандидаты в резюме
+    folded: list[Turn] = field(default_factory=list)
+
+
+def fit_to_budget(
+    system_prompt: Optional[str],
+    summary: Optional[str],
+    turns: Sequence[Turn],
+    budget: int,
+) -> DialogContext:
+    """Системный промпт + резюме + самые новые реплики, пока помещаются в budget."""
+    head: list[dict[str, Any]] = []
+    if system_prompt:
+        head.append({"role": "system", "content": system_prompt})
+    if summary:
+        # summary=True: своё у каждого диалога, в ключ кэша ответов не входит (core.llm.response_cache)
+        head.append({
+            "role": "system",
+            "content": f"Краткое содержание предыдущей части диалога:\n{summary}",
+            "summary": True,
+        })
+    used = sum(_message_tokens(m["content"]) for m in head)
+    kept: list[Turn] = []
+    folded: list[Turn] = []
+    for idx in range(len(turns) - 1, -1, -1):
+        cost = _message_tokens(turns[idx][2])
+        # Последнее сообщение клиента берём всегда, даже если оно одно не помещается
+        if kept and used + cost > budget:
+            folded = list(turns[: idx + 1])
+            break
+        kept.append(turns[idx])
+        used += cost
+    kept.reverse()
+    return DialogContext(
+        messages=head + [{"role": role, "content": content} for _, role, content in kept],
+        tokens=used,
+        folded=folded,
+    )
+
+
+async def _load_turns(
+    session: AsyncSession,
+    key: DialogKey,
+    lower: Optional[datetime],
+    limit: int,
+) -> list[Turn]:
+    """Последние limit реплик новее lower из БД + write-behind буфера."""
+    user_id, profile_id, dialog_id = key
+    # Снимок буфера до запроса (см. core.services.message_buffer)
+    pending = dialog_messages.pending_messages(user_id, profile_id, dialog_id)
+    q = select(AIDialogMessage).where(
+        AIDialogMessage.user_id == user_id,
+        AIDialogMessage.profile_id == profile_id,
+        AIDialogMessage.dialog_id == dialog_id,
+    )
+    if lower is not None:
+        q = q.where(AIDialogMessage.created_at > lower)
+    rows = (await session.execute(q.order_by(desc(AIDialogMessage.created_at)).limit(limit))).scalars().all()
+    return [t for t in merge_rows(rows, pending, limit) if lower is None or t[0] > lower]
+
+
+async def load_dialog_context(
+    session: AsyncSession,
+    ai: AISettings,
+    *,
+    user_id: int,
+    profile_id: int,
+    dialog_id: str,
+    now: Optional[datetime] = None,
+    state: Optional[AIDialogState] = None,
+) -> DialogContext:
+    """Собрать контекст диалога (история из БД + write-behind буфер + резюме) и, если нужно, обновить резюме."""
+    now = now or datetime.utcnow()
+    if state is None:
+        state = await session.get(AIDialogState, {"user_id": user_id, "profile_id": profile_id, "dialog_id": dialog_id})
+    limit, since = history_window(ai, now)
+    summary = state.context_summary if state is not None else None
+    summary_until = state.summary_until if state is not None else None
+    if summary and since and summary_until and summary_until < since:
+        # Резюме целиком старше окна time_window/retention — в промпт не идёт
+        summary, summary_until = None, None
+    lower = max(filter(None, (since, summary_until)), default=None)
+
+    max_rows = min(limit, settings.LLM_CONTEXT_MAX_ROWS) if limit else settings.LLM_CONTEXT_MAX_ROWS
+    key = (user_id, profile_id, dialog_id)
+    turns: Optional[list[Turn]] = None
+    if get_partition()[1] > 1:
+        # Несколько живых реплик: строки, записанные другими процессами, в наше кольцо не попадают.
+        # Кэш не используем и сбрасываем, чтобы после ухода соседей не отдать устаревшее кольцо.
+        dialog_history.invalidate()
+    else:
+        # Активный диалог — из кэша последних реплик, без запроса к БД
+        if key not in dialog_history:
+            await dialog_history.fill(key, lambda n: _load_turns(session, key, None, n))
+        turns = dialog_history.recent(key, lower, max_rows)
+    if turns is None:
+        # Окно шире кольца кэша (time_window / all на длинном диалоге)
+        turns = await _load_turns(session, key, lower, max_rows)
+
+    ctx = fit_to_budget(ai.system_prompt, summary, turns, settings.LLM_CONTEXT_TOKEN_BUDGET)
+    if len(ctx.folded) >= settings.LLM_SUMMARY_MIN_TURNS:
+        schedule_summary_update(ai, (user_id, profile_id, dialog_id), summary, ctx.folded)
+    return ctx
+
+
+_summarizing: set[DialogKey] = set()
+_tasks: set[asyncio.Task] = set()
+
+
+def schedule_summary_update(ai: Any, key: DialogKey, previous: Optional[str], folded: Sequence[Turn]) -> None:
+    """Свернуть folded в резюме в фоне (не задерживает ответ); по одной задаче на диалог."""
+    if key in _summarizing:
+        return
+    _summarizing.add(key)
+    task = asyncio.create_task(_update_summary(ai, key, previous, list(folded)))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _update_summary(ai: Any, key: DialogKey, previous: Optional[str], folded: list[Turn]) -> None:
+    user_id, profile_id, dialog_id = key
+    try:
+        summary = await LLMClient().summarize_dialog(
+            ai, previous, [(role, content) for _, role, content in folded], settings.LLM_SUMMARY_MAX_CHARS,
+            owner_id=user_id,
+        )
+        if not summary:
+            return
+        until = folded[-1][0]
+        async with get_session() as session:
+            state = await session.get(AIDialogState, {"user_id": user_id, "profile_id": profile_id, "dialog_id": dialog_id})
+            if state is None:
+                state = AIDialogState(user_id=user_id, profile_id=profile_id, dialog_id=dialog_id)
+                session.add(state)
+            elif state.summary_until is not None and state.summary_until >= until:
+                return
+            state.context_summary = summary
+            state.summary_until = until
+    except Exception as exc:
+        logger.warning("Dialog summary update failed for %s: %s", key, exc)
+    finally:
+        _summarizing.discard(key)
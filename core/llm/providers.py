@@ -0,0 +1,148 @@
+"""
+Провайдеры LLM: то, что LLMClient вызывает за моделью.
+
+- OpenAIProvider — OpenAI API (или любой совместимый сервер через LLM_BASE_URL);
+- EchoProvider — эхо последнего сообщения, когда ключа нет (прежний stub);
+- SimulatedProvider (core.llm.simulator) — локальная модель-имитация с задержками,
+  скоростью потока и ошибками для нагрузочных тестов.
+
+Выбор — LLM_PROVIDER: auto (OpenAI при наличии ключа или LLM_BASE_URL, иначе echo),
+openai, echo, simulated.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Messages = Sequence[dict[str, Any]]
+
+# Один AsyncOpenAI (и его пул соединений) на ключ и адрес: без повторного TLS-рукопожатия на каждый ответ
+_openai_clients: dict[tuple[str, Optional[str]], Any] = {}
+
+
+def get_openai_client(api_key: str, base_url: Optional[str] = None) -> Any:
+    """Общий AsyncOpenAI для ключа; создаётся при первом вызове."""
+    client = _openai_clients.get((api_key, base_url))
+    if client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=settings.LLM_MAX_RETRIES,
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT_SEC, connect=settings.LLM_CONNECT_TIMEOUT_SEC),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_KEEPALIVE_SEC,
+                ),
+            ),
+        )
+        _openai_clients[(api_key, base_url)] = client
+    return client
+
+
+async def close_llm_clients() -> None:
+    """Закрыть пулы соединений (при остановке процесса)."""
+    clients = list(_openai_clients.values())
+    _openai_clients.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except Exception as exc:
+            logger.warning("Failed to close OpenAI client: %s", exc)
+
+
+def _wire_messages(messages: Messages) -> list[dict[str, str]]:
+    return [{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in messages]
+
+
+def last_user_message(messages: Messages) -> str:
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            return str(m.get("content", ""))
+    return ""
+
+
+class LLMProvider:
+    """Ответ модели целиком (complete) или по частям (stream)."""
+
+    name = "base"
+
+    async def complete(self, model: str, messages: Messages) -> str:
+        raise NotImplementedError
+
+    async def stream(self, model: str, messages: Messages) -> AsyncIterator[str]:
+        # По умолчанию — одним куском
+        yield await self.complete(model, messages)
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None) -> None:
+        self.api_key = api_key
+        self.base_url = base_url
+
+    async def complete(self, model: str, messages: Messages) -> str:
+        client = get_openai_client(self.api_key, self.base_url)
+        resp = await client.chat.completions.create(model=model, messages=_wire_messages(messages))
+        if not resp.choices:
+            return "⚠️ Пустой ответ от модели."
+        return (resp.choices[0].message.content or "").strip()
+
+    async def stream(self, model: str, messages: Messages) -> AsyncIterator[str]:
+        client = get_openai_client(self.api_key, self.base_url)
+        stream = await client.chat.completions.create(model=model, messages=_wire_messages(messages), stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class EchoProvider(LLMProvider):
+    name = "echo"
+
+    async def complete(self, model: str, messages: Messages) -> str:
+        await asyncio.sleep(0)
+        return f"[{model}] {last_user_message(messages)}\n\n(stub LLM response)"
+
+    async def stream(self, model: str, messages: Messages) -> AsyncIterator[str]:
+        text = await self.complete(model, messages)
+        for piece in re.findall(r"\S+\s*", text):
+            yield piece
+
+
+_shared: dict[str, LLMProvider] = {}
+
+
+def get_provider(api_key: str) -> LLMProvider:
+    """Провайдер по LLM_PROVIDER; echo и simulated — общие на процесс."""
+    name = (settings.LLM_PROVIDER or "auto").lower()
+    base_url = settings.LLM_BASE_URL or None
+    if name == "auto":
+        name = "openai" if api_key or base_url else "echo"
+    if name == "openai":
+        # Локальному совместимому серверу ключ не нужен, но клиент OpenAI требует непустой
+        return OpenAIProvider(api_key or "local", base_url)
+    provider = _shared.get(name)
+    if provider is None:
+        if name == "simulated":
+            from core.llm.simulator import SimulatedProvider
+
+            provider = SimulatedProvider.from_settings()
+        else:
+            if name != "echo":
+                logger.warning("Unknown LLM_PROVIDER=%r, using echo", name)
+            else:
+                logger.warning("LLM_API_KEY не задан, ответы LLM заменяются эхом (stub)")
+            provider = EchoProvider()
+        _shared[name] = provider
+    return provider
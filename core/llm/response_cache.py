@@ -0,0 +1,171 @@
+"""
+Кэш ответов LLM по точному совпадению (включается в AISettings.response_cache_enabled).
+
+Ключ: профиль + модель + sha256 системного промпта + нормализованные последние N сообщений
+(AISettings.response_cache_context_messages; регистр, пунктуация и лишние пробелы не важны,
+так что «Актуально?» и «актуально» совпадают). Профиль в ключе обязателен: иначе при
+одинаковом (или пустом) промпте ответ одного продавца ушёл бы клиенту другого. Резюме
+диалога (системное сообщение с summary=True, core.llm.context) в ключ не входит. В памяти — LRU на LLM_CACHE_MAX_ITEMS записей
+с TTL профиля; при LLM_CACHE_PERSIST=true записи дублируются в таблицу llm_response_cache.
+
+Статистика попаданий — get_response_cache_stats() и метрики llm_cache_* в /metrics.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Optional, Sequence
+
+from sqlalchemy import delete, select
+
+from core.config import settings
+from core.database.models import LLMResponseCacheEntry
+from core.database.session import get_session
+from core.metrics import (
+    LLM_CACHE_ITEMS,
+    LLM_CACHE_REQUESTS_TOTAL,
+    LLM_CACHE_SAVED_SECONDS_TOTAL,
+    LLM_REQUEST_SECONDS,
+)
+from core.timezone import utc_now
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+# Не чаще раза в N секунд удаляем из таблицы истёкшие записи
+_PURGE_INTERVAL_SEC = 600
+
+
+def normalize_text(text: str) -> str:
+    return _NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def cache_key(profile_id: int, model: str, messages: Sequence[dict[str, Any]], context_messages: int) -> str:
+    system = "\n".join(
+        str(m.get("content", "")) for m in messages if m.get("role") == "system" and not m.get("summary")
+    )
+    dialog = [m for m in messages if m.get("role") != "system"][-max(1, context_messages):]
+    h = hashlib.sha256()
+    h.update(f"{profile_id}\x00{model}".encode("utf-8"))
+    h.update(b"\x00")
+    h.update(hashlib.sha256(system.encode("utf-8")).digest())
+    for m in dialog:
+        h.update(b"\x00")
+        h.update(f"{m.get('role')}:{normalize_text(str(m.get('content', '')))}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_items: int, persist: bool = False) -> None:
+        self._max_items = max(1, max_items)
+        self._persist = persist
+        self._items: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._stats: dict[int, dict[str, int]] = {}
+        self._last_purge = 0.0
+
+    def _count(self, profile_id: int, result: str) -> None:
+        per_profile = self._stats.setdefault(profile_id, {"hit": 0, "miss": 0})
+        per_profile[result] += 1
+        LLM_CACHE_REQUESTS_TOTAL.inc(result=result)
+
+    async def get(self, key: str, profile_id: int, model: str) -> Optional[str]:
+        now = time.monotonic()
+        entry = self._items.get(key)
+        if entry is not None and entry[0] <= now:
+            self._items.pop(key, None)
+            entry = None
+        if entry is None and self._persist:
+            entry = await self._load(key, now)
+        if entry is None:
+            self._count(profile_id, "miss")
+            return None
+        self._items.move_to_end(key)
+        self._count(profile_id, "hit")
+        # Экономия: средняя латентность модели по гистограмме LLM
+        count = LLM_REQUEST_SECONDS.count(model=model)
+        if count:
+            LLM_CACHE_SAVED_SECONDS_TOTAL.inc(LLM_REQUEST_SECONDS.sum(model=model) / count)
+        return entry[1]
+
+    async def put(self, key: str, model: str, response: str, ttl_seconds: int) -> None:
+        if not response or ttl_seconds <= 0:
+            return
+        self._remember(key, time.monotonic() + ttl_seconds, response)
+        if self._persist:
+            try:
+                async with get_session() as session:
+                    await session.merge(LLMResponseCacheEntry(
+                        key=key,
+                        model=model,
+                        response=response,
+                        expires_at=utc_now() + timedelta(seconds=ttl_seconds),
+                    ))
+            except Exception as exc:
+                logger.warning("ResponseCache: persist failed: %s", exc)
+            now = time.monotonic()
+            if now - self._last_purge > _PURGE_INTERVAL_SEC:
+                self._last_purge = now
+                try:
+                    await self.purge_expired()
+                except Exception as exc:
+                    logger.warning("ResponseCache: purge failed: %s", exc)
+
+    def _remember(self, key: str, expires: float, response: str) -> None:
+        self._items[key] = (expires, response)
+        self._items.move_to_end(key)
+        while len(self._items) > self._max_items:
+            self._items.popitem(last=False)
+
+    async def _load(self, key: str, now: float) -> Optional[tuple[float, str]]:
+        try:
+            async with get_session() as session:
+                row = (await session.execute(
+                    select(LLMResponseCacheEntry).where(
+                        LLMResponseCacheEntry.key == key,
+                        LLMResponseCacheEntry.expires_at > utc_now(),
+                    )
+                )).scalar_one_or_none()
+                if row is None:
+                    return None
+                expires = now + (row.expires_at - utc_now()).total_seconds()
+                response = row.response
+        except Exception as exc:
+            logger.warning("ResponseCache: load failed: %s", exc)
+            return None
+        self._remember(key, expires, response)
+        return (expires, response)
+
+    async def purge_expired(self) -> int:
+        """Удалить истёкшие записи из таблицы (память чистится сама при чтении/вытеснении)."""
+        if not self._persist:
+            return 0
+        async with get_session() as session:
+            result = await session.execute(
+                delete(LLMResponseCacheEntry).where(LLMResponseCacheEntry.expires_at <= utc_now())
+            )
+            return result.rowcount or 0
+
+    def stats(self, profile_id: Optional[int] = None) -> dict[str, Any]:
+        if profile_id is not None:
+            per_profile = self._stats.get(profile_id, {"hit": 0, "miss": 0})
+            total = per_profile["hit"] + per_profile["miss"]
+            return {**per_profile, "hit_rate": per_profile["hit"] / total if total else 0.0}
+        hits = sum(s["hit"] for s in self._stats.values())
+        misses = sum(s["miss"] for s in self._stats.values())
+        total = hits + misses
+        return {"size": len(self._items), "hit": hits, "miss": misses, "hit_rate": hits / total if total else 0.0}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+response_cache = ResponseCache(settings.LLM_CACHE_MAX_ITEMS, persist=settings.LLM_CACHE_PERSIST)
+LLM_CACHE_ITEMS.set_function(lambda: len(response_cache))
+
+
+def get_response_cache_stats(profile_id: Optional[int] = None) -> dict[str, Any]:
+    return response_cache.stats(profile_id)
@@ -0,0 +1,222 @@
+"""
+Маршрутизация запросов к LLM по задержке.
+
+Для каждой модели хранится скользящее окно последних LLM_LATENCY_WINDOW замеров (полный
+ответ и время до первого токена в потоке — отдельно). Дедлайн запроса — p95 модели (не
+меньше LLM_HEDGE_MIN_DEADLINE_SEC; пока замеров меньше LLM_HEDGE_MIN_SAMPLES —
+LLM_HEDGE_DEFAULT_DEADLINE_SEC). Если основной запрос не уложился в дедлайн или упал,
+запускается запасной: на модели с наименьшим p95 (или LLM_FALLBACK_MODEL, если замеров нет,
+или той же модели — hedged-запрос). Берётся первый успешный ответ, второй запрос отменяется.
+Запасной запрос после дедлайна идёт параллельно основному, поэтому ему нужен свой слот
+(backup_slot, без ожидания): нет свободного слота — запасной не запускается, ждём основной.
+После ошибки основного запасной идёт в его слоте.
+
+Провайдер передаётся как функция model -> ответ / поток, поэтому механизм проверяется
+на локальной заглушке с искусственной задержкой.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from core.config import LLM_MODEL_MAP, settings
+from core.metrics import LLM_HEDGE_WINS_TOTAL, LLM_HEDGES_TOTAL, LLM_LATENCY_P95_SECONDS
+
+logger = logging.getLogger(__name__)
+
+KIND_REPLY = "reply"
+KIND_FIRST_TOKEN = "first_token"
+
+T = TypeVar("T")
+
+# Слот под запасной запрос без ожидания: функция освобождения или None (свободных нет)
+BackupSlot = Callable[[], Optional[Callable[[], None]]]
+
+
+class LatencyTracker:
+    def __init__(self, window: int, min_samples: int) -> None:
+        self._window = max(1, window)
+        self._min_samples = max(1, min_samples)
+        self._samples: dict[tuple[str, str], deque[float]] = {}
+
+    def observe(self, model: str, kind: str, seconds: float) -> None:
+        samples = self._samples.get((model, kind))
+        if samples is None:
+            samples = self._samples[(model, kind)] = deque(maxlen=self._window)
+        samples.append(seconds)
+
+    def p95(self, model: str, kind: str) -> Optional[float]:
+        samples = self._samples.get((model, kind))
+        if not samples or len(samples) < self._min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[math.ceil(0.95 * len(ordered)) - 1]
+
+    def snapshot(self) -> dict[tuple[str, str], float]:
+        result = {}
+        for model, kind in list(self._samples):
+            p95 = self.p95(model, kind)
+            if p95 is not None:
+                result[(model, kind)] = p95
+        return result
+
+
+latency = LatencyTracker(settings.LLM_LATENCY_WINDOW, settings.LLM_HEDGE_MIN_SAMPLES)
+LLM_LATENCY_P95_SECONDS.set_function(latency.snapshot)
+
+
+def hedge_deadline(model: str, kind: str) -> float:
+    p95 = latency.p95(model, kind)
+    if p95 is None:
+        return settings.LLM_HEDGE_DEFAULT_DEADLINE_SEC
+    return max(settings.LLM_HEDGE_MIN_DEADLINE_SEC, p95)
+
+
+def fallback_model(model: str, kind: str) -> str:
+    """Модель для запасного запроса: самая быстрая по p95 (возможно, та же самая)."""
+    own = latency.p95(model, kind)
+    best: Optional[tuple[float, str]] = None
+    for candidate in {*LLM_MODEL_MAP.values(), settings.LLM_FALLBACK_MODEL}:
+        if candidate == model:
+            continue
+        p95 = latency.p95(candidate, kind)
+        if p95 is not None and (best is None or p95 < best[0]):
+            best = (p95, candidate)
+    if best is not None:
+        return best[1] if own is None or best[0] < own else model
+    return settings.LLM_FALLBACK_MODEL
+
+
+async def _timed(model: str, kind: str, aw: Awaitable[T]) -> T:
+    started = time.perf_counter()
+    try:
+        result = await aw
+    except asyncio.CancelledError:
+        # Проигравший запрос: его задержка не меньше прошедшего времени
+        latency.observe(model, kind, time.perf_counter() - started)
+        raise
+    latency.observe(model, kind, time.perf_counter() - started)
+    return result
+
+
+async def _race(
+    model: str,
+    kind: str,
+    start: Callable[[str], "asyncio.Future[T]"],
+    backup_slot: Optional[BackupSlot] = None,
+) -> tuple[int, T]:
+    """Основной запрос, после дедлайна/ошибки — запасной. Возвращает (номер победителя, результат)."""
+    primary = start(model)
+    tasks = [primary]
+    done, _ = await asyncio.wait({primary}, timeout=hedge_deadline(model, kind))
+    if done and primary.exception() is None:
+        return 0, primary.result()
+    release: Optional[Callable[[], None]] = None
+    if not done and backup_slot is not None:
+        release = backup_slot()
+        if release is None:
+            logger.debug("LLM %s: deadline on %s, no free slot for a backup request", kind, model)
+            return 0, await primary
+    backup_model = fallback_model(model, kind)
+    reason = "error" if done else "deadline"
+    LLM_HEDGES_TOTAL.inc(model=model, reason=reason)
+    logger.info("LLM %s: %s on %s, starting backup request on %s", kind, reason, model, backup_model)
+    backup = start(backup_model)
+    if release is not None:
+        backup.add_done_callback(lambda _: release())
+    tasks.append(backup)
+    pending = {t for t in tasks if not t.done()}
+    last_exc = primary.exception() if done else None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                idx = tasks.index(task)
+                LLM_HEDGE_WINS_TOTAL.inc(winner="backup" if idx else "primary")
+                return idx, task.result()
+            last_exc = task.exception()
+    assert last_exc is not None
+    raise last_exc
+
+
+async def hedged_call(
+    model: str,
+    call: Callable[[str], Awaitable[str]],
+    backup_slot: Optional[BackupSlot] = None,
+) -> str:
+    """Ответ целиком: call(model) с запасным запросом после дедлайна; проигравший отменяется."""
+    if not settings.LLM_HEDGE_ENABLED:
+        return await call(model)
+    tasks: list[asyncio.Task] = []
+
+    def start(m: str) -> asyncio.Task:
+        task = asyncio.ensure_future(_timed(m, KIND_REPLY, call(m)))
+        tasks.append(task)
+        return task
+
+    try:
+        _, reply = await _race(model, KIND_REPLY, start, backup_slot)
+        return reply
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+_EMPTY = object()
+
+
+async def _first(stream: AsyncIterator[str]) -> object:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return _EMPTY
+
+
+async def hedged_stream(
+    model: str,
+    open_stream: Callable[[str], AsyncIterator[str]],
+    backup_slot: Optional[BackupSlot] = None,
+) -> AsyncIterator[str]:
+    """
+    Поток: дедлайн считается по первому токену. Победивший поток отдаётся до конца,
+    проигравший отменяется и закрывается. Слот запасного запроса освобождается вместе с
+    гонкой за первый токен: дальше идёт один поток, в слоте вызывающего.
+    """
+    if not settings.LLM_HEDGE_ENABLED:
+        async for delta in open_stream(model):
+            yield delta
+        return
+    streams: list[AsyncIterator[str]] = []
+    tasks: list[asyncio.Task] = []
+
+    def start(m: str) -> asyncio.Task:
+        stream = open_stream(m).__aiter__()
+        streams.append(stream)
+        task = asyncio.ensure_future(_timed(m, KIND_FIRST_TOKEN, _first(stream)))
+        tasks.append(task)
+        return task
+
+    winner: Optional[int] = None
+    try:
+        winner, first = await _race(model, KIND_FIRST_TOKEN, start, backup_slot)
+    finally:
+        for idx, (stream, task) in enumerate(zip(streams, tasks)):
+            if idx == winner:
+                continue
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            try:
+                await stream.aclose()  # type: ignore[attr-defined]
+            except Exception:
+                pass
+    if first is _EMPTY:
+        return
+    yield first  # type: ignore[misc]
+    async for delta in streams[winner]:
+        yield delta
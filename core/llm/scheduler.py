@@ -0,0 +1,154 @@
+"""
+Планировщик запросов к LLM: общий лимит параллельности, две полосы приоритета и квоты владельцев.
+
+- interactive — ответы в диалоге (тест-чат, webhook Avito): обслуживаются первыми;
+- background — фоллоу-апы и резюме диалогов: занимают не больше LLM_BACKGROUND_MAX_CONCURRENCY
+  слотов, так что волна фоллоу-апов не выедает ёмкость у живых ответов.
+
+Внутри полосы очередь разбита по владельцам (owner — Telegram ID владельца профиля) и
+обслуживается по кругу; сверх того у владельца не больше LLM_OWNER_MAX_CONCURRENCY
+одновременных запросов. Крупный аккаунт не может занять все слоты.
+
+Использование: ``async with llm_scheduler.slot(owner, LANE_BACKGROUND): ...``
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Hashable
+
+from core.config import settings
+from core.metrics import LLM_SCHEDULER_ACTIVE, LLM_SCHEDULER_WAIT_SECONDS, LLM_SCHEDULER_WAITING
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int, background_max: int, owner_max: int = 0) -> None:
+        self._max = max(1, max_concurrency)
+        self._background_max = max(1, min(background_max, self._max))
+        self._owner_max = max(0, owner_max)
+        self._active = 0
+        self._active_by_lane: dict[str, int] = {lane: 0 for lane in LANES}
+        self._active_by_owner: dict[Hashable, int] = {}
+        # Полоса → владелец → ожидающие; порядок владельцев = очередь round-robin
+        self._waiting: dict[str, OrderedDict[Hashable, deque[asyncio.Future]]] = {
+            lane: OrderedDict() for lane in LANES
+        }
+
+    def _can_run(self, owner: Hashable, lane: str) -> bool:
+        if self._active >= self._max:
+            return False
+        if lane == LANE_BACKGROUND and self._active_by_lane[LANE_BACKGROUND] >= self._background_max:
+            return False
+        if self._owner_max and self._active_by_owner.get(owner, 0) >= self._owner_max:
+            return False
+        return True
+
+    def _grant(self, owner: Hashable, lane: str) -> None:
+        self._active += 1
+        self._active_by_lane[lane] += 1
+        self._active_by_owner[owner] = self._active_by_owner.get(owner, 0) + 1
+
+    def release(self, owner: Hashable, lane: str) -> None:
+        self._active -= 1
+        self._active_by_lane[lane] -= 1
+        left = self._active_by_owner.get(owner, 0) - 1
+        if left > 0:
+            self._active_by_owner[owner] = left
+        else:
+            self._active_by_owner.pop(owner, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Раздать освободившиеся слоты: сначала interactive, внутри полосы — по кругу владельцев."""
+        for lane in LANES:
+            queue = self._waiting[lane]
+            progressed = True
+            while queue and progressed and self._active < self._max:
+                progressed = False
+                for owner in list(queue):
+                    waiters = queue[owner]
+                    while waiters and waiters[0].done():
+                        waiters.popleft()  # отменён, пока ждал
+                    if not waiters:
+                        del queue[owner]
+                        continue
+                    if not self._can_run(owner, lane):
+                        continue
+                    self._grant(owner, lane)
+                    waiters.popleft().set_result(None)
+                    if waiters:
+                        queue.move_to_end(owner)
+                    else:
+                        del queue[owner]
+                    progressed = True
+                    break
+
+    async def acquire(self, owner: Hashable, lane: str = LANE_INTERACTIVE) -> None:
+        queue = self._waiting[lane]
+        # Быстрый путь: слот свободен и у владельца нет более ранних запросов в очереди
+        if owner not in queue and not (lane == LANE_BACKGROUND and self._waiting[LANE_INTERACTIVE]) and self._can_run(owner, lane):
+            self._grant(owner, lane)
+            LLM_SCHEDULER_WAIT_SECONDS.observe(0.0, lane=lane)
+            return
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        queue.setdefault(owner, deque()).append(fut)
+        self._dispatch()
+        started = time.perf_counter()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот выдан одновременно с отменой — вернуть
+                self.release(owner, lane)
+            raise
+        finally:
+            LLM_SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - started, lane=lane)
+
+    def try_acquire(self, owner: Hashable, lane: str = LANE_INTERACTIVE) -> bool:
+        """
+        Слот без ожидания (запасной hedged-запрос): только если он свободен в пределах всех
+        лимитов и никто не ждёт в очереди — запасной запрос не обгоняет чужие. Вернуть — release().
+        """
+        if self.waiting(LANE_INTERACTIVE) or self.waiting(lane) or not self._can_run(owner, lane):
+            return False
+        self._grant(owner, lane)
+        return True
+
+    @asynccontextmanager
+    async def slot(self, owner: Hashable, lane: str = LANE_INTERACTIVE) -> AsyncIterator[None]:
+        await self.acquire(owner, lane)
+        try:
+            yield
+        finally:
+            self.release(owner, lane)
+
+    def waiting(self, lane: str) -> int:
+        return sum(sum(1 for f in waiters if not f.done()) for waiters in self._waiting[lane].values())
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max": self._max,
+            "active": self._active,
+            **{f"active_{lane}": self._active_by_lane[lane] for lane in LANES},
+            **{f"waiting_{lane}": self.waiting(lane) for lane in LANES},
+            "owners": len(self._active_by_owner),
+        }
+
+
+llm_scheduler = LLMScheduler(
+    settings.LLM_MAX_CONCURRENCY,
+    settings.LLM_BACKGROUND_MAX_CONCURRENCY,
+    settings.LLM_OWNER_MAX_CONCURRENCY,
+)
+LLM_SCHEDULER_ACTIVE.set_function(lambda: {(lane,): n for lane, n in llm_scheduler._active_by_lane.items()})
+LLM_SCHEDULER_WAITING.set_function(lambda: {(lane,): llm_scheduler.waiting(lane) for lane in LANES})
+
+
+def get_llm_scheduler_stats() -> dict[str, Any]:
+    return llm_scheduler.stats()
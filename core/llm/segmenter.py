@@ -0,0 +1,92 @@
+"""
+Разбиение потокового ответа LLM на группы предложений (AISettings.message_mode="by_sentences").
+
+Предложение считается законченным, когда за знаком .!?… следует пробел/перевод строки
+и затем не строчная буква (или встретилась пустая строка). Так «3.5» не режется (нет
+пробела), «т.е. это», «руб. в месяц» — тоже (дальше строчная), а после сокращений из
+_ABBREVIATIONS («т.е.», «ул.») граница не ставится и перед заглавной. Чтобы увидеть
+следующую букву, граница подтверждается только со следующим непробельным символом.
+Группа из message_sentences_count предложений отдаётся, как только набрана, не дожидаясь
+конца генерации.
+"""
+from __future__ import annotations
+
+import re
+from typing import AsyncIterable, AsyncIterator, Optional
+
+from core.database.models import AISettings
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_BOUNDARY = re.compile(r"[.!?…]+[\"'»)]*\s+(?=\S)|" + _PARAGRAPH.pattern)
+_LAST_WORD = re.compile(r"\w+(?:\.\w+)*$")
+# Сокращения, после которых предложение не заканчивается (без последней точки, casefold)
+_ABBREVIATIONS = frozenset({"т.е", "т.к", "т.н", "напр", "ул", "им"})
+
+
+def _is_boundary(text: str, match: re.Match[str]) -> bool:
+    if _PARAGRAPH.search(match.group()):
+        return True  # пустая строка
+    if text[match.end()].islower():
+        return False
+    word = _LAST_WORD.search(text, 0, match.start())
+    return not (match.group().startswith(".") and word and word.group().casefold() in _ABBREVIATIONS)
+
+
+def sentence_group_size(ai: AISettings) -> Optional[int]:
+    """N предложений на сообщение или None, если ответ отправляется целиком."""
+    if getattr(ai, "message_mode", None) != "by_sentences":
+        return None
+    count = getattr(ai, "message_sentences_count", None) or 0
+    return count if count > 0 else None
+
+
+class SentenceSegmenter:
+    def __init__(self, sentences_per_group: int) -> None:
+        self._n = max(1, sentences_per_group)
+        self._buffer = ""
+        self._sentences: list[str] = []
+
+    def feed(self, delta: str) -> list[str]:
+        """Добавить кусок текста; вернуть готовые группы (возможно, пустой список)."""
+        self._buffer += delta
+        groups: list[str] = []
+        pos = 0
+        while True:
+            match = _BOUNDARY.search(self._buffer, pos)
+            if match is None:
+                break
+            if not _is_boundary(self._buffer, match):
+                pos = match.end()
+                continue
+            pos = 0
+            sentence = self._buffer[: match.end()].strip()
+            self._buffer = self._buffer[match.end():]
+            if sentence:
+                self._sentences.append(sentence)
+            if len(self._sentences) >= self._n:
+                groups.append(" ".join(self._sentences))
+                self._sentences = []
+        return groups
+
+    def finish(self) -> Optional[str]:
+        """Остаток после конца потока (неполная группа и/или предложение без точки)."""
+        tail = self._buffer.strip()
+        if tail:
+            self._sentences.append(tail)
+        self._buffer = ""
+        if not self._sentences:
+            return None
+        group = " ".join(self._sentences)
+        self._sentences = []
+        return group
+
+
+async def sentence_groups(stream: AsyncIterable[str], sentences_per_group: int) -> AsyncIterator[str]:
+    """Поток дельт → поток готовых к отправке сообщений по N предложений."""
+    segmenter = SentenceSegmenter(sentences_per_group)
+    async for delta in stream:
+        for group in segmenter.feed(delta):
+            yield group
+    tail = segmenter.finish()
+    if tail:
+        yield tail
@@ -0,0 +1,232 @@
+"""
+Локальная имитация LLM для нагрузочных тестов без сети.
+
+SimulatedProvider ведёт себя как модель: время до первого токена из распределения
+(fixed / uniform / lognormal вокруг медианы, своя медиана на модель), дальше токены
+идут со скоростью LLM_SIM_TOKENS_PER_SEC; с заданной вероятностью запрос падает
+(SimulatedLLMError) или зависает до таймаута. Ответ детерминирован по тексту вопроса:
+заготовка из LLM_SIM_CANNED_FILE (JSON {"фраза": "ответ"}, совпадение по нормализованной
+подстроке) или сгенерированный текст из предложений заданной длины.
+
+Тот же провайдер доступен как OpenAI-совместимый HTTP-сервер (create_app(),
+запуск — scripts/llm_sim_server.py): POST /v1/chat/completions (в т.ч. stream=true),
+GET /v1/models.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+
+from core.config import settings
+from core.llm.providers import LLMProvider, Messages, last_user_message
+from core.llm.response_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_WORDS = (
+    "товар", "в", "наличии", "можно", "забрать", "сегодня", "доставка", "по", "городу", "цена",
+    "указана", "в", "объявлении", "отправим", "после", "оплаты", "есть", "гарантия", "пишите",
+    "если", "будут", "вопросы", "размер", "уточню", "у", "склада", "самовывоз", "до", "вечера",
+)
+_SENTENCE_WORDS = 8
+
+
+def _batch_items(question: str) -> Optional[list[dict[str, Any]]]:
+    if not question.startswith("{"):
+        return None
+    try:
+        data = json.loads(question)
+    except ValueError:
+        return None
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return None
+    return items
+
+
+class SimulatedLLMError(RuntimeError):
+    """Имитация ошибки провайдера (HTTP 500)."""
+
+    status_code = 500
+
+
+@dataclass
+class SimulationConfig:
+    latency_ms: float = 800.0
+    distribution: str = "lognormal"  # fixed | uniform | lognormal
+    spread: float = 0.5  # sigma для lognormal, ±доля медианы для uniform
+    model_latency_ms: dict[str, float] = field(default_factory=dict)
+    tokens_per_sec: float = 40.0  # 0 — весь ответ сразу
+    reply_tokens: int = 60
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    timeout_sec: float = 60.0
+    canned: dict[str, str] = field(default_factory=dict)
+    seed: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls) -> "SimulationConfig":
+        canned: dict[str, str] = {}
+        if settings.LLM_SIM_CANNED_FILE:
+            canned = json.loads(Path(settings.LLM_SIM_CANNED_FILE).read_text(encoding="utf-8"))
+        return cls(
+            latency_ms=settings.LLM_SIM_LATENCY_MS,
+            distribution=settings.LLM_SIM_LATENCY_DISTRIBUTION,
+            spread=settings.LLM_SIM_LATENCY_SPREAD,
+            model_latency_ms=dict(settings.LLM_SIM_MODEL_LATENCY_MS),
+            tokens_per_sec=settings.LLM_SIM_TOKENS_PER_SEC,
+            reply_tokens=settings.LLM_SIM_REPLY_TOKENS,
+            error_rate=settings.LLM_SIM_ERROR_RATE,
+            timeout_rate=settings.LLM_SIM_TIMEOUT_RATE,
+            timeout_sec=settings.LLM_TIMEOUT_SEC,
+            canned=canned,
+            seed=settings.LLM_SIM_SEED,
+        )
+
+
+class SimulatedProvider(LLMProvider):
+    name = "simulated"
+
+    def __init__(self, config: Optional[SimulationConfig] = None) -> None:
+        self.config = config or SimulationConfig()
+        self._rng = random.Random(self.config.seed)
+        self._canned = [(normalize_text(k), v) for k, v in self.config.canned.items() if normalize_text(k)]
+
+    @classmethod
+    def from_settings(cls) -> "SimulatedProvider":
+        return cls(SimulationConfig.from_settings())
+
+    def first_token_delay(self, model: str) -> float:
+        cfg = self.config
+        median = cfg.model_latency_ms.get(model, cfg.latency_ms) / 1000
+        if cfg.distribution == "fixed" or median <= 0:
+            return max(0.0, median)
+        if cfg.distribution == "uniform":
+            return max(0.0, self._rng.uniform(median * (1 - cfg.spread), median * (1 + cfg.spread)))
+        return self._rng.lognormvariate(0.0, cfg.spread) * median
+
+    def answer(self, model: str, messages: Messages) -> str:
+        question = last_user_message(messages)
+        batch = _batch_items(question)
+        if batch is not None:
+            # Пакетный запрос фоллоу-апов (core.llm.batching): JSON-ответ по каждому id
+            return json.dumps({"items": [
+                {"id": item.get("id"), "text": self.answer(model, [{"role": "user", "content": json.dumps(item, ensure_ascii=False)}])}
+                for item in batch
+            ]}, ensure_ascii=False)
+        normalized = normalize_text(question)
+        for phrase, reply in self._canned:
+            if phrase in normalized:
+                return reply
+        # Детерминированно по (модель, вопрос): одинаковый вопрос — одинаковый ответ
+        seed = hashlib.sha256(f"{model}\x00{normalized}".encode("utf-8")).digest()
+        rng = random.Random(seed)
+        words = [rng.choice(_WORDS) for _ in range(max(1, self.config.reply_tokens))]
+        sentences = []
+        for i in range(0, len(words), _SENTENCE_WORDS):
+            chunk = words[i:i + _SENTENCE_WORDS]
+            sentences.append(" ".join(chunk).capitalize() + ".")
+        return " ".join(sentences)
+
+    async def _before_first_token(self, model: str) -> None:
+        roll = self._rng.random()
+        if roll < self.config.timeout_rate:
+            await asyncio.sleep(self.config.timeout_sec)
+            raise asyncio.TimeoutError(f"simulated timeout for {model}")
+        await asyncio.sleep(self.first_token_delay(model))
+        if roll < self.config.timeout_rate + self.config.error_rate:
+            raise SimulatedLLMError(f"simulated error for {model}")
+
+    async def complete(self, model: str, messages: Messages) -> str:
+        await self._before_first_token(model)
+        text = self.answer(model, messages)
+        if self.config.tokens_per_sec > 0:
+            await asyncio.sleep(len(text.split()) / self.config.tokens_per_sec)
+        return text
+
+    async def stream(self, model: str, messages: Messages) -> AsyncIterator[str]:
+        await self._before_first_token(model)
+        tokens = self.answer(model, messages).split(" ")
+        pause = 1 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+        for idx, token in enumerate(tokens):
+            if idx and pause:
+                await asyncio.sleep(pause)
+            yield token if idx == len(tokens) - 1 else token + " "
+
+
+def create_app(provider: Optional[SimulatedProvider] = None) -> Any:
+    """aiohttp-приложение с OpenAI-совместимым /v1/chat/completions поверх SimulatedProvider."""
+    from aiohttp import web
+
+    provider = provider or SimulatedProvider.from_settings()
+
+    def _error(status: int, message: str) -> web.Response:
+        return web.json_response({"error": {"message": message, "type": "server_error"}}, status=status)
+
+    async def handle_models(request: web.Request) -> web.Response:
+        models = sorted({*settings.LLM_SIM_MODEL_LATENCY_MS, "gpt-4o-mini", "gpt-4.1-mini", "gpt-4.1"})
+        return web.json_response({"object": "list", "data": [{"id": m, "object": "model", "owned_by": "simulator"} for m in models]})
+
+    async def handle_completions(request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except Exception:
+            return _error(400, "invalid JSON body")
+        model = str(body.get("model") or "gpt-4o-mini")
+        messages = body.get("messages") or []
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            try:
+                text = await provider.complete(model, messages)
+            except (SimulatedLLMError, asyncio.TimeoutError) as exc:
+                return _error(500, str(exc))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+            })
+
+        def chunk(delta: dict[str, str], finish: Optional[str] = None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        stream = provider.stream(model, messages)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except (SimulatedLLMError, asyncio.TimeoutError) as exc:
+            return _error(500, str(exc))
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(chunk({"role": "assistant", "content": first}))
+        async for delta in stream:
+            await response.write(chunk({"content": delta}))
+        await response.write(chunk({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", handle_completions)
+    app.router.add_get("/v1/models", handle_models)
+    return app
@@ -0,0 +1,255 @@
+"""
+Метрики процесса в текстовом формате Prometheus (без внешних зависимостей).
+
+Счётчики и гистограммы живут в памяти процесса; снимок отдаёт GET /metrics
+на aiohttp-приложении webhook (core.avito.webhook_server). Значения, которые
+дешевле прочитать в момент запроса (глубина очереди, пул БД), регистрируются
+как callback-метрики.
+"""
+from __future__ import annotations
+
+import math
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator, Sequence
+
+# Секунды: от быстрых запросов к БД до долгих ответов LLM
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: list["_Metric"] = []
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"
+
+
+class Gauge(_Metric):
+    """Gauge: set() вручную или set_function() — значение читается при каждом scrape."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+        self._fn: Callable[[], float | dict[LabelValues, float]] | None = None
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def set_function(self, fn: Callable[[], float | dict[LabelValues, float]]) -> None:
+        self._fn = fn
+
+    def _samples(self) -> Iterator[str]:
+        values = dict(self._values)
+        if self._fn is not None:
+            try:
+                result = self._fn()
+            except Exception:
+                result = None
+            if isinstance(result, dict):
+                values.update(result)
+            elif result is not None:
+                values[()] = float(result)
+        for key, value in values.items():
+            yield f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"
+
+
+class CallbackCounter(Gauge):
+    """Монотонный счётчик, который ведёт сам код (set_function); в выдаче — тип counter."""
+
+    type_name = "counter"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+        # key -> [counts per bucket..., count, sum]
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        row = self._values.get(key)
+        if row is None:
+            row = [0.0] * (len(self._buckets) + 2)
+            self._values[key] = row
+        idx = bisect_left(self._buckets, value)
+        if idx < len(self._buckets):
+            row[idx] += 1
+        row[-2] += 1
+        row[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Замер длительности блока (работает и вокруг await)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(row[-2]) if row else 0
+
+    def sum(self, **labels: str) -> float:
+        row = self._values.get(self._key(labels))
+        return row[-1] if row else 0.0
+
+    def _samples(self) -> Iterator[str]:
+        for key, row in self._values.items():
+            cumulative = 0.0
+            for bound, n in zip(self._buckets, row):
+                cumulative += n
+                le = f'le="{_fmt_value(bound)}"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {_fmt_value(cumulative)}"
+            inf = 'le="+Inf"'
+            yield f"{self.name}_bucket{_fmt_labels(self.labelnames, key, inf)} {_fmt_value(row[-2])}"
+            yield f"{self.name}_count{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-2])}"
+            yield f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-1])}"
+
+
+def render_metrics() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_JOB_ID_SUFFIX = re.compile(r"_\d+$")
+
+
+def endpoint_label(path: str) -> str:
+    """/messenger/v1/accounts/123/chats/u2i-x/messages → /messenger/v1/accounts/{id}/chats/{chat_id}/messages."""
+    path = _ID_SEGMENT.sub("/{id}", path)
+    # chat_id Avito (u2i-…) тоже раздувает кардинальность
+    return re.sub(r"/chats/[^/]+", "/chats/{chat_id}", path)
+
+
+def job_label(job_id: str) -> str:
+    """report_task_42 → report_task (один ряд на тип джоба, а не на задачу)."""
+    return _JOB_ID_SUFFIX.sub("", job_id or "")
+
+
+# ─── Метрики приложения ─────────────────────────────────────────────────────
+
+AVITO_API_SECONDS = Histogram(
+    "avito_api_request_seconds", "Avito API request latency", ("endpoint", "method")
+)
+LLM_REQUEST_SECONDS = Histogram("llm_request_seconds", "LLM request latency", ("model",))
+LLM_ERRORS_TOTAL = Counter("llm_errors_total", "Failed LLM requests", ("model",))
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    "telegram_request_seconds", "Telegram Bot API request latency", ("method",)
+)
+DB_SESSION_SECONDS = Histogram("db_session_seconds", "Duration of get_session() blocks")
+RATE_LIMITED_TOTAL = Counter("rate_limited_total", "HTTP 429 responses by upstream", ("service",))
+RETRIES_TOTAL = Counter("retries_total", "Retried operations by component", ("component",))
+SCHEDULER_JOB_LAG_SECONDS = Histogram(
+    "scheduler_job_lag_seconds", "Delay between scheduled and actual job start", ("job",)
+)
+SCHEDULER_JOBS_MISSED_TOTAL = Counter(
+    "scheduler_jobs_missed_total", "Scheduler runs skipped as misfired", ("job",)
+)
+WEBHOOK_QUEUE_DEPTH = Gauge("webhook_queue_depth", "Avito webhook jobs waiting in the queue")
+WEBHOOK_QUEUE_CAPACITY = Gauge("webhook_queue_capacity", "Avito webhook queue size limit")
+WEBHOOK_EVENTS_TOTAL = CallbackCounter(
+    "webhook_events_total", "Avito webhook deliveries by outcome since start", ("outcome",)
+)
+FOLLOWUP_BACKLOG = Gauge("followup_backlog", "Pending follow-ups already due (execute_at <= now)")
+FOLLOWUP_DISPATCHER_HEAP = Gauge("followup_dispatcher_heap", "Follow-ups held by the in-process timer heap")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "DB connections currently checked out")
+LLM_CACHE_REQUESTS_TOTAL = Counter("llm_cache_requests_total", "LLM response cache lookups", ("result",))
+LLM_CACHE_SAVED_SECONDS_TOTAL = Counter(
+    "llm_cache_saved_seconds_total", "LLM time saved by cache hits (mean model latency per hit)"
+)
+LLM_CACHE_ITEMS = Gauge("llm_cache_items", "Entries in the in-memory LLM response cache")
+LLM_SCHEDULER_WAIT_SECONDS = Histogram(
+    "llm_scheduler_wait_seconds", "Time LLM requests waited for a scheduler slot", ("lane",)
+)
+LLM_SCHEDULER_ACTIVE = Gauge("llm_scheduler_active", "LLM requests currently running", ("lane",))
+LLM_SCHEDULER_WAITING = Gauge("llm_scheduler_waiting", "LLM requests waiting for a slot", ("lane",))
+LLM_HEDGES_TOTAL = Counter(
+    "llm_hedges_total", "Backup LLM requests started after the deadline or an error", ("model", "reason")
+)
+LLM_HEDGE_WINS_TOTAL = Counter("llm_hedge_wins_total", "Hedged LLM requests by the request that answered", ("winner",))
+LLM_LATENCY_P95_SECONDS = Gauge(
+    "llm_latency_p95_seconds", "Rolling p95 LLM latency used for routing", ("model", "kind")
+)
+LLM_BATCH_ITEMS_TOTAL = Counter(
+    "llm_batch_items_total", "Follow-ups generated in batched LLM requests by outcome", ("result",)
+)
+DIALOG_CACHE_REQUESTS_TOTAL = Counter(
+    "dialog_cache_requests_total", "Dialog history cache lookups (hit, miss, bypass = window wider than the ring)", ("result",)
+)
+DIALOG_CACHE_DIALOGS = Gauge("dialog_cache_dialogs", "Dialogs held by the recent-history cache")
+DIALOG_CACHE_BYTES = Gauge("dialog_cache_bytes", "Estimated memory used by the recent-history cache")
+RETENTION_ROWS_TOTAL = Counter("retention_rows_total", "Rows archived and deleted by the retention job", ("table",))
+RETENTION_BYTES_TOTAL = Counter(
+    "retention_bytes_total", "Estimated row payload bytes deleted by the retention job", ("table",)
+)
+DIALOG_BUFFER_ROWS = Gauge("dialog_buffer_rows", "AIDialogMessage rows waiting in the write-behind buffer")
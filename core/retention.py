@@ -0,0 +1,408 @@
+"""
+Хранение и чистка растущих таблиц: ai_dialog_messages, scheduled_followups, ai_dialog_state.
+
+- ai_dialog_messages — старше AISettings.context_retention_days профиля: при включённом
+  RETENTION_ENABLED этот срок не только обрезает контекст LLM, но и удаляет историю из БД.
+  Профили без срока не чистятся, если не задан RETENTION_DIALOG_DAYS (по умолчанию 0).
+- scheduled_followups — в конечных статусах (sent / canceled / failed / dead) с execute_at
+  старше RETENTION_FOLLOWUP_DAYS; pending / processing не трогаем.
+- ai_dialog_state — диалоги, где клиент молчит дольше срока хранения профиля и нет
+  незавершённых фоллоу-апов (они читают has_negative / is_converted при отправке).
+
+Строки удаляются пачками по RETENTION_BATCH_SIZE, каждая пачка — своя короткая транзакция.
+Перед удалением пачка дописывается в архив RETENTION_ARCHIVE_DIR/<таблица>-<время запуска>.jsonl.gz
+(пусто — без архива). Итог — RetentionReport: строк и байт (оценка по JSON строк) по таблицам.
+
+PostgreSQL: ai_dialog_messages можно перевести на помесячные партиции по created_at
+(convert_to_partitioned(), scripts/retention.py --partition, в окно обслуживания).
+Тогда каждый запуск создаёт партиции на RETENTION_PARTITION_MONTHS_AHEAD месяцев вперёд,
+а опустевшие прошлые партиции удаляет целиком (DROP возвращает место сразу, DELETE — нет).
+
+webhook_deliveries и llm_response_cache чистят себя сами (core.avito.dedup, core.llm.response_cache).
+Запуск: джоб планировщика раз в сутки на лидере (RETENTION_HOUR по Москве, только при
+RETENTION_ENABLED=true — по умолчанию выключен) или scripts/retention.py.
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+from sqlalchemy import Table, and_, delete, exists, func, select, text, tuple_
+
+from core.config import settings
+from core.database.models import AIDialogMessage, AIDialogState, AISettings, AvitoProfile, ScheduledFollowup
+from core.database.session import async_engine, get_session
+from core.metrics import RETENTION_BYTES_TOTAL, RETENTION_ROWS_TOTAL
+from core.services.dialog_history import dialog_history
+from core.timezone import utc_now
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_FOLLOWUP_STATUSES = ("sent", "canceled", "failed", "dead")
+ACTIVE_FOLLOWUP_STATUSES = ("pending", "processing")
+PARTITIONED_TABLE = AIDialogMessage.__tablename__
+
+
+@dataclass
+class TableReport:
+    rows: int = 0
+    bytes: int = 0
+    archived_bytes: int = 0
+
+
+@dataclass
+class RetentionReport:
+    dry_run: bool = False
+    tables: dict[str, TableReport] = field(default_factory=dict)
+    partitions_created: list[str] = field(default_factory=list)
+    partitions_dropped: dict[str, int] = field(default_factory=dict)  # имя → байт на диске
+    archive_files: list[str] = field(default_factory=list)
+    started_at: datetime = field(default_factory=utc_now)
+    finished_at: Optional[datetime] = None
+
+    def table(self, name: str) -> TableReport:
+        return self.tables.setdefault(name, TableReport())
+
+    @property
+    def rows(self) -> int:
+        return sum(t.rows for t in self.tables.values())
+
+    @property
+    def bytes(self) -> int:
+        return sum(t.bytes for t in self.tables.values()) + sum(self.partitions_dropped.values())
+
+    def format(self) -> str:
+        title = "Retention (dry run)" if self.dry_run else "Retention"
+        lines = [f"{title}: {self.rows} row(s), ~{_human_bytes(self.bytes)}"]
+        for name, t in sorted(self.tables.items()):
+            line = f"  {name}: {t.rows} row(s)"
+            if not self.dry_run:
+                line += f", ~{_human_bytes(t.bytes)}"
+            if t.archived_bytes:
+                line += f", archive {_human_bytes(t.archived_bytes)}"
+            lines.append(line)
+        for name in self.partitions_created:
+            lines.append(f"  + partition {name}")
+        for name, size in self.partitions_dropped.items():
+            lines.append(f"  - partition {name} ({_human_bytes(size)})")
+        for path in self.archive_files:
+            lines.append(f"  archive: {path}")
+        if self.finished_at is not None:
+            lines.append(f"  took {(self.finished_at - self.started_at).total_seconds():.1f}s")
+        return "\n".join(lines)
+
+
+def _human_bytes(n: int) -> str:
+    size = float(n)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{n} B"
+
+
+class _Archive:
+    """gzip JSONL на таблицу за запуск; пачка дописывается отдельным gzip-членом (файл читается целиком)."""
+
+    def __init__(self, directory: str, stamp: str) -> None:
+        self._dir = Path(directory)
+        self._stamp = stamp
+        self.files: dict[str, Path] = {}
+
+    def _write(self, table: str, lines: Sequence[str]) -> int:
+        path = self.files.get(table)
+        if path is None:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            path = self.files[table] = self._dir / f"{table}-{self._stamp}.jsonl.gz"
+        before = path.stat().st_size if path.exists() else 0
+        with gzip.open(path, "at", encoding="utf-8") as fh:
+            fh.write("".join(f"{line}\n" for line in lines))
+        return path.stat().st_size - before
+
+    async def write(self, table: str, lines: Sequence[str]) -> int:
+        return await asyncio.to_thread(self._write, table, lines)
+
+
+async def _purge(
+    report: RetentionReport,
+    archive: Optional[_Archive],
+    table: Table,
+    where: Sequence[Any],
+    *,
+    batch_size: int,
+) -> int:
+    """Архивировать и удалить строки table по условию where пачками; вернуть число удалённых."""
+    stats = report.table(table.name)
+    if report.dry_run:
+        async with get_session() as session:
+            count = await session.scalar(select(func.count()).select_from(table).where(*where)) or 0
+        stats.rows += count
+        return count
+
+    pk = list(table.primary_key.columns)
+    deleted = 0
+    while True:
+        async with get_session() as session:
+            rows = (await session.execute(select(table).where(*where).limit(batch_size))).mappings().all()
+            if not rows:
+                break
+            lines = [json.dumps(dict(row), ensure_ascii=False, default=str) for row in rows]
+            if archive is not None:
+                # Сначала архив, потом DELETE: при сбое строки останутся в БД (в архиве — дубль)
+                stats.archived_bytes += await archive.write(table.name, lines)
+            if len(pk) == 1:
+                cond = pk[0].in_([row[pk[0].key] for row in rows])
+            else:
+                cond = tuple_(*pk).in_([tuple(row[c.key] for c in pk) for row in rows])
+            await session.execute(delete(table).where(cond))
+        payload = sum(len(line.encode("utf-8")) + 1 for line in lines)
+        stats.rows += len(rows)
+        stats.bytes += payload
+        deleted += len(rows)
+        RETENTION_ROWS_TOTAL.inc(len(rows), table=table.name)
+        RETENTION_BYTES_TOTAL.inc(payload, table=table.name)
+        if len(rows) < batch_size:
+            break
+        await asyncio.sleep(0)  # отдать цикл событий между пачками
+    return deleted
+
+
+async def _profile_cutoffs(now: datetime) -> dict[int, datetime]:
+    """profile_id → граница хранения диалогов (строки старше удаляются); профили без срока не попадают.
+
+    Срок — явный context_retention_days профиля; RETENTION_DIALOG_DAYS — только если задан (> 0).
+    """
+    async with get_session() as session:
+        rows = (await session.execute(
+            select(AvitoProfile.id, AISettings.context_retention_days)
+            .outerjoin(AISettings, AISettings.profile_id == AvitoProfile.id)
+        )).all()
+    cutoffs: dict[int, datetime] = {}
+    for profile_id, days in rows:
+        days = days or settings.RETENTION_DIALOG_DAYS
+        if days and days > 0:
+            cutoffs[profile_id] = now - timedelta(days=days)
+    return cutoffs
+
+
+# --- PostgreSQL: помесячные партиции ai_dialog_messages ---------------------------------
+
+def _month_start(value: datetime | date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month: date, n: int) -> date:
+    idx = month.year * 12 + month.month - 1 + n
+    return date(idx // 12, idx % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITIONED_TABLE}_p{month:%Y%m}"
+
+
+def _is_postgres() -> bool:
+    return async_engine.dialect.name == "postgresql"
+
+
+async def is_partitioned(session: Any) -> bool:
+    if not _is_postgres():
+        return False
+    return bool(await session.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"
+    ), {"t": PARTITIONED_TABLE}))
+
+
+async def _create_partition(session: Any, month: date) -> bool:
+    name = partition_name(month)
+    if await session.scalar(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": name}):
+        return False
+    await session.execute(text(
+        f'CREATE TABLE "{name}" PARTITION OF "{PARTITIONED_TABLE}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    ))
+    return True
+
+
+async def ensure_partitions(report: RetentionReport, now: datetime) -> None:
+    """Партиции на текущий и RETENTION_PARTITION_MONTHS_AHEAD следующих месяцев."""
+    month = _month_start(now)
+    for n in range(settings.RETENTION_PARTITION_MONTHS_AHEAD + 1):
+        target = _add_months(month, n)
+        try:
+            async with get_session() as session:
+                if await _create_partition(session, target):
+                    report.partitions_created.append(partition_name(target))
+        except Exception as exc:
+            # Например, строки этого месяца уже лежат в DEFAULT-партиции
+            logger.warning("Retention: cannot create partition %s: %s", partition_name(target), exc)
+
+
+async def drop_empty_partitions(report: RetentionReport, now: datetime) -> None:
+    """Удалить опустевшие партиции прошлых месяцев (строки из них уже вычищены и заархивированы)."""
+    current = _month_start(now)
+    async with get_session() as session:
+        names = (await session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:t)"
+        ), {"t": PARTITIONED_TABLE})).scalars().all()
+    prefix = f"{PARTITIONED_TABLE}_p"
+    for name in sorted(names):
+        suffix = name[len(prefix):] if name.startswith(prefix) else ""
+        if len(suffix) != 6 or not suffix.isdigit():
+            continue  # DEFAULT и чужие партиции
+        month = date(int(suffix[:4]), int(suffix[4:]), 1)
+        if _add_months(month, 1) > current:
+            continue
+        async with get_session() as session:
+            if await session.scalar(text(f'SELECT EXISTS (SELECT 1 FROM "{name}")')):
+                continue
+            size = await session.scalar(text("SELECT pg_total_relation_size(to_regclass(:n))"), {"n": name}) or 0
+            if report.dry_run:
+                report.partitions_dropped[name] = size
+                continue
+            await session.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" DETACH PARTITION "{name}"'))
+            await session.execute(text(f'DROP TABLE "{name}"'))
+        report.partitions_dropped[name] = size
+        logger.info("Retention: dropped empty partition %s (%s bytes)", name, size)
+
+
+async def convert_to_partitioned(months_ahead: Optional[int] = None) -> list[str]:
+    """
+    Перевести ai_dialog_messages на помесячные партиции (PostgreSQL, одна транзакция).
+
+    Таблица пересоздаётся с PRIMARY KEY (id, created_at) и DEFAULT-партицией, строки
+    копируются, индексы и внешние ключи переносятся. Держит эксклюзивную блокировку на
+    всё время копирования — запускать в окно обслуживания, при остановленном боте.
+    """
+    if not _is_postgres():
+        raise RuntimeError("Partitioning is supported on PostgreSQL only")
+    ahead = settings.RETENTION_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    old = f"{PARTITIONED_TABLE}_unpartitioned"
+    created: list[str] = []
+    async with get_session() as session:
+        if await is_partitioned(session):
+            return created
+        indexes = (await session.execute(text(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = :t"
+        ), {"t": PARTITIONED_TABLE})).all()
+        fks = (await session.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(:t) AND contype = 'f'"
+        ), {"t": PARTITIONED_TABLE})).all()
+        oldest = await session.scalar(text(f'SELECT min(created_at) FROM "{PARTITIONED_TABLE}"'))
+
+        await session.execute(text(f'LOCK TABLE "{PARTITIONED_TABLE}" IN ACCESS EXCLUSIVE MODE'))
+        await session.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" RENAME TO "{old}"'))
+        # Имена индексов (и _pkey) освобождаются для новой таблицы
+        for name, _ in indexes:
+            await session.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name}_unpartitioned"'))
+        for name, _ in fks:
+            await session.execute(text(f'ALTER TABLE "{old}" RENAME CONSTRAINT "{name}" TO "{name}_unpartitioned"'))
+        await session.execute(text(
+            f'CREATE TABLE "{PARTITIONED_TABLE}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING IDENTITY) '
+            "PARTITION BY RANGE (created_at)"
+        ))
+        await session.execute(text(
+            f'ALTER TABLE "{PARTITIONED_TABLE}" ADD CONSTRAINT "{PARTITIONED_TABLE}_pkey" PRIMARY KEY (id, created_at)'
+        ))
+        for name, definition in fks:
+            await session.execute(text(f'ALTER TABLE "{PARTITIONED_TABLE}" ADD CONSTRAINT "{name}" {definition}'))
+        await session.execute(text(
+            f'CREATE TABLE "{PARTITIONED_TABLE}_default" PARTITION OF "{PARTITIONED_TABLE}" DEFAULT'
+        ))
+        month = _month_start(oldest or utc_now())
+        last = _add_months(_month_start(utc_now()), ahead)
+        while month <= last:
+            await _create_partition(session, month)
+            created.append(partition_name(month))
+            month = _add_months(month, 1)
+        await session.execute(text(f'INSERT INTO "{PARTITIONED_TABLE}" SELECT * FROM "{old}"'))
+        # Последовательность id переходит к новой таблице, иначе DROP старой её удалит
+        await session.execute(text(
+            f"ALTER SEQUENCE IF EXISTS \"{PARTITIONED_TABLE}_id_seq\" OWNED BY \"{PARTITIONED_TABLE}\".id"
+        ))
+        await session.execute(text(f'DROP TABLE "{old}"'))
+        for name, definition in indexes:
+            if name == f"{PARTITIONED_TABLE}_pkey":
+                continue
+            # Определение ссылается на имя таблицы, которое теперь у партиционированной
+            await session.execute(text(definition))
+    logger.info("Retention: %s converted to %s monthly partition(s)", PARTITIONED_TABLE, len(created))
+    return created
+
+
+# --- Запуск ----------------------------------------------------------------------------
+
+async def run_retention(
+    *,
+    dry_run: bool = False,
+    now: Optional[datetime] = None,
+    archive_dir: Optional[str] = None,
+    batch_size: Optional[int] = None,
+) -> RetentionReport:
+    now = now or utc_now()
+    batch = max(1, batch_size or settings.RETENTION_BATCH_SIZE)
+    directory = settings.RETENTION_ARCHIVE_DIR if archive_dir is None else archive_dir
+    report = RetentionReport(dry_run=dry_run, started_at=now)
+    archive = _Archive(directory, now.strftime("%Y%m%d-%H%M%S")) if directory and not dry_run else None
+
+    messages = AIDialogMessage.__table__
+    states = AIDialogState.__table__
+    followups = ScheduledFollowup.__table__
+
+    cutoffs = await _profile_cutoffs(now)
+    for profile_id, cutoff in sorted(cutoffs.items()):
+        removed = await _purge(report, archive, messages, [
+            messages.c.profile_id == profile_id,
+            messages.c.created_at < cutoff,
+        ], batch_size=batch)
+        if removed:
+            dialog_history.invalidate(profile_id)
+        await _purge(report, archive, states, [
+            states.c.profile_id == profile_id,
+            states.c.last_client_message_at < cutoff,
+            ~exists().where(and_(
+                followups.c.user_id == states.c.user_id,
+                followups.c.profile_id == states.c.profile_id,
+                followups.c.dialog_id == states.c.dialog_id,
+                followups.c.status.in_(ACTIVE_FOLLOWUP_STATUSES),
+            )),
+        ], batch_size=batch)
+
+    if settings.RETENTION_FOLLOWUP_DAYS > 0:
+        await _purge(report, archive, followups, [
+            followups.c.status.in_(TERMINAL_FOLLOWUP_STATUSES),
+            followups.c.execute_at < now - timedelta(days=settings.RETENTION_FOLLOWUP_DAYS),
+        ], batch_size=batch)
+
+    async with get_session() as session:
+        partitioned = await is_partitioned(session)
+    if partitioned:
+        if not dry_run:
+            await ensure_partitions(report, now)
+        await drop_empty_partitions(report, now)
+
+    if archive is not None:
+        report.archive_files = [str(p) for p in archive.files.values()]
+    report.finished_at = utc_now()
+    return report
+
+
+async def run_retention_job() -> None:
+    """Джоб планировщика: раз в сутки, только на лидере (джобстор общий для всех реплик)."""
+    from core.leases import is_leader
+
+    if not settings.RETENTION_ENABLED or not await is_leader():
+        return
+    try:
+        report = await run_retention()
+    except Exception as e:
+        logger.exception("Retention job failed: %s", e)
+        return
+    logger.info("%s", report.format())
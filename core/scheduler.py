@@ -7,12 +7,22 @@ APScheduler: AsyncIOScheduler + SQLAlchemyJobStore.
 - Часовой пояс по умолчанию: Europe/Moscow (константа TIMEZONE ниже); для отчётов — profile.report_timezone.
 - В проде планировщик включается автоматически при старте бота (start_scheduler в main.py).
   Job «Лимиты по дням» (23:59 Moscow): DAILY_LIMITS_JOB_ID, см. run_daily_limits_job().
+- Хранение: RETENTION_JOB_ID раз в сутки (RETENTION_HOUR) — core.retention.run_retention_job().
+- Фоллоу-апы: core.followups (FollowupDispatcher по таймеру + страховочный опрос AI_FOLLOWUP_JOB_ID
+  в каждой реплике; смена партиции в heartbeat перезагружает heap диспетчера).
+- Несколько реплик: джобстор общий, поэтому каждый запуск отчёта берёт lease в job_leases,
+  периодический sync выполняет только лидер, фоллоу-апы делятся по profile_id (core.leases).
+  Джобы, которые должны идти в каждой реплике (heartbeat, опрос фоллоу-апов), живут в LOCAL_JOBSTORE
+  (MemoryJobStore): в общем джобсторе такой джоб один на кластер и срабатывает на случайной реплике.
 """
 import logging
 from datetime import date, datetime, timedelta
 from typing import Optional
 
 from aiogram import Bot
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED, JobEvent
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -23,10 +33,12 @@ from zoneinfo import ZoneInfo
 
 from core.config import settings
 from core.database.models import AvitoProfile, ReportTask, ProfileDailyLimits
-from core.database.models import AIDialogMessage, AIDialogState, AISettings, FollowupStep, ScheduledFollowup
 from core.database.session import get_session
-from core.llm.client import LLMClient
+from core.followups import followup_dispatcher, process_followups, run_followup_safety_poll  # noqa: F401
+from core.leases import get_partition, heartbeat, is_leader, leave_cluster, try_acquire_lease
+from core.metrics import SCHEDULER_JOB_LAG_SECONDS, SCHEDULER_JOBS_MISSED_TOTAL, job_label
 from core.report_runner import run_report, set_report_bot
+from core.retention import run_retention_job
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +46,10 @@ TIMEZONE = "Europe/Moscow"
 REPORT_JOB_ID_PREFIX = "report_task_"
 SYNC_JOB_ID = "report_sync_tasks"
 AI_FOLLOWUP_JOB_ID = "ai_followup_processor"
+LEASE_HEARTBEAT_JOB_ID = "worker_lease_heartbeat"
+RETENTION_JOB_ID = "retention"
+# Джобстор джобов «на каждую реплику» (в памяти процесса)
+LOCAL_JOBSTORE = "local"
 
 # Sync URL for SQLAlchemyJobStore: replace '+asyncpg' with '' -> standard postgresql://
 _url = settings.DATABASE_URL
@@ -67,11 +83,24 @@ logger.info("Scheduler JobStore using sync URL: %s", _mask_url(_jobstore_url))
 
 jobstores = {
     "default": SQLAlchemyJobStore(url=_jobstore_url),
+    LOCAL_JOBSTORE: MemoryJobStore(),
 }
 
 scheduler: Optional[AsyncIOScheduler] = None
 
 
+def _on_job_event(event: JobEvent) -> None:
+    """Метрики планировщика: задержка старта джоба относительно расписания и пропуски."""
+    job = job_label(event.job_id)
+    if event.code == EVENT_JOB_MISSED:
+        SCHEDULER_JOBS_MISSED_TOTAL.inc(job=job)
+        return
+    run_times = getattr(event, "scheduled_run_times", None) or []
+    if run_times:
+        lag = (datetime.now(run_times[-1].tzinfo) - run_times[-1]).total_seconds()
+        SCHEDULER_JOB_LAG_SECONDS.observe(max(0.0, lag), job=job)
+
+
 def get_scheduler() -> AsyncIOScheduler:
     global scheduler
     if scheduler is None:
@@ -79,6 +108,7 @@ def get_scheduler() -> AsyncIOScheduler:
             jobstores=jobstores,
             timezone=TIMEZONE,
         )
+        scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
     return scheduler
 
 
@@ -92,6 +122,10 @@ async def run_scheduled_report(task_id: int) -> None:
     if not bot:
         logger.warning("run_scheduled_report: bot not set, skip task_id=%s", task_id)
         return
+    # Lease не отпускаем: другая реплика, сработавшая на тот же слот, его не получит
+    if not await try_acquire_lease(f"{REPORT_JOB_ID_PREFIX}{task_id}", settings.REPORT_LEASE_TTL_SEC):
+        logger.debug("run_scheduled_report: task id=%s taken by another worker", task_id)
+        return
     async with get_session() as session:
         result = await session.execute(
             select(ReportTask)
@@ -251,6 +285,33 @@ async def sync_scheduler_tasks() -> None:
     logger.info("sync_scheduler_tasks: scheduled %s report job(s).", scheduled)
 
 
+async def run_periodic_sync() -> None:
+    """Периодическая пересинхронизация — только на лидере (джобстор общий для всех реплик)."""
+    if not await is_leader():
+        return
+    await sync_scheduler_tasks()
+
+
+async def run_lease_heartbeat() -> None:
+    before = get_partition()
+    try:
+        partition = await heartbeat()
+    except Exception as e:
+        logger.warning("Lease heartbeat failed: %s", e)
+        return
+    if partition != before:
+        # Часть профилей перешла к нам (или от нас): heap фоллоу-апов — по новой партиции
+        followup_dispatcher.reload()
+
+
+def _drop_shared_job(s: AsyncIOScheduler, job_id: str) -> None:
+    """Убрать из общего джобстора джоб, который теперь живёт в LOCAL_JOBSTORE (после обновления)."""
+    try:
+        s.remove_job(job_id, jobstore="default")
+    except JobLookupError:
+        pass
+
+
 async def start_scheduler(bot: Bot) -> None:
     """Запуск планировщика и синхронизация джобов отчётов из БД."""
     set_report_bot(bot)
@@ -259,132 +320,56 @@ async def start_scheduler(bot: Bot) -> None:
         return
     s.start()
     logger.info("Scheduler started (timezone=%s).", TIMEZONE)
+    await run_lease_heartbeat()
+    _drop_shared_job(s, LEASE_HEARTBEAT_JOB_ID)
+    _drop_shared_job(s, AI_FOLLOWUP_JOB_ID)
+    s.add_job(
+        run_lease_heartbeat,
+        "interval",
+        seconds=settings.WORKER_HEARTBEAT_SEC,
+        id=LEASE_HEARTBEAT_JOB_ID,
+        jobstore=LOCAL_JOBSTORE,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
     await sync_scheduler_tasks()
     # Периодическая пересинхронизация при изменении настроек (каждые 15 мин)
     s.add_job(
-        sync_scheduler_tasks,
+        run_periodic_sync,
         "interval",
         minutes=15,
         id=SYNC_JOB_ID,
         replace_existing=True,
     )
+    # Фоллоу-апы отправляет FollowupDispatcher по таймеру; опрос БД — только страховка
     s.add_job(
-        process_followups,
+        run_followup_safety_poll,
         "interval",
-        seconds=45,
+        seconds=settings.FOLLOWUP_SAFETY_POLL_SEC,
         id=AI_FOLLOWUP_JOB_ID,
+        jobstore=LOCAL_JOBSTORE,
         replace_existing=True,
         max_instances=1,
         coalesce=True,
     )
-
-
-async def process_followups() -> None:
-    from core.report_runner import _current_bot
-
-    bot = _current_bot
-    if not bot:
-        return
-
-    now = datetime.utcnow()
-    items_data: list[dict[str, object]] = []
-
-    async with get_session() as session:
-        stmt = (
-            select(ScheduledFollowup)
-            .where(ScheduledFollowup.status == "pending")
-            .where(ScheduledFollowup.execute_at <= now)
-            .order_by(ScheduledFollowup.execute_at.asc())
-            .limit(100)
-        )
-        if settings.DATABASE_URL.startswith("postgresql"):
-            stmt = stmt.with_for_update(skip_locked=True)
-
-        items = list((await session.execute(stmt)).scalars().all())
-        if not items:
-            return
-
-        for item in items:
-            item.status = "processing"
-
-        step_ids = [item.step_id for item in items]
-        profile_ids = [item.profile_id for item in items]
-        step_map = {step.id: step for step in (await session.execute(select(FollowupStep).where(FollowupStep.id.in_(step_ids)))).scalars().all()}
-        settings_map = {x.profile_id: x for x in (await session.execute(select(AISettings).where(AISettings.profile_id.in_(profile_ids)))).scalars().all()}
-
-        for item in items:
-            state = (await session.execute(select(AIDialogState).where(AIDialogState.user_id == item.user_id, AIDialogState.profile_id == item.profile_id, AIDialogState.dialog_id == item.dialog_id))).scalar_one_or_none()
-            items_data.append({
-                "id": item.id,
-                "user_id": item.user_id,
-                "profile_id": item.profile_id,
-                "step_id": item.step_id,
-                "dialog_id": item.dialog_id,
-                "converted": state.is_converted if state else item.converted,
-                "negative": state.has_negative if state else item.negative_detected,
-                "step": step_map.get(item.step_id),
-                "ai_settings": settings_map.get(item.profile_id),
-            })
-
-    llm = LLMClient()
-    updates: list[tuple[int, str]] = []
-    assistant_messages: list[dict[str, object]] = []
-
-    for item in items_data:
-        item_id = int(item["id"])
-        try:
-            step = item["step"]
-            ai_settings = item["ai_settings"]
-            if step is None or ai_settings is None:
-                updates.append((item_id, "failed"))
-                continue
-
-            converted = bool(item["converted"])
-            negative = bool(item["negative"])
-            if step.send_mode == "if_not_converted" and converted:
-                updates.append((item_id, "canceled"))
-                continue
-            if step.send_mode == "if_not_converted_and_no_negative" and (converted or negative):
-                updates.append((item_id, "canceled"))
-                continue
-
-            text = step.content_text or ""
-            if step.content_type == "llm":
-                text = await llm.generate_followup(ai_settings, step.content_text or "", {
-                    "user_id": item["user_id"],
-                    "profile_id": item["profile_id"],
-                    "step_id": item["step_id"],
-                    "dialog_id": item["dialog_id"],
-                })
-
-            await bot.send_message(chat_id=int(item["user_id"]), text=text)
-            assistant_messages.append({
-                "user_id": int(item["user_id"]),
-                "profile_id": int(item["profile_id"]),
-                "dialog_id": str(item["dialog_id"]),
-                "content": text,
-            })
-            updates.append((item_id, "sent"))
-        except Exception:
-            logger.exception("process_followups failed for id=%s", item_id)
-            updates.append((item_id, "failed"))
-
-    async with get_session() as session:
-        update_ids = [item_id for item_id, _ in updates]
-        if update_ids:
-            rows_map = {row.id: row for row in (await session.execute(select(ScheduledFollowup).where(ScheduledFollowup.id.in_(update_ids)))).scalars().all()}
-            for item_id, status in updates:
-                row = rows_map.get(item_id)
-                if row:
-                    row.status = status
-
-        for msg in assistant_messages:
-            session.add(AIDialogMessage(user_id=msg["user_id"], profile_id=msg["profile_id"], dialog_id=msg["dialog_id"], role="assistant", content=msg["content"], created_at=datetime.utcnow()))
+    # Чистка старых диалогов и фоллоу-апов (core.retention), только на лидере
+    s.add_job(
+        run_retention_job,
+        CronTrigger(hour=settings.RETENTION_HOUR, minute=0, timezone=TIMEZONE),
+        id=RETENTION_JOB_ID,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    await followup_dispatcher.start()
 
 
 async def stop_scheduler() -> None:
     global scheduler
+    await followup_dispatcher.stop()
     if scheduler and scheduler.running:
         scheduler.shutdown(wait=False)
         scheduler = None
+        await leave_cluster()
         logger.info("Scheduler stopped.")
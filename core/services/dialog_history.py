@@ -0,0 +1,163 @@
+"""
+Кэш последних реплик диалогов для контекста LLM: кольцевой буфер на диалог, LRU по диалогам.
+
+Буфер диалога заполняется из БД при первом обращении (последние DIALOG_CACHE_TURNS строк)
+и дополняется при каждой новой строке AIDialogMessage (write-behind буфер, ответы
+фоллоу-апов), так что контекст активного диалога собирается без чтения из БД.
+Ответ из кэша возможен, если кольцо покрывает запрошенное окно: в нём вся история
+диалога, или самая старая реплика кольца не новее нижней границы окна, или в кольце
+уже есть limit реплик новее границы. Иначе вызывающий код идёт в БД.
+
+Кэш локален для процесса: при нескольких живых репликах (core.leases.get_partition)
+load_dialog_context его не использует и сбрасывает — реплики пишут в один диалог.
+
+Память: общий потолок DIALOG_CACHE_MAX_BYTES (оценка по длине текста), диалоги без
+обращений дольше DIALOG_CACHE_IDLE_SEC вытесняются первыми.
+"""
+from __future__ import annotations
+
+import bisect
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Sequence
+
+from core.config import settings
+from core.metrics import DIALOG_CACHE_BYTES, DIALOG_CACHE_DIALOGS, DIALOG_CACHE_REQUESTS_TOTAL
+
+Turn = tuple[datetime, str, str]  # (created_at, role, content)
+DialogKey = tuple[int, int, Optional[str]]  # (user_id, profile_id, dialog_id)
+
+# Накладные расходы на реплику сверх текста: кортеж, datetime, строки ролей
+_TURN_OVERHEAD_BYTES = 160
+
+
+def _turn_size(turn: Turn) -> int:
+    return len(turn[2]) * 2 + _TURN_OVERHEAD_BYTES
+
+
+class _Ring:
+    __slots__ = ("turns", "complete", "size", "touched")
+
+    def __init__(self, capacity: int) -> None:
+        self.turns: deque[Turn] = deque(maxlen=capacity)
+        # True — в кольце вся история диалога (из БД пришло меньше строк, чем вмещает кольцо)
+        self.complete = False
+        self.size = 0
+        self.touched = time.monotonic()
+
+    def add(self, turn: Turn) -> int:
+        """Добавить реплику по порядку created_at; возвращает изменение размера в байтах."""
+        full = len(self.turns) == self.turns.maxlen
+        in_order = not self.turns or self.turns[-1][0] <= turn[0]
+        idx = len(self.turns)
+        if not in_order:
+            # Редкий случай: строка с более ранним created_at пришла позже (фоллоу-ап)
+            idx = bisect.bisect_right([t[0] for t in self.turns], turn[0])
+            if full and idx == 0:
+                self.complete = False  # старее всего кольца — не помещается
+                return 0
+        delta = _turn_size(turn)
+        if full:
+            delta -= _turn_size(self.turns.popleft())
+            self.complete = False
+            idx -= 1
+        self.turns.insert(idx, turn)
+        self.size += delta
+        return delta
+
+    def recent(self, lower: Optional[datetime], limit: Optional[int]) -> Optional[list[Turn]]:
+        turns = [t for t in self.turns if lower is None or t[0] > lower]
+        covered = (
+            self.complete
+            or (lower is not None and bool(self.turns) and self.turns[0][0] <= lower)
+            or (bool(limit) and len(turns) >= limit)  # type: ignore[operator]
+        )
+        if not covered:
+            return None
+        return turns[-limit:] if limit else turns
+
+
+class DialogHistoryCache:
+    def __init__(self, turns_per_dialog: int, max_bytes: int, idle_sec: float) -> None:
+        self._capacity = max(1, turns_per_dialog)
+        self._max_bytes = max(1, max_bytes)
+        self._idle_sec = idle_sec
+        self._rings: OrderedDict[DialogKey, _Ring] = OrderedDict()
+        self._bytes = 0
+        # Диалоги, которые сейчас загружаются из БД: новые реплики копятся здесь
+        self._filling: dict[DialogKey, list[Turn]] = {}
+
+    def append(self, key: DialogKey, turn: Turn) -> None:
+        """Новая строка диалога; диалоги, которых нет в кэше, не загружаются."""
+        filling = self._filling.get(key)
+        if filling is not None:
+            filling.append(turn)
+        ring = self._rings.get(key)
+        if ring is not None and turn not in ring.turns:
+            self._bytes += ring.add(turn)
+            self._evict()
+
+    def recent(self, key: DialogKey, lower: Optional[datetime], limit: Optional[int]) -> Optional[list[Turn]]:
+        """Последние limit реплик новее lower из кэша или None (нет в кэше / кольцо не покрывает окно)."""
+        ring = self._rings.get(key)
+        if ring is None:
+            return None
+        ring.touched = time.monotonic()
+        self._rings.move_to_end(key)
+        turns = ring.recent(lower, limit)
+        DIALOG_CACHE_REQUESTS_TOTAL.inc(result="hit" if turns is not None else "bypass")
+        self._evict()
+        return turns
+
+    async def fill(self, key: DialogKey, load: Callable[[int], Awaitable[Sequence[Turn]]]) -> None:
+        """Загрузить кольцо: load(n) — последние n реплик из БД (с учётом write-behind буфера)."""
+        if key in self._rings or key in self._filling:
+            return
+        DIALOG_CACHE_REQUESTS_TOTAL.inc(result="miss")
+        self._filling[key] = []
+        try:
+            rows = list(await load(self._capacity))
+        finally:
+            arrived = self._filling.pop(key, [])
+        ring = _Ring(self._capacity)
+        ring.complete = len(rows) < self._capacity
+        seen = set(rows)
+        for turn in sorted([*rows, *(t for t in arrived if t not in seen)], key=lambda t: t[0]):
+            ring.add(turn)
+        self._rings[key] = ring
+        self._bytes += ring.size
+        self._evict()
+
+    def invalidate(self, profile_id: Optional[int] = None) -> None:
+        """Сбросить кэш профиля (или весь) — после удаления строк из ai_dialog_messages."""
+        for key in [k for k in self._rings if profile_id is None or k[1] == profile_id]:
+            self._bytes -= self._rings.pop(key).size
+
+    def _evict(self) -> None:
+        deadline = time.monotonic() - self._idle_sec
+        while self._rings:
+            key, ring = next(iter(self._rings.items()))
+            if self._bytes <= self._max_bytes and ring.touched > deadline:
+                break
+            self._rings.popitem(last=False)
+            self._bytes -= ring.size
+
+    def __contains__(self, key: DialogKey) -> bool:
+        return key in self._rings
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+
+dialog_history = DialogHistoryCache(
+    settings.DIALOG_CACHE_TURNS,
+    settings.DIALOG_CACHE_MAX_BYTES,
+    settings.DIALOG_CACHE_IDLE_SEC,
+)
+DIALOG_CACHE_DIALOGS.set_function(lambda: len(dialog_history))
+DIALOG_CACHE_BYTES.set_function(lambda: dialog_history.bytes)
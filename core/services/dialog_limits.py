@@ -0,0 +1,173 @@
+"""
+Лимиты ИИ-продавца на входящие сообщения клиентов — в памяти процесса, без COUNT(*) на каждое сообщение.
+
+Считаются только принятые сообщения клиента, role="user" (сообщения сверх лимита в историю
+не пишутся; сообщения со стоп-словом пишутся, но в памяти не учитываются — после рестарта
+COUNT их посчитает):
+- messages_per_minute_limit — скользящее окно 60 с на профиль;
+- daily_dialog_limit — разных диалогов за сутки (UTC) на профиль; новый диалог сверх лимита
+  не обслуживается, если включён block_on_limit (как и раньше);
+- per_dialog_message_limit — сообщений в диалоге всего;
+- cooldown_after_n_messages / cooldown_minutes — после N сообщений подряд (без паузы
+  cooldown_minutes) диалог молчит cooldown_minutes.
+
+Окна профилей загружаются из БД при старте (seed()), счётчик диалога — одним COUNT при
+первом обращении к диалогу после старта или вытеснения (LRU на LIMITER_MAX_DIALOGS).
+Дальше каждая проверка — O(1). Тест-чат и webhook Avito вызывают один и тот же acquire();
+тест-чат — с dialog_limits=False: его единственный диалог «default» живёт, пока владелец
+тестирует профиль, и лимит на диалог / пауза закрыли бы его навсегда.
+"""
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import func, select
+
+from core.config import settings
+from core.database.models import AIDialogMessage
+from core.database.session import get_session
+
+logger = logging.getLogger(__name__)
+
+_MINUTE = timedelta(minutes=1)
+
+# Причины отказа (acquire() → str)
+LIMIT_PER_MINUTE = "per_minute"
+LIMIT_DAILY_DIALOGS = "daily_dialogs"
+LIMIT_DIALOG_MESSAGES = "dialog_messages"
+LIMIT_COOLDOWN = "cooldown"
+
+
+@dataclass
+class _ProfileWindow:
+    minute: deque[datetime] = field(default_factory=deque)
+    day: Optional[date] = None
+    dialogs_today: set[str] = field(default_factory=set)
+
+    def roll(self, now: datetime) -> None:
+        border = now - _MINUTE
+        while self.minute and self.minute[0] <= border:
+            self.minute.popleft()
+        if self.day != now.date():
+            self.day = now.date()
+            self.dialogs_today = set()
+
+
+@dataclass
+class _DialogCounter:
+    total: int = 0
+    streak: int = 0
+    last_at: Optional[datetime] = None
+    cooldown_until: Optional[datetime] = None
+
+
+class DialogLimiter:
+    def __init__(self, max_dialogs: int) -> None:
+        self._max_dialogs = max(1, max_dialogs)
+        self._profiles: dict[int, _ProfileWindow] = {}
+        self._dialogs: OrderedDict[tuple[int, str], _DialogCounter] = OrderedDict()
+
+    async def _load_dialog_count(self, profile_id: int, dialog_id: str) -> int:
+        async with get_session() as session:
+            return await session.scalar(
+                select(func.count()).select_from(AIDialogMessage).where(
+                    AIDialogMessage.profile_id == profile_id,
+                    AIDialogMessage.dialog_id == dialog_id,
+                    AIDialogMessage.role == "user",
+                )
+            ) or 0
+
+    async def _dialog(self, profile_id: int, dialog_id: str) -> _DialogCounter:
+        key = (profile_id, dialog_id)
+        counter = self._dialogs.get(key)
+        if counter is None:
+            total = await self._load_dialog_count(profile_id, dialog_id)
+            # Пока шёл запрос, счётчик мог создать параллельный вызов
+            counter = self._dialogs.setdefault(key, _DialogCounter(total=total))
+            while len(self._dialogs) > self._max_dialogs:
+                self._dialogs.popitem(last=False)
+        self._dialogs.move_to_end(key)
+        return counter
+
+    def _profile(self, profile_id: int, now: datetime) -> _ProfileWindow:
+        window = self._profiles.get(profile_id)
+        if window is None:
+            window = self._profiles[profile_id] = _ProfileWindow()
+        window.roll(now)
+        return window
+
+    async def acquire(
+        self,
+        ai: Any,
+        profile_id: int,
+        dialog_id: str,
+        now: Optional[datetime] = None,
+        dialog_limits: bool = True,
+    ) -> Optional[str]:
+        """
+        Принять сообщение клиента: None и учесть его, либо причина отказа (сообщение не учитывается).
+        dialog_limits=False — только лимиты профиля (в минуту, диалогов в сутки), без
+        per_dialog_message_limit и cooldown.
+        """
+        now = now or datetime.utcnow()
+        dialog = await self._dialog(profile_id, dialog_id) if dialog_limits else None
+        window = self._profile(profile_id, now)
+
+        if dialog is not None:
+            if dialog.cooldown_until is not None and now < dialog.cooldown_until:
+                return LIMIT_COOLDOWN
+            if ai.per_dialog_message_limit and dialog.total >= ai.per_dialog_message_limit:
+                return LIMIT_DIALOG_MESSAGES
+        if (
+            ai.block_on_limit
+            and ai.daily_dialog_limit
+            and dialog_id not in window.dialogs_today
+            and len(window.dialogs_today) >= ai.daily_dialog_limit
+        ):
+            return LIMIT_DAILY_DIALOGS
+        if ai.messages_per_minute_limit and len(window.minute) >= ai.messages_per_minute_limit:
+            return LIMIT_PER_MINUTE
+
+        window.minute.append(now)
+        window.dialogs_today.add(dialog_id)
+        if dialog is None:
+            return None
+        pause = timedelta(minutes=ai.cooldown_minutes or 0)
+        if dialog.last_at is not None and now - dialog.last_at >= pause:
+            dialog.streak = 0
+        dialog.total += 1
+        dialog.streak += 1
+        dialog.last_at = now
+        if ai.cooldown_after_n_messages and pause and dialog.streak >= ai.cooldown_after_n_messages:
+            dialog.cooldown_until = now + pause
+            dialog.streak = 0
+        return None
+
+    async def seed(self, now: Optional[datetime] = None) -> None:
+        """Окна профилей из БД: сообщения за последнюю минуту и диалоги за текущие сутки."""
+        now = now or datetime.utcnow()
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        async with get_session() as session:
+            dialogs = (await session.execute(
+                select(AIDialogMessage.profile_id, AIDialogMessage.dialog_id)
+                .where(AIDialogMessage.role == "user", AIDialogMessage.created_at >= day_start)
+                .group_by(AIDialogMessage.profile_id, AIDialogMessage.dialog_id)
+            )).all()
+            recent = (await session.execute(
+                select(AIDialogMessage.profile_id, AIDialogMessage.created_at)
+                .where(AIDialogMessage.role == "user", AIDialogMessage.created_at > now - _MINUTE)
+                .order_by(AIDialogMessage.created_at)
+            )).all()
+        self._profiles.clear()
+        for profile_id, dialog_id in dialogs:
+            self._profile(profile_id, now).dialogs_today.add(dialog_id or "")
+        for profile_id, created_at in recent:
+            self._profile(profile_id, now).minute.append(created_at)
+        logger.info("DialogLimiter: seeded %s profile(s), %s dialog(s) today", len(self._profiles), len(dialogs))
+
+
+dialog_limiter = DialogLimiter(settings.LIMITER_MAX_DIALOGS)
@@ -0,0 +1,160 @@
+"""
+Write-behind буфер для AIDialogMessage.
+
+Сообщения диалогов (тест-чат, webhook) не пишутся отдельным INSERT + COMMIT: они копятся
+в памяти и сбрасываются одним multi-row INSERT раз в DIALOG_BUFFER_FLUSH_MS или при
+DIALOG_BUFFER_MAX_ROWS строк — общим для всех диалогов.
+
+Read-your-writes: пока строка не в БД, её видно через pending_messages(); контекст
+собирается через merge_rows() в core.llm.context (снимок буфера берётся ДО запроса к БД, дубликаты,
+успевшие записаться между снимком и запросом, отсекаются). При остановке — flush().
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Iterable, Optional, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from core.config import settings
+from core.database.models import AIDialogMessage
+from core.database.session import get_session
+from core.metrics import DIALOG_BUFFER_ROWS
+from core.services.dialog_history import dialog_history
+
+logger = logging.getLogger(__name__)
+
+DialogKey = tuple[int, int, Optional[str]]  # (user_id, profile_id, dialog_id)
+
+
+def _key(row: dict[str, Any]) -> DialogKey:
+    return (row["user_id"], row["profile_id"], row.get("dialog_id"))
+
+
+class DialogMessageBuffer:
+    def __init__(self, flush_interval_ms: int, max_rows: int) -> None:
+        self._interval = max(1, flush_interval_ms) / 1000
+        self._max_rows = max(1, max_rows)
+        self._pending: list[dict[str, Any]] = []
+        # Строки, которые сейчас пишутся: для читателя они ещё «в буфере»
+        self._inflight: list[dict[str, Any]] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(
+        self,
+        *,
+        user_id: int,
+        profile_id: int,
+        dialog_id: Optional[str],
+        role: str,
+        content: str,
+        created_at: Optional[datetime] = None,
+    ) -> None:
+        created_at = created_at or datetime.utcnow()
+        self._pending.append({
+            "user_id": user_id,
+            "profile_id": profile_id,
+            "dialog_id": dialog_id,
+            "role": role,
+            "content": content,
+            "created_at": created_at,
+        })
+        dialog_history.append((user_id, profile_id, dialog_id), (created_at, role, content))
+        if len(self._pending) >= self._max_rows:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._interval, self._spawn_flush)
+
+    def pending_messages(self, user_id: int, profile_id: int, dialog_id: Optional[str]) -> list[dict[str, Any]]:
+        """Ещё не записанные в БД сообщения диалога (по порядку добавления)."""
+        key = (user_id, profile_id, dialog_id)
+        return [row for row in (*self._inflight, *self._pending) if _key(row) == key]
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    def _spawn_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> int:
+        """Записать всё накопленное; при ошибке строки возвращаются в буфер до следующего сброса."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, []
+            try:
+                written = await self._write(self._inflight)
+            except Exception as exc:
+                logger.warning("DialogMessageBuffer: flush of %s row(s) failed, will retry: %s", len(self._inflight), exc)
+                self._pending[:0] = self._inflight
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self._interval, self._spawn_flush)
+                return 0
+            finally:
+                self._inflight = []
+            return written
+
+    async def _write(self, rows: list[dict[str, Any]]) -> int:
+        try:
+            async with get_session() as session:
+                await session.execute(insert(AIDialogMessage), rows)
+            return len(rows)
+        except IntegrityError:
+            # Профиль/пользователь удалён, пока строки ждали: пишем поштучно, битые отбрасываем
+            written = 0
+            for row in rows:
+                try:
+                    async with get_session() as session:
+                        await session.execute(insert(AIDialogMessage), [row])
+                    written += 1
+                except IntegrityError:
+                    logger.info("DialogMessageBuffer: dropped row for deleted profile_id=%s", row["profile_id"])
+            return written
+
+    async def stop(self) -> None:
+        """Сбросить буфер при остановке процесса."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        await self.flush()
+        if self._pending:
+            logger.error("DialogMessageBuffer: %s row(s) lost on shutdown", len(self._pending))
+
+
+def merge_rows(
+    db_rows: Iterable[AIDialogMessage],
+    pending: Sequence[dict[str, Any]],
+    limit: Optional[int] = None,
+) -> list[tuple[datetime, str, str]]:
+    """
+    История диалога из БД + ещё не записанные строки как (created_at, role, content),
+    старые → новые, не больше limit. pending должен быть снят до запроса к БД: строка,
+    успевшая записаться, придёт из БД, и её копия из снимка отбрасывается.
+    """
+    items = [(m.created_at, m.role, m.content) for m in db_rows]
+    seen = set(items)
+    items.extend(
+        (row["created_at"], row["role"], row["content"])
+        for row in pending
+        if (row["created_at"], row["role"], row["content"]) not in seen
+    )
+    items.sort(key=lambda item: item[0])
+    if limit:
+        items = items[-limit:]
+    return items
+
+
+dialog_messages = DialogMessageBuffer(settings.DIALOG_BUFFER_FLUSH_MS, settings.DIALOG_BUFFER_MAX_ROWS)
+DIALOG_BUFFER_ROWS.set_function(lambda: len(dialog_messages))
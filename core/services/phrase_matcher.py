@@ -0,0 +1,128 @@
+"""
+Стоп-слова и негативные фразы ИИ-продавца: один скомпилированный шаблон на профиль.
+
+Фразы профиля (AISettings.stop_words — через запятую или с новой строки,
+AISettings.negative_phrases — JSON-список, плюс фразы по умолчанию) собираются в одно
+регулярное выражение: альтернативы сложены в префиксное дерево («не (?:интересно|надо|...)»),
+поэтому текст проходится один раз, сколько бы фраз ни было. Совпадение — по границам
+слов, без учёта регистра и разницы «ё»/«е».
+
+Шаблон строится один раз на ревизию настроек: кэш по profile_id хранит исходные строки
+stop_words/negative_phrases, и при их изменении матчер пересобирается. Тест-чат и
+webhook Avito вызывают один и тот же get_matcher(ai).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEGATIVE_PHRASES = ("не интересно", "не надо", "не буду", "не хочу")
+
+_STOP_SPLIT_RE = re.compile(r"[,;\n]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    return _SPACE_RE.sub(" ", text.casefold().replace("ё", "е")).strip()
+
+
+def parse_stop_words(raw: Optional[str]) -> list[str]:
+    return [w for w in (normalize(p) for p in _STOP_SPLIT_RE.split(raw or "")) if w]
+
+
+def parse_negative_phrases(raw: Optional[str]) -> list[str]:
+    phrases = list(DEFAULT_NEGATIVE_PHRASES)
+    if raw:
+        try:
+            extra = json.loads(raw)
+        except ValueError:
+            extra = None
+        if isinstance(extra, list):
+            phrases.extend(str(p) for p in extra)
+        else:
+            logger.warning("negative_phrases is not a JSON list, using defaults: %.80r", raw)
+    return [p for p in (normalize(p) for p in phrases) if p]
+
+
+def _trie_pattern(phrases: Iterable[str]) -> str:
+    """Альтернатива фраз, сложенная в префиксное дерево: общий префикс проверяется один раз."""
+    trie: dict[str, Any] = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: dict[str, Any]) -> str:
+        end = "" in node
+        branches = [
+            (" " if ch == " " else re.escape(ch)) + build(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Фраза может закончиться здесь или продолжиться: жадно пробуется более длинная
+        return "(?:" + body + ")?" if end else body
+
+    return build(trie)
+
+
+@dataclass(frozen=True)
+class PhraseMatch:
+    stop_word: Optional[str] = None
+    negative: bool = False
+
+
+class PhraseMatcher:
+    def __init__(self, stop_words: Iterable[str], negative_phrases: Iterable[str]) -> None:
+        groups = []
+        stop = _trie_pattern(set(stop_words))
+        negative = _trie_pattern(set(negative_phrases))
+        if stop:
+            groups.append(f"(?P<stop>{stop})")
+        if negative:
+            groups.append(f"(?P<neg>{negative})")
+        self._pattern = (
+            re.compile(r"(?<!\w)(?:" + "|".join(groups) + r")(?!\w)") if groups else None
+        )
+
+    @classmethod
+    def from_settings(cls, ai: Any) -> "PhraseMatcher":
+        return cls(parse_stop_words(ai.stop_words), parse_negative_phrases(ai.negative_phrases))
+
+    def scan(self, text: str) -> PhraseMatch:
+        """Первое стоп-слово и признак негатива — за один проход по тексту."""
+        if self._pattern is None or not text:
+            return PhraseMatch()
+        stop_word: Optional[str] = None
+        negative = False
+        for m in self._pattern.finditer(normalize(text)):
+            if m.lastgroup == "stop":
+                stop_word = stop_word or m.group()
+            else:
+                negative = True
+            if stop_word and negative:
+                break
+        return PhraseMatch(stop_word=stop_word, negative=negative)
+
+
+# profile_id → ((stop_words, negative_phrases) как в AISettings, матчер)
+_matchers: dict[int, tuple[tuple[Optional[str], Optional[str]], PhraseMatcher]] = {}
+
+
+def get_matcher(ai: Any) -> PhraseMatcher:
+    """Матчер профиля (AISettings или его снимок); пересобирается, только если фразы изменились."""
+    revision = (ai.stop_words, ai.negative_phrases)
+    entry = _matchers.get(ai.profile_id)
+    if entry is not None and entry[0] == revision:
+        return entry[1]
+    matcher = PhraseMatcher.from_settings(ai)
+    _matchers[ai.profile_id] = (revision, matcher)
+    return matcher
+
@@ -0,0 +1,112 @@
+"""
+Кэш профиля и настроек ИИ для горячего пути webhook (ключ — Avito user_id).
+
+Запись кэша — неизменяемый снимок: id/owner профиля + AISettings как namedtuple.
+Хендлеры, меняющие профиль или AISettings, вызывают invalidate_on_commit(session, profile_id):
+запись удаляется после успешного commit этой сессии (а не до, иначе параллельный webhook
+успел бы закэшировать старые значения). Промах, во время чтения которого случилась
+инвалидация (счётчик _generation), результат не кэширует: снимок мог быть прочитан до commit.
+TTL — страховка от изменений в обход хендлеров.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.database.models import AISettings, AvitoProfile
+from core.database.session import get_session
+
+logger = logging.getLogger(__name__)
+
+AISettingsSnapshot = namedtuple(  # type: ignore[misc]
+    "AISettingsSnapshot", [c.key for c in AISettings.__table__.columns]
+)
+
+_INFO_KEY = "profile_cache_invalidate"
+# «Профиль не найден» кэшируем коротко: новый профиль может появиться в любой момент
+_MISS_TTL_SEC = 60
+
+
+@dataclass(frozen=True)
+class CachedProfile:
+    profile_id: int
+    owner_id: int
+    avito_user_id: int
+    ai: Optional[AISettingsSnapshot]
+
+
+def snapshot_ai_settings(ai: AISettings) -> AISettingsSnapshot:
+    return AISettingsSnapshot(**{key: getattr(ai, key) for key in AISettingsSnapshot._fields})
+
+
+_entries: dict[int, tuple[float, Optional[CachedProfile]]] = {}
+_stats: dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0}
+# Растёт при каждой инвалидации
+_generation = 0
+
+
+async def get_webhook_profile(avito_user_id: int) -> Optional[CachedProfile]:
+    """Профиль + снимок AISettings по Avito user_id; из БД только при промахе/истечении TTL."""
+    now = time.monotonic()
+    entry = _entries.get(avito_user_id)
+    if entry is not None and entry[0] > now:
+        _stats["hits"] += 1
+        return entry[1]
+    _stats["misses"] += 1
+    generation = _generation
+    async with get_session() as session:
+        profile = (await session.execute(
+            select(AvitoProfile).where(AvitoProfile.user_id == avito_user_id)
+        )).scalars().first()
+        if profile is None:
+            if generation == _generation:
+                _entries[avito_user_id] = (now + _MISS_TTL_SEC, None)
+            return None
+        ai = await session.get(AISettings, profile.id)
+        cached = CachedProfile(
+            profile_id=profile.id,
+            owner_id=profile.owner_id,
+            avito_user_id=avito_user_id,
+            ai=snapshot_ai_settings(ai) if ai is not None else None,
+        )
+    if generation == _generation:
+        _entries[avito_user_id] = (now + settings.PROFILE_CACHE_TTL_SEC, cached)
+    return cached
+
+
+def invalidate_profile(profile_id: int) -> None:
+    """Удалить из кэша все записи профиля (и «не найден» — профиль мог получить user_id)."""
+    global _generation
+    _generation += 1
+    for user_id, (_, cached) in list(_entries.items()):
+        if cached is None or cached.profile_id == profile_id:
+            _entries.pop(user_id, None)
+    _stats["invalidations"] += 1
+
+
+def invalidate_on_commit(session: Any, profile_id: int) -> None:
+    """Запланировать invalidate_profile(profile_id) после commit сессии (AsyncSession или Session)."""
+    session.info.setdefault(_INFO_KEY, set()).add(profile_id)
+
+
+def get_profile_cache_stats() -> dict[str, int]:
+    return {"size": len(_entries), **_stats}
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session) -> None:
+    pending = session.info.pop(_INFO_KEY, None)
+    for profile_id in pending or ():
+        invalidate_profile(profile_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session: Session, previous_transaction: Any) -> None:
+    session.info.pop(_INFO_KEY, None)
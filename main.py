@@ -59,10 +59,13 @@ try:
     from bot.handlers.ai_mode import router as ai_mode_router
     from bot.handlers.ai_admin import router as ai_admin_router
     from bot.handlers.daily_limits import router as daily_limits_router
-    from bot.middleware import DbSessionMiddleware
+    from bot.middleware import DbSessionMiddleware, TelegramMetricsMiddleware
     from core.database.session import async_engine, init_db
     from core.scheduler import start_scheduler, stop_scheduler
     from core.avito.webhook_server import start_webhook_server, stop_webhook_server
+    from core.llm.client import close_llm_clients
+    from core.services.dialog_limits import dialog_limiter
+    from core.services.message_buffer import dialog_messages
 except Exception as e:
     print(f">>> DEBUG: IMPORT ERROR: {e}", flush=True)
     logger.exception("Failed during module imports")
@@ -112,6 +115,10 @@ async def on_startup(bot: Bot) -> None:
         logger.info("Ключ OpenAI задан (%s символов) — ответы ИИ через API.", len(llm_key))
     await bot.set_my_commands(BOT_COMMANDS)
     await init_db()
+    try:
+        await dialog_limiter.seed()
+    except Exception as exc:
+        logger.exception("Failed to seed dialog limits: %s", exc)
     await start_scheduler(bot)  # запуск APScheduler + первичный sync_scheduler_tasks()
     # Webhook server for Avito Messenger (optional)
     global _webhook_runner
@@ -125,13 +132,20 @@ async def on_startup(bot: Bot) -> None:
 async def on_shutdown(bot: Bot) -> None:
     """Остановка планировщика и закрытие соединений."""
     await stop_scheduler()
-    await async_engine.dispose()
+    # Webhook-очередь дорабатывает с БД, поэтому останавливаем её до dispose()
     global _webhook_runner
     try:
         await stop_webhook_server(_webhook_runner)
     except Exception as exc:
         logger.exception("Failed to stop Avito webhook server: %s", exc)
     _webhook_runner = None
+    # Последние ответы webhook/тест-чата могут быть ещё в write-behind буфере
+    try:
+        await dialog_messages.stop()
+    except Exception as exc:
+        logger.exception("Failed to flush dialog message buffer: %s", exc)
+    await close_llm_clients()
+    await async_engine.dispose()
     logger.info("Бот остановлен, соединения закрыты.")
 
 
@@ -170,6 +184,7 @@ async def _create_bot_and_dispatcher():
         token=settings.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
+    bot.session.middleware(TelegramMetricsMiddleware())
     dp = Dispatcher()
     dp["bot"] = bot
 
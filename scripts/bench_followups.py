@@ -0,0 +1,158 @@
+"""
+Бенчмарк process_followups: число обращений к БД (round trips) и время на N наступивших фоллоу-апов.
+
+Сравнивает прежнюю схему (select AIDialogState на каждую строку, повторная загрузка строк
+для статусов, AIDialogMessage по одному) с текущей (один JOIN на пачку, UPDATE ... WHERE id IN
+по статусам, multi-row INSERT ответов). Отправка в Telegram — заглушка, LLM — stub.
+
+Запуск: python scripts/bench_followups.py [--count 10000]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_DB_PATH = Path(tempfile.mkdtemp()) / "bench_followups.db"
+os.environ.setdefault("BOT_TOKEN", "bench-token")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_DB_PATH}"
+os.environ["LLM_API_KEY"] = ""
+os.environ["OPENAI_API_KEY"] = ""
+
+from sqlalchemy import event, select, update  # noqa: E402
+
+from core.database.models import (  # noqa: E402
+    AIDialogMessage,
+    AIDialogState,
+    AISettings,
+    AvitoProfile,
+    FollowupStep,
+    ScheduledFollowup,
+    User,
+)
+from core.database.session import async_engine, get_session, init_db  # noqa: E402
+from core.timezone import utc_now  # noqa: E402
+
+BATCH = 100
+
+
+class _FakeBot:
+    async def send_message(self, chat_id: int, text: str) -> None:
+        await asyncio.sleep(0)
+
+
+class _RoundTrips:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, *args, **kwargs) -> None:
+        self.count += 1
+
+
+async def _seed(count: int) -> None:
+    async with get_session() as session:
+        await session.execute(update(ScheduledFollowup).values(status="pending"))
+        if await session.get(User, 1) is not None:
+            return
+        session.add(User(telegram_id=1))
+        await session.flush()
+        session.add(AvitoProfile(id=1, owner_id=1, profile_name="bench", client_id="c", client_secret="s"))
+        await session.flush()
+        session.add(AISettings(profile_id=1, is_enabled=True))
+        session.add(FollowupStep(id=1, profile_id=1, order_index=0, delay_seconds=60, send_mode="always", content_type="text", content_text="Напоминаем о себе"))
+        await session.flush()
+        due = utc_now() - timedelta(minutes=1)
+        session.add_all([AIDialogState(user_id=1, profile_id=1, dialog_id=f"d{i}") for i in range(count)])
+        session.add_all([
+            ScheduledFollowup(user_id=1, profile_id=1, step_id=1, dialog_id=f"d{i}", execute_at=due, status="pending")
+            for i in range(count)
+        ])
+
+
+async def _legacy_batch(bot: _FakeBot) -> int:
+    """Прежняя схема process_followups (для сравнения)."""
+    now = utc_now()
+    async with get_session() as session:
+        items = list((await session.execute(
+            select(ScheduledFollowup)
+            .where(ScheduledFollowup.status == "pending", ScheduledFollowup.execute_at <= now)
+            .order_by(ScheduledFollowup.execute_at.asc())
+            .limit(BATCH)
+        )).scalars().all())
+        if not items:
+            return 0
+        for item in items:
+            item.status = "processing"
+        step_map = {s.id: s for s in (await session.execute(select(FollowupStep).where(FollowupStep.id.in_([i.step_id for i in items])))).scalars().all()}
+        await session.execute(select(AISettings).where(AISettings.profile_id.in_([i.profile_id for i in items])))
+        data = []
+        for item in items:
+            await session.execute(select(AIDialogState).where(
+                AIDialogState.user_id == item.user_id,
+                AIDialogState.profile_id == item.profile_id,
+                AIDialogState.dialog_id == item.dialog_id,
+            ))
+            data.append((item.id, item.user_id, item.profile_id, item.dialog_id, step_map[item.step_id].content_text))
+    for _, user_id, _, _, text in data:
+        await bot.send_message(chat_id=user_id, text=text)
+    async with get_session() as session:
+        rows = (await session.execute(select(ScheduledFollowup).where(ScheduledFollowup.id.in_([d[0] for d in data])))).scalars().all()
+        for row in rows:
+            row.status = "sent"
+        for _, user_id, profile_id, dialog_id, text in data:
+            session.add(AIDialogMessage(user_id=user_id, profile_id=profile_id, dialog_id=dialog_id, role="assistant", content=text))
+    return len(data)
+
+
+async def _run(name: str, batch_fn, count: int) -> tuple[str, int, float, int]:
+    await _seed(count)
+    counter = _RoundTrips()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+    started = time.perf_counter()
+    processed = 0
+    try:
+        while True:
+            claimed = await batch_fn()
+            processed += claimed
+            if claimed < BATCH:
+                break
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", counter)
+    return name, processed, time.perf_counter() - started, counter.count
+
+
+async def main(count: int) -> None:
+    from core.config import settings
+    import core.report_runner as report_runner
+    from core.followups import process_followups
+
+    settings.FOLLOWUP_BATCH_SIZE = BATCH
+    bot = _FakeBot()
+    report_runner._current_bot = bot
+    await init_db()
+    results = [
+        await _run("legacy (N+1)", lambda: _legacy_batch(bot), count),
+        await _run("joined + bulk", process_followups, count),
+    ]
+    await async_engine.dispose()
+
+    print(f"\nprocess_followups, {count} due follow-ups, batch={BATCH}, SQLite\n")
+    print(f"{'variant':<16}{'processed':>10}{'round trips':>13}{'per item':>10}{'seconds':>10}")
+    for name, processed, elapsed, trips in results:
+        per_item = trips / processed if processed else 0.0
+        print(f"{name:<16}{processed:>10}{trips:>13}{per_item:>10.2f}{elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(main(args.count))
@@ -0,0 +1,35 @@
+"""
+OpenAI-совместимый сервер-имитация LLM (core.llm.simulator) для нагрузочных тестов без сети.
+
+Запуск: python scripts/llm_sim_server.py [--host 127.0.0.1] [--port 8100]
+Параметры имитации — переменные LLM_SIM_* (задержка, скорость токенов, ошибки, заготовки).
+Бот к нему: LLM_BASE_URL=http://127.0.0.1:8100/v1 (ключ не нужен).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("BOT_TOKEN", "llm-sim-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from aiohttp import web  # noqa: E402
+
+from core.llm.simulator import create_app  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Чистка старых строк (core.retention) вручную: ai_dialog_messages, ai_dialog_state, scheduled_followups.
+
+Запуск: python scripts/retention.py [--dry-run] [--archive-dir DIR | --no-archive] [--batch-size N]
+        python scripts/retention.py --partition   # PostgreSQL: перевести ai_dialog_messages на помесячные партиции
+БД и сроки хранения — из окружения (.env), как у бота. --partition — только при остановленном боте.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("BOT_TOKEN", "retention-script")
+
+from core.database.session import async_engine  # noqa: E402
+from core.retention import convert_to_partitioned, run_retention  # noqa: E402
+
+
+async def _main(args: argparse.Namespace) -> None:
+    try:
+        if args.partition:
+            created = await convert_to_partitioned()
+            print(f"Partitions: {', '.join(created) or 'already partitioned'}")
+            return
+        report = await run_retention(
+            dry_run=args.dry_run,
+            archive_dir="" if args.no_archive else args.archive_dir,
+            batch_size=args.batch_size,
+        )
+        print(report.format())
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать строки")
+    parser.add_argument("--archive-dir", default=None, help="каталог архива (по умолчанию RETENTION_ARCHIVE_DIR)")
+    parser.add_argument("--no-archive", action="store_true", help="удалять без архива")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--partition", action="store_true", help="PostgreSQL: помесячные партиции ai_dialog_messages")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
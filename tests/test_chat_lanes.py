@@ -0,0 +1,92 @@
+"""
+Unit-тесты для полос по чатам (core.avito.chat_lanes): порядок внутри чата и очистка.
+"""
+import asyncio
+
+from core.avito.chat_lanes import ChatLanes
+
+
+class TestChatLanes:
+    def test_same_chat_is_serialized_in_order(self):
+        events: list = []
+
+        def turn(n):
+            async def job():
+                events.append(("start", n))
+                await asyncio.sleep(0.01)
+                events.append(("end", n))
+            return job
+
+        async def scenario():
+            lanes = ChatLanes()
+            ran = await asyncio.gather(*(lanes.run((1, "chat"), turn(n)) for n in range(3)))
+            # Всю цепочку выполнил первый вызов, остальные вернулись сразу
+            assert ran == [True, False, False]
+            assert len(lanes) == 0
+
+        asyncio.run(scenario())
+        assert events == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+
+    def test_busy_chat_does_not_hold_callers(self):
+        async def scenario():
+            lanes = ChatLanes()
+            release = asyncio.Event()
+            done: list = []
+
+            async def slow():
+                await release.wait()
+                done.append("slow")
+
+            async def quick():
+                done.append("quick")
+
+            holder = asyncio.create_task(lanes.run("busy", slow))
+            await asyncio.sleep(0)
+            # Второй вызов для занятого чата не ждёт первый
+            assert await asyncio.wait_for(lanes.run("busy", quick), timeout=1) is False
+            assert done == []
+            release.set()
+            assert await holder is True
+            assert done == ["slow", "quick"]
+
+        asyncio.run(scenario())
+
+    def test_different_chats_run_in_parallel(self):
+        active: list = []
+        peak = []
+
+        def turn(chat):
+            async def job():
+                active.append(chat)
+                peak.append(len(active))
+                await asyncio.sleep(0.01)
+                active.remove(chat)
+            return job
+
+        async def scenario():
+            lanes = ChatLanes()
+            await asyncio.gather(*(lanes.run((1, c), turn(c)) for c in ("a", "b", "c")))
+
+        asyncio.run(scenario())
+        assert max(peak) == 3
+
+    def test_error_does_not_break_the_chain(self):
+        async def scenario():
+            lanes = ChatLanes()
+            done: list = []
+
+            async def failing():
+                await asyncio.sleep(0)
+                raise ValueError
+
+            async def next_job():
+                done.append("next")
+
+            holder = asyncio.create_task(lanes.run("k", failing))
+            await asyncio.sleep(0)
+            await lanes.run("k", next_job)
+            await holder
+            assert done == ["next"]
+            assert len(lanes) == 0
+
+        asyncio.run(scenario())
@@ -0,0 +1,49 @@
+"""
+Unit-тесты для контекста диалога LLM (core.llm.context).
+"""
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.llm.context import estimate_tokens, fit_to_budget, history_window
+
+
+def _ai(**kw):
+    base = dict(context_mode="last_n", context_value=20, max_messages_in_context=None, context_retention_days=None)
+    base.update(kw)
+    return SimpleNamespace(**base)
+
+
+def test_history_window_modes():
+    now = datetime(2026, 10, 19, 12, 0)
+    assert history_window(_ai(), now) == (20, None)
+    assert history_window(_ai(max_messages_in_context=5), now) == (5, None)
+    assert history_window(_ai(context_mode="time_window", context_value=24), now) == (None, now - timedelta(hours=24))
+    # Ретенция тест-чата уже окна time_window — берётся более поздняя граница
+    limit, since = history_window(_ai(context_mode="time_window", context_value=72, context_retention_days=1), now)
+    assert limit is None and since == now - timedelta(days=1)
+    assert history_window(_ai(context_mode="all", context_value=None), now) == (None, None)
+
+
+def test_fit_to_budget_keeps_newest_and_folds_rest():
+    t0 = datetime(2026, 10, 19)
+    turns = [(t0 + timedelta(minutes=i), "user" if i % 2 == 0 else "assistant", "x" * 40) for i in range(10)]
+    per_turn = estimate_tokens("x" * 40) + 4
+    head = fit_to_budget("sys", "резюме", [], budget=0).tokens
+    ctx = fit_to_budget("sys", "резюме", turns, budget=head + per_turn * 3)
+    assert [m["role"] for m in ctx.messages[:2]] == ["system", "system"]
+    assert "резюме" in ctx.messages[1]["content"]
+    assert len(ctx.messages) - 2 == 3
+    assert ctx.folded == turns[:7]
+    assert ctx.tokens == head + per_turn * 3
+
+
+def test_fit_to_budget_always_keeps_last_message():
+    t0 = datetime(2026, 10, 19)
+    turns = [(t0, "user", "очень длинное сообщение " * 100)]
+    ctx = fit_to_budget(None, None, turns, budget=10)
+    assert ctx.messages == [{"role": "user", "content": turns[0][2]}]
+    assert ctx.folded == []
@@ -0,0 +1,65 @@
+"""
+Unit-тесты для debounce входящих сообщений (core.avito.debounce): склейка серии в один вызов.
+"""
+import asyncio
+
+from core.avito.debounce import ChatDebouncer
+
+
+def _collect(calls: list):
+    async def on_fire(key, items):
+        calls.append((key, list(items)))
+    return on_fire
+
+
+class TestChatDebouncer:
+    def test_burst_is_merged_into_one_call(self):
+        calls: list = []
+
+        async def scenario():
+            d = ChatDebouncer(_collect(calls))
+            for text in ("привет", "актуально?", "где находитесь?"):
+                d.submit((1, "chat"), text, 0.05)
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.15)
+
+        asyncio.run(scenario())
+        assert calls == [((1, "chat"), ["привет", "актуально?", "где находитесь?"])]
+
+    def test_chats_are_independent(self):
+        calls: list = []
+
+        async def scenario():
+            d = ChatDebouncer(_collect(calls))
+            d.submit((1, "a"), "x", 0.02)
+            d.submit((1, "b"), "y", 0.02)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        assert sorted(calls) == [((1, "a"), ["x"]), ((1, "b"), ["y"])]
+
+    def test_max_wait_caps_window(self):
+        calls: list = []
+
+        async def scenario():
+            d = ChatDebouncer(_collect(calls), max_wait_seconds=0.05)
+            for _ in range(10):
+                d.submit("k", 1, 0.04)
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        assert len(calls) >= 2
+        assert sum(len(items) for _, items in calls) == 10
+
+    def test_flush_all_fires_pending(self):
+        calls: list = []
+
+        async def scenario():
+            d = ChatDebouncer(_collect(calls))
+            d.submit("k", "late", 60)
+            await d.flush_all()
+            assert d.pending_count() == 0
+
+        asyncio.run(scenario())
+        assert calls == [("k", ["late"])]
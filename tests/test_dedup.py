@@ -0,0 +1,116 @@
+"""
+Тесты идемпотентности Avito webhook (core.avito.dedup) на SQLite в памяти.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import select
+
+from core.avito import dedup
+from core.avito.dedup import DeliveryDedup, delivery_key
+from core.database.models import Base, WebhookDelivery
+from core.database.session import async_engine, get_session
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+async def _reset_db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def _stored_keys():
+    async with get_session() as session:
+        return sorted((await session.execute(select(WebhookDelivery.key))).scalars())
+
+
+class _Clock:
+    """Подменяет time.monotonic и utc_now в core.avito.dedup."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def monotonic(self):
+        return 1000.0 + self.offset
+
+    def utc_now(self):
+        return NOW + timedelta(seconds=self.offset)
+
+    def patch(self):
+        return mock.patch.multiple(dedup, time=mock.Mock(monotonic=self.monotonic), utc_now=self.utc_now)
+
+
+class TestDeliveryKey:
+    def test_message_id_is_preferred(self):
+        assert delivery_key({"user_id": 777, "message_id": "m1", "raw": {"x": 1}}) == "777:m1"
+
+    def test_payload_hash_fallback_ignores_key_order(self):
+        first = delivery_key({"user_id": 777, "message_id": None, "raw": {"a": 1, "b": "тест"}})
+        second = delivery_key({"user_id": 777, "raw": {"b": "тест", "a": 1}})
+        assert first == second
+        assert first.startswith("sha256:") and len(first) == len("sha256:") + 64
+        assert first != delivery_key({"user_id": 777, "raw": {"a": 2, "b": "тест"}})
+
+    def test_long_message_id_is_truncated(self):
+        key = delivery_key({"user_id": 777, "message_id": "x" * 500})
+        assert len(key) == 128
+        assert key.startswith("777:xxx")
+
+
+class TestDeliveryDedup:
+    def test_repeat_is_detected_in_memory_and_after_restart(self):
+        async def main():
+            await _reset_db()
+            first = DeliveryDedup(ttl_seconds=3600, max_items=100)
+            assert await first.check_and_mark("777:m1") is True
+            assert await first.check_and_mark("777:m1") is False
+            # Новый процесс с пустой памятью: повтор отсекает таблица webhook_deliveries
+            restarted = DeliveryDedup(ttl_seconds=3600, max_items=100)
+            assert await restarted.check_and_mark("777:m1") is False
+            assert await _stored_keys() == ["777:m1"]
+        asyncio.run(main())
+
+    def test_memory_is_bounded_by_max_items(self):
+        async def main():
+            await _reset_db()
+            d = DeliveryDedup(ttl_seconds=3600, max_items=2)
+            for key in ("a", "b", "c"):
+                assert await d.check_and_mark(key) is True
+            assert list(d._seen) == ["b", "c"]
+            # Вытесненный из памяти ключ всё ещё отсекается по БД
+            assert await d.check_and_mark("a") is False
+            assert list(d._seen) == ["c", "a"]
+        asyncio.run(main())
+
+    def test_forget_lets_the_retry_through(self):
+        async def main():
+            await _reset_db()
+            d = DeliveryDedup(ttl_seconds=3600, max_items=100)
+            assert await d.check_and_mark("777:m1") is True
+            # Очередь переполнена — доставку не приняли (503), Avito повторит
+            await d.forget("777:m1")
+            assert await _stored_keys() == []
+            assert await d.check_and_mark("777:m1") is True
+        asyncio.run(main())
+
+    def test_keys_expire_after_ttl(self):
+        async def main():
+            await _reset_db()
+            clock = _Clock()
+            with clock.patch():
+                d = DeliveryDedup(ttl_seconds=60, max_items=100)
+                assert await d.check_and_mark("old") is True
+                clock.offset = 30
+                assert await d.check_and_mark("old") is False
+                # Через _PURGE_INTERVAL_SEC новая доставка запускает чистку ключей старше TTL
+                clock.offset = dedup._PURGE_INTERVAL_SEC + 1
+                assert await d.check_and_mark("new") is True
+                assert await _stored_keys() == ["new"]
+                assert await d.check_and_mark("old") is True
+        asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Unit-тесты для кэша последних реплик диалогов (core.services.dialog_history).
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.services.dialog_history import DialogHistoryCache
+
+T0 = datetime(2026, 10, 19, 12, 0)
+KEY = (1, 2, "d1")
+
+
+def _turns(n, start=0):
+    return [(T0 + timedelta(minutes=start + i), "user", f"m{start + i}") for i in range(n)]
+
+
+def _loader(rows, calls):
+    async def load(n):
+        calls.append(n)
+        return rows[-n:]
+    return load
+
+
+def test_short_dialog_is_complete_and_appends_without_db():
+    async def main():
+        cache, calls = DialogHistoryCache(turns_per_dialog=10, max_bytes=10**6, idle_sec=3600), []
+        await cache.fill(KEY, _loader(_turns(3), calls))
+        cache.append(KEY, _turns(1, start=3)[0])
+        cache.append((9, 9, "other"), _turns(1)[0])  # не в кэше — игнорируется
+        assert cache.recent(KEY, None, 20) == _turns(4)
+        assert cache.recent(KEY, T0 + timedelta(minutes=1), None) == _turns(2, start=2)
+        assert calls == [10] and len(cache) == 1
+    asyncio.run(main())
+
+
+def test_long_dialog_serves_only_covered_windows():
+    async def main():
+        cache = DialogHistoryCache(turns_per_dialog=5, max_bytes=10**6, idle_sec=3600)
+        await cache.fill(KEY, _loader(_turns(50), []))
+        assert cache.recent(KEY, None, 3) == _turns(3, start=47)
+        # Окно шире кольца и без границы внутри него — в БД
+        assert cache.recent(KEY, None, 20) is None
+        assert cache.recent(KEY, T0 + timedelta(minutes=10), None) is None
+        assert cache.recent(KEY, T0 + timedelta(minutes=46), None) == _turns(3, start=47)
+    asyncio.run(main())
+
+
+def test_append_during_fill_and_out_of_order_rows():
+    async def main():
+        cache = DialogHistoryCache(turns_per_dialog=10, max_bytes=10**6, idle_sec=3600)
+        late = (T0 + timedelta(minutes=10), "assistant", "late")
+
+        async def load(n):
+            cache.append(KEY, late)  # строка пришла, пока шёл запрос
+            return _turns(2)
+
+        await cache.fill(KEY, load)
+        cache.append(KEY, (T0 + timedelta(minutes=5), "assistant", "followup"))
+        assert [t[2] for t in cache.recent(KEY, None, None)] == ["m0", "m1", "followup", "late"]
+    asyncio.run(main())
+
+
+def test_memory_cap_evicts_least_recent_dialogs():
+    async def main():
+        cache = DialogHistoryCache(turns_per_dialog=10, max_bytes=1000, idle_sec=3600)
+        for dialog in range(5):
+            await cache.fill((1, 2, f"d{dialog}"), _loader(_turns(2), []))
+        assert cache.bytes <= 1000 and len(cache) < 5
+        assert (1, 2, "d4") in cache and (1, 2, "d0") not in cache
+        cache.invalidate(profile_id=2)
+        assert len(cache) == 0 and cache.bytes == 0
+    asyncio.run(main())
+
+
+def test_context_bypasses_cache_with_several_replicas():
+    from types import SimpleNamespace
+    from unittest import mock
+
+    from core.database.models import AIDialogMessage, Base
+    from core.database.session import async_engine, get_session
+    from core.llm import context
+    from core.services.dialog_history import dialog_history
+
+    ai = SimpleNamespace(profile_id=2, system_prompt="sys", context_mode="last_n", context_value=10,
+                         max_messages_in_context=None, context_retention_days=None)
+
+    async def load():
+        async with get_session() as session:
+            ctx = await context.load_dialog_context(session, ai, user_id=1, profile_id=2, dialog_id="d1", now=T0)
+        return [m["content"] for m in ctx.messages if m["role"] != "system"]
+
+    async def main():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        dialog_history.invalidate()
+        async with get_session() as s:
+            s.add(AIDialogMessage(user_id=1, profile_id=2, dialog_id="d1", role="user", content="m0", created_at=T0))
+        assert await load() == ["m0"]
+        assert KEY in dialog_history
+        # Строку записала другая реплика — мимо кольца этого процесса
+        async with get_session() as s:
+            s.add(AIDialogMessage(user_id=1, profile_id=2, dialog_id="d1", role="assistant", content="m1",
+                                  created_at=T0 + timedelta(minutes=1)))
+        assert await load() == ["m0"]
+        with mock.patch.object(context, "get_partition", return_value=(0, 2)):
+            assert await load() == ["m0", "m1"]
+        assert KEY not in dialog_history
+    asyncio.run(main())
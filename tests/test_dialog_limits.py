@@ -0,0 +1,96 @@
+"""
+Unit-тесты для лимитов ИИ-продавца в памяти (core.services.dialog_limits).
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.services.dialog_limits import (
+    LIMIT_COOLDOWN,
+    LIMIT_DAILY_DIALOGS,
+    LIMIT_DIALOG_MESSAGES,
+    LIMIT_PER_MINUTE,
+    DialogLimiter,
+)
+
+T0 = datetime(2026, 10, 19, 12, 0)
+
+
+class _Limiter(DialogLimiter):
+    def __init__(self, seeded=None, **kw):
+        super().__init__(max_dialogs=kw.pop("max_dialogs", 100))
+        self.seeded = seeded or {}
+        self.loads = 0
+
+    async def _load_dialog_count(self, profile_id, dialog_id):
+        self.loads += 1
+        return self.seeded.get(dialog_id, 0)
+
+
+def _ai(**kw):
+    base = dict(
+        messages_per_minute_limit=0, daily_dialog_limit=0, per_dialog_message_limit=0,
+        cooldown_after_n_messages=0, cooldown_minutes=0, block_on_limit=False,
+    )
+    base.update(kw)
+    return SimpleNamespace(**base)
+
+
+def test_per_minute_window_slides():
+    async def main():
+        lim, ai = _Limiter(), _ai(messages_per_minute_limit=2)
+        assert await lim.acquire(ai, 1, "a", T0) is None
+        assert await lim.acquire(ai, 1, "b", T0 + timedelta(seconds=30)) is None
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(seconds=59)) == LIMIT_PER_MINUTE
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(seconds=61)) is None
+        # Другой профиль — своё окно
+        assert await lim.acquire(ai, 2, "a", T0 + timedelta(seconds=61)) is None
+    asyncio.run(main())
+
+
+def test_daily_dialogs_only_with_block_on_limit():
+    async def main():
+        lim = _Limiter()
+        ai = _ai(daily_dialog_limit=1, block_on_limit=True)
+        assert await lim.acquire(ai, 1, "a", T0) is None
+        assert await lim.acquire(ai, 1, "a", T0) is None  # тот же диалог — можно
+        assert await lim.acquire(ai, 1, "b", T0) == LIMIT_DAILY_DIALOGS
+        assert await lim.acquire(_ai(daily_dialog_limit=1), 1, "b", T0) is None
+        assert await lim.acquire(ai, 1, "c", T0 + timedelta(days=1)) is None
+    asyncio.run(main())
+
+
+def test_dialog_limit_is_seeded_once_and_survives_in_memory():
+    async def main():
+        lim, ai = _Limiter(seeded={"a": 4}), _ai(per_dialog_message_limit=5)
+        assert await lim.acquire(ai, 1, "a", T0) is None
+        assert await lim.acquire(ai, 1, "a", T0) == LIMIT_DIALOG_MESSAGES
+        assert lim.loads == 1
+    asyncio.run(main())
+
+
+def test_cooldown_after_n_messages():
+    async def main():
+        lim, ai = _Limiter(), _ai(cooldown_after_n_messages=2, cooldown_minutes=5)
+        assert await lim.acquire(ai, 1, "a", T0) is None
+        # Пауза дольше cooldown_minutes обнуляет серию
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(minutes=6)) is None
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(minutes=7)) is None
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(minutes=8)) == LIMIT_COOLDOWN
+        assert await lim.acquire(ai, 1, "a", T0 + timedelta(minutes=12)) is None
+    asyncio.run(main())
+
+
+def test_profile_limits_only_skip_dialog_counter():
+    async def main():
+        lim = _Limiter(seeded={"default": 100})
+        ai = _ai(per_dialog_message_limit=5, cooldown_after_n_messages=1, cooldown_minutes=5, messages_per_minute_limit=2)
+        assert await lim.acquire(ai, 1, "default", T0, dialog_limits=False) is None
+        assert await lim.acquire(ai, 1, "default", T0, dialog_limits=False) is None
+        assert await lim.acquire(ai, 1, "default", T0, dialog_limits=False) == LIMIT_PER_MINUTE
+        assert lim.loads == 0
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+"""
+Тесты очереди фоллоу-апов с арендой (core.followups.process_followups) на SQLite в памяти.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import select, update
+
+from core import followups, report_runner
+from core.config import settings
+from core.database.models import (
+    AIDialogMessage,
+    AISettings,
+    AvitoProfile,
+    Base,
+    FollowupStep,
+    ScheduledFollowup,
+    User,
+)
+from core.database.session import async_engine, get_session
+from core.llm.client import LLMClient
+
+TEXT_STEP, LLM_STEP = 1, 2
+
+
+class _Bot:
+    def __init__(self):
+        self.sent: list[tuple[int, str]] = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+async def _seed(*rows):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with get_session() as s:
+        s.add(User(telegram_id=1))
+        await s.flush()
+        s.add(AvitoProfile(id=1, owner_id=1, profile_name="p1", client_id="c", client_secret="s"))
+        await s.flush()
+        s.add(AISettings(profile_id=1, is_enabled=True))
+        s.add(FollowupStep(id=TEXT_STEP, profile_id=1, order_index=0, delay_seconds=60, send_mode="always",
+                           content_type="text", content_text="Напоминаем о товаре"))
+        s.add(FollowupStep(id=LLM_STEP, profile_id=1, order_index=1, delay_seconds=60, send_mode="always",
+                           content_type="llm", content_text="prompt"))
+        for row in rows:
+            s.add(row)
+
+
+def _row(step_id=TEXT_STEP, **kw):
+    base = dict(user_id=1, profile_id=1, step_id=step_id, dialog_id="d1",
+                execute_at=datetime.utcnow() - timedelta(seconds=1), status="pending")
+    base.update(kw)
+    return ScheduledFollowup(**base)
+
+
+async def _rows():
+    async with get_session() as s:
+        return {r.id: r for r in (await s.execute(select(ScheduledFollowup))).scalars()}
+
+
+def _run(scenario):
+    bot = _Bot()
+    with mock.patch.object(report_runner, "_current_bot", bot), \
+            mock.patch.object(followups.followup_dispatcher, "notify"):
+        asyncio.run(scenario(bot))
+
+
+def test_due_row_is_sent_and_stored_in_history():
+    async def scenario(bot):
+        await _seed(_row(id=1), _row(id=2, execute_at=datetime.utcnow() + timedelta(hours=1)))
+        assert await followups.process_followups() == 1
+        assert bot.sent == [(1, "Напоминаем о товаре")]
+        rows = await _rows()
+        assert (rows[1].status, rows[1].attempts, rows[1].lease_owner, rows[1].lease_expires_at) == ("sent", 1, None, None)
+        assert rows[2].status == "pending"
+        async with get_session() as s:
+            history = (await s.execute(select(AIDialogMessage.role, AIDialogMessage.content))).all()
+        assert history == [("assistant", "Напоминаем о товаре")]
+    _run(scenario)
+
+
+def test_llm_failure_retries_with_backoff_then_dead_letters():
+    async def failing(self, ai_settings, content_text, contexts, owner_id=None, limit=None):
+        return [RuntimeError("llm down") for _ in contexts]
+
+    async def scenario(bot):
+        await _seed(_row(id=1, step_id=LLM_STEP))
+        with mock.patch.object(LLMClient, "generate_followups", failing), \
+                mock.patch.object(settings, "FOLLOWUP_MAX_ATTEMPTS", 2):
+            started = datetime.utcnow()
+            assert await followups.process_followups() == 1
+            row = (await _rows())[1]
+            assert (row.status, row.attempts, row.lease_owner) == ("pending", 1, None)
+            delay = (row.execute_at - started).total_seconds()
+            assert settings.FOLLOWUP_RETRY_BASE_SEC - 5 < delay < settings.FOLLOWUP_RETRY_BASE_SEC + 5
+            # Пока задержка не прошла, строку не берём
+            assert await followups.process_followups() == 0
+            async with get_session() as s:
+                await s.execute(update(ScheduledFollowup).values(execute_at=datetime.utcnow() - timedelta(seconds=1)))
+            assert await followups.process_followups() == 1
+        row = (await _rows())[1]
+        assert (row.status, row.attempts) == ("dead", 2)
+        assert bot.sent == []
+    _run(scenario)
+
+
+def test_live_lease_is_skipped_and_expired_lease_is_reclaimed():
+    async def scenario(bot):
+        now = datetime.utcnow()
+        await _seed(
+            _row(id=1, status="processing", attempts=1, lease_owner="other", lease_expires_at=now + timedelta(minutes=5)),
+            _row(id=2, status="processing", attempts=1, lease_owner="crashed", lease_expires_at=now - timedelta(seconds=1)),
+        )
+        assert await followups.process_followups() == 1
+        rows = await _rows()
+        assert (rows[1].status, rows[1].lease_owner, rows[1].attempts) == ("processing", "other", 1)
+        assert (rows[2].status, rows[2].lease_owner, rows[2].attempts) == ("sent", None, 2)
+        assert len(bot.sent) == 1
+    _run(scenario)
+
+
+def test_result_of_a_lost_lease_is_not_written():
+    async def scenario(bot):
+        await _seed(_row(id=1, status="processing", attempts=1, lease_owner="new-owner",
+                         lease_expires_at=datetime.utcnow() + timedelta(minutes=5)))
+        await followups._save_results("old-owner", [(1, "sent", 1)], [])
+        row = (await _rows())[1]
+        assert (row.status, row.lease_owner) == ("processing", "new-owner")
+    _run(scenario)
+
+
+def test_row_whose_lease_keeps_expiring_is_dead_lettered():
+    async def scenario(bot):
+        await _seed(_row(id=1, status="processing", attempts=settings.FOLLOWUP_MAX_ATTEMPTS, lease_owner="crashed",
+                         lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        assert await followups.process_followups() == 0
+        row = (await _rows())[1]
+        assert (row.status, row.attempts, row.lease_owner) == ("dead", settings.FOLLOWUP_MAX_ATTEMPTS, None)
+        assert bot.sent == []
+    _run(scenario)
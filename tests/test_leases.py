@@ -0,0 +1,137 @@
+"""
+Тесты аренд и партиционирования реплик (core.leases) на SQLite в памяти.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import select
+
+from core import leases
+from core.database.models import Base, JobLease, ScheduledFollowup
+from core.database.session import async_engine, get_session
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+async def _reset_db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def _owners():
+    async with get_session() as session:
+        return dict((await session.execute(select(JobLease.name, JobLease.owner))).all())
+
+
+class _Clock:
+    def __init__(self):
+        self.offset = 0
+
+    def __call__(self):
+        return NOW + timedelta(seconds=self.offset)
+
+
+def _run(coro_fn):
+    async def main():
+        await _reset_db()
+        clock = _Clock()
+        with mock.patch.object(leases, "utc_now", clock), mock.patch.object(leases, "_partition", (0, 1)):
+            await coro_fn(clock)
+    asyncio.run(main())
+
+
+class TestTryAcquireLease:
+    def test_contested_lease_is_not_taken_until_expiry(self):
+        async def scenario(clock):
+            assert await leases.try_acquire_lease("report_task_1", 60, owner="a") is True
+            assert await leases.try_acquire_lease("report_task_1", 60, owner="b") is False
+            # Владелец продлевает свою аренду
+            clock.offset = 50
+            assert await leases.try_acquire_lease("report_task_1", 60, owner="a") is True
+            clock.offset = 100
+            assert await leases.try_acquire_lease("report_task_1", 60, owner="b") is False
+            # После истечения аренду забирает другая реплика
+            clock.offset = 111
+            assert await leases.try_acquire_lease("report_task_1", 60, owner="b") is True
+            assert (await _owners())["report_task_1"] == "b"
+        _run(scenario)
+
+    def test_insert_race_returns_false(self):
+        real_get_session = leases.get_session
+        calls = []
+
+        @asynccontextmanager
+        async def racing_session():
+            calls.append(1)
+            if len(calls) == 2:
+                # Между проверкой и INSERT строку вставила другая реплика
+                async with real_get_session() as session:
+                    session.add(JobLease(name="leader", owner="other", expires_at=NOW + timedelta(seconds=60)))
+            async with real_get_session() as session:
+                yield session
+
+        async def scenario(clock):
+            with mock.patch.object(leases, "get_session", racing_session):
+                assert await leases.try_acquire_lease("leader", 60, owner="me") is False
+            assert (await _owners())["leader"] == "other"
+        _run(scenario)
+
+    def test_is_leader_is_exclusive(self):
+        async def scenario(clock):
+            assert await leases.is_leader() is True
+            assert await leases.try_acquire_lease(leases.LEADER_LEASE, 45, owner="other") is False
+        _run(scenario)
+
+
+class TestPartition:
+    async def _join(self, *others):
+        for owner in others:
+            await leases.try_acquire_lease(f"{leases.MEMBER_LEASE_PREFIX}{owner}", 45, owner=owner)
+
+    def test_partition_of_live_members(self):
+        async def scenario(clock):
+            others = ["~after", "\x01before"]
+            await self._join(*others)
+            members = sorted([leases.WORKER_ID, *others])
+            assert await leases.heartbeat() == (members.index(leases.WORKER_ID), 3)
+            index, count = leases.get_partition()
+            assert [leases.owns_profile(p) for p in range(6)] == [p % 3 == index for p in range(6)]
+            # Участник без heartbeat выпадает по истечении WORKER_LEASE_TTL_SEC
+            clock.offset = 30
+            await self._join("~after")
+            clock.offset = 50
+            members = sorted([leases.WORKER_ID, "~after"])
+            assert await leases.heartbeat() == (members.index(leases.WORKER_ID), 2)
+        _run(scenario)
+
+    def test_partition_clause_filters_profiles(self):
+        async def scenario(clock):
+            assert leases.profile_partition_clause(ScheduledFollowup.profile_id) is None
+            async with get_session() as session:
+                session.add_all([
+                    ScheduledFollowup(id=p, user_id=1, profile_id=p, step_id=1, dialog_id="d", execute_at=NOW)
+                    for p in range(1, 7)
+                ])
+            with mock.patch.object(leases, "_partition", (1, 2)):
+                clause = leases.profile_partition_clause(ScheduledFollowup.profile_id)
+                async with get_session() as session:
+                    owned = (await session.execute(select(ScheduledFollowup.profile_id).where(clause))).scalars()
+                    assert sorted(owned) == [1, 3, 5]
+        _run(scenario)
+
+    def test_leave_cluster_releases_membership(self):
+        async def scenario(clock):
+            await self._join("~other")
+            assert (await leases.heartbeat())[1] == 2
+            await leases.leave_cluster()
+            assert leases.get_partition() == (0, 1)
+            assert f"{leases.MEMBER_LEASE_PREFIX}{leases.WORKER_ID}" not in await _owners()
+            assert "~other" in (await _owners()).values()
+        _run(scenario)
@@ -0,0 +1,98 @@
+"""
+Unit-тесты для пакетной генерации фоллоу-апов (core.llm.batching, LLMClient.generate_followups).
+"""
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.config import settings
+from core.llm.batching import build_batch_messages, parse_batch_reply
+from core.llm.client import LLMClient
+from core.llm.providers import LLMProvider
+
+_AI = SimpleNamespace(model_alias="gpt-mini", profile_id=1, response_cache_enabled=False)
+
+
+class _BatchProvider(LLMProvider):
+    """Отвечает на пакет JSON'ом, пропуская id из skip; одиночные запросы — 'single'."""
+
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.calls: list[int] = []
+
+    async def complete(self, model, messages):
+        payload = json.loads(messages[-1]["content"]) if messages[-1]["content"].startswith("{") else None
+        if payload and "items" in payload:
+            self.calls.append(len(payload["items"]))
+            return "```json\n" + json.dumps({"items": [
+                {"id": it["id"], "text": f"text {it['context']['dialog_id']}"}
+                for it in payload["items"] if it["context"]["dialog_id"] not in self.skip
+            ]}) + "\n```"
+        self.calls.append(1)
+        return "single"
+
+
+def test_parse_batch_reply_is_per_item():
+    raw = json.dumps({"items": [
+        {"id": 0, "text": "ok"}, {"id": 1, "text": ""}, {"id": "2", "text": "two"},
+        {"id": 7, "text": "out of range"}, "junk",
+    ]})
+    assert parse_batch_reply(raw, 3) == {0: "ok", 2: "two"}
+    assert parse_batch_reply("not json", 3) == {}
+    messages = build_batch_messages("Напомни о товаре", [{"dialog_id": "d1"}])
+    assert json.loads(messages[1]["content"]) == {"items": [{"id": 0, "context": {"dialog_id": "d1"}}]}
+
+
+def test_generate_followups_batches_and_falls_back_per_item():
+    async def main():
+        provider = _BatchProvider(skip={"d3"})
+        contexts = [{"dialog_id": f"d{i}"} for i in range(5)]
+        with mock.patch.object(settings, "FOLLOWUP_LLM_BATCH_ITEMS", 3):
+            texts = await LLMClient(provider=provider).generate_followups(_AI, "prompt", contexts)
+        assert texts == ["text d0", "text d1", "text d2", "single", "text d4"]
+        # Два пакетных запроса (3 + 2) и один повтор для пропущенного элемента
+        assert sorted(provider.calls) == [1, 2, 3]
+    asyncio.run(main())
+
+
+def test_generate_followups_returns_errors_instead_of_placeholder():
+    class _Failing(LLMProvider):
+        async def complete(self, model, messages):
+            raise RuntimeError("boom")
+
+    async def main():
+        contexts = [{"dialog_id": f"d{i}"} for i in range(3)]
+        with mock.patch.object(settings, "FOLLOWUP_LLM_BATCH_ITEMS", 3):
+            texts = await LLMClient(provider=_Failing()).generate_followups(_AI, "prompt", contexts)
+        assert all(isinstance(text, RuntimeError) for text in texts)
+    asyncio.run(main())
+
+
+def test_generate_followups_takes_limit_per_request():
+    class _Counting(_BatchProvider):
+        def __init__(self, limit):
+            super().__init__(skip={"d1", "d4"})
+            self.limit = limit
+            self.locked: list[bool] = []
+
+        async def complete(self, model, messages):
+            self.locked.append(self.limit.locked())
+            await asyncio.sleep(0)
+            return await super().complete(model, messages)
+
+    async def main():
+        limit = asyncio.Semaphore(1)
+        provider = _Counting(limit)
+        contexts = [{"dialog_id": f"d{i}"} for i in range(6)]
+        with mock.patch.object(settings, "FOLLOWUP_LLM_BATCH_ITEMS", 3):
+            texts = await LLMClient(provider=provider).generate_followups(_AI, "prompt", contexts, limit=limit)
+        assert texts == ["text d0", "single", "text d2", "text d3", "single", "text d5"]
+        # Каждый из 2 пакетов и 2 повторов шёл под семафором, и он отпускался между запросами
+        assert provider.locked == [True] * 4
+        assert not limit.locked()
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Unit-тесты для маршрутизации LLM по задержке (core.llm.routing) на заглушке с задержкой.
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.config import settings
+from core.llm import routing
+from core.llm.client import LLMClient
+from core.llm.providers import LLMProvider
+from core.llm.routing import KIND_REPLY, LatencyTracker, fallback_model, hedged_call
+
+
+class _SlowProvider(LLMProvider):
+    """Заглушка провайдера: задержка и ошибки по модели."""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = set(failing)
+        self.cancelled: list[str] = []
+
+    async def complete(self, model, messages):
+        try:
+            await asyncio.sleep(self.delays.get(model, 0))
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.failing:
+            raise RuntimeError(f"{model} down")
+        return f"answer from {model}"
+
+
+_AI = SimpleNamespace(model_alias="gpt-optimal", profile_id=1, response_cache_enabled=False)
+_MSGS = [{"role": "user", "content": "Актуально?"}]
+
+
+def _patched(**overrides):
+    values = {"LLM_HEDGE_ENABLED": True, "LLM_HEDGE_DEFAULT_DEADLINE_SEC": 0.05, "LLM_FALLBACK_MODEL": "gpt-4o-mini"}
+    values.update(overrides)
+    return mock.patch.multiple(settings, **values)
+
+
+class TestLatencyTracker:
+    def test_p95_needs_min_samples(self):
+        tracker = LatencyTracker(window=100, min_samples=5)
+        for v in (0.1, 0.2, 0.3, 0.4):
+            tracker.observe("m", KIND_REPLY, v)
+        assert tracker.p95("m", KIND_REPLY) is None
+        for v in range(1, 21):
+            tracker.observe("m", KIND_REPLY, v / 10)
+        assert tracker.p95("m", KIND_REPLY) == 1.9
+
+    def test_fallback_prefers_fastest_model(self):
+        tracker = LatencyTracker(window=10, min_samples=1)
+        tracker.observe("gpt-4.1", KIND_REPLY, 9.0)
+        tracker.observe("gpt-4.1-mini", KIND_REPLY, 2.0)
+        tracker.observe("gpt-4o-mini", KIND_REPLY, 3.0)
+        with mock.patch.object(routing, "latency", tracker):
+            assert fallback_model("gpt-4.1", KIND_REPLY) == "gpt-4.1-mini"
+            # Сама модель быстрее остальных — дублируем запрос к ней же
+            assert fallback_model("gpt-4.1-mini", KIND_REPLY) == "gpt-4.1-mini"
+
+
+class TestHedging:
+    def test_slow_primary_loses_to_backup_and_is_cancelled(self):
+        async def scenario():
+            provider = _SlowProvider({"gpt-4.1": 5.0, "gpt-4o-mini": 0.01})
+            reply = await asyncio.wait_for(LLMClient(provider=provider).generate_reply(_AI, _MSGS), 2)
+            await asyncio.sleep(0)
+            assert reply == "answer from gpt-4o-mini"
+            assert provider.cancelled == ["gpt-4.1"]
+
+        with _patched(), mock.patch.object(routing, "latency", LatencyTracker(50, 20)):
+            asyncio.run(scenario())
+
+    def test_fast_primary_needs_no_backup(self):
+        async def scenario():
+            provider = _SlowProvider({"gpt-4.1": 0.0, "gpt-4o-mini": 0.0})
+            calls = []
+            reply = await hedged_call("gpt-4.1", lambda m: calls.append(m) or provider.complete(m, _MSGS))
+            assert reply == "answer from gpt-4.1" and calls == ["gpt-4.1"]
+
+        with _patched(), mock.patch.object(routing, "latency", LatencyTracker(50, 20)):
+            asyncio.run(scenario())
+
+    def test_primary_error_falls_back_immediately(self):
+        async def scenario():
+            provider = _SlowProvider({}, failing={"gpt-4.1"})
+            assert await LLMClient(provider=provider).generate_reply(_AI, _MSGS) == "answer from gpt-4o-mini"
+
+        with _patched(LLM_HEDGE_DEFAULT_DEADLINE_SEC=30), mock.patch.object(routing, "latency", LatencyTracker(50, 20)):
+            asyncio.run(scenario())
+
+    def test_stream_hedges_on_first_token(self):
+        async def scenario():
+            provider = _SlowProvider({"gpt-4.1": 5.0, "gpt-4o-mini": 0.01})
+            parts = [p async for p in LLMClient(provider=provider).stream_reply(_AI, _MSGS)]
+            assert "".join(parts) == "answer from gpt-4o-mini"
+            assert provider.cancelled == ["gpt-4.1"]
+
+        with _patched(), mock.patch.object(routing, "latency", LatencyTracker(50, 20)):
+            asyncio.run(asyncio.wait_for(scenario(), 2))
+
+    def test_backup_needs_its_own_scheduler_slot(self):
+        from core.llm import client as client_module
+        from core.llm.scheduler import LLMScheduler
+
+        async def scenario(max_concurrency):
+            scheduler = LLMScheduler(max_concurrency, background_max=1)
+            provider = _SlowProvider({"gpt-4.1": 0.2, "gpt-4o-mini": 0.01})
+            with mock.patch.object(client_module, "llm_scheduler", scheduler):
+                reply = await LLMClient(provider=provider).generate_reply(_AI, _MSGS)
+            assert scheduler.stats()["active"] == 0
+            return reply
+
+        with _patched(), mock.patch.object(routing, "latency", LatencyTracker(50, 20)):
+            # Единственный слот занят основным запросом — запасной не запускается
+            assert asyncio.run(scenario(1)) == "answer from gpt-4.1"
+            assert asyncio.run(scenario(2)) == "answer from gpt-4o-mini"
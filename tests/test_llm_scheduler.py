@@ -0,0 +1,83 @@
+"""
+Unit-тесты для планировщика LLM (core.llm.scheduler).
+"""
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.llm.scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, LLMScheduler
+
+
+async def _run(sched, jobs):
+    """jobs: [(name, owner, lane)] — стартуют по порядку; возвращает порядок получения слота."""
+    order: list[str] = []
+    gate = asyncio.Event()
+
+    async def job(name, owner, lane):
+        async with sched.slot(owner, lane):
+            order.append(name)
+            await gate.wait()
+
+    tasks = []
+    for name, owner, lane in jobs:
+        tasks.append(asyncio.create_task(job(name, owner, lane)))
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    started = list(order)
+    gate.set()
+    await asyncio.gather(*tasks)
+    return started, order
+
+
+def test_global_limit_and_interactive_first():
+    async def main():
+        sched = LLMScheduler(max_concurrency=2, background_max=2)
+        started, order = await _run(sched, [
+            ("b1", 1, LANE_BACKGROUND), ("b2", 1, LANE_BACKGROUND),
+            ("b3", 2, LANE_BACKGROUND), ("i1", 3, LANE_INTERACTIVE),
+        ])
+        assert started == ["b1", "b2"]
+        # Живой ответ обгоняет фоновый, пришедший раньше
+        assert order[2:] == ["i1", "b3"]
+        assert sched.stats()["active"] == 0
+    asyncio.run(main())
+
+
+def test_background_lane_cap_leaves_room_for_interactive():
+    async def main():
+        sched = LLMScheduler(max_concurrency=3, background_max=1)
+        started, _ = await _run(sched, [
+            ("b1", 1, LANE_BACKGROUND), ("b2", 1, LANE_BACKGROUND), ("i1", 2, LANE_INTERACTIVE),
+        ])
+        assert started == ["b1", "i1"]
+    asyncio.run(main())
+
+
+def test_owner_quota_and_round_robin():
+    async def main():
+        sched = LLMScheduler(max_concurrency=2, background_max=2, owner_max=1)
+        started, order = await _run(sched, [
+            ("a1", "big", LANE_INTERACTIVE), ("a2", "big", LANE_INTERACTIVE), ("a3", "big", LANE_INTERACTIVE),
+            ("s1", "small", LANE_INTERACTIVE),
+        ])
+        # Квота 1 на владельца: второй слот достаётся другому аккаунту
+        assert started == ["a1", "s1"]
+        assert order == ["a1", "s1", "a2", "a3"]
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def main():
+        sched = LLMScheduler(max_concurrency=1, background_max=1)
+        await sched.acquire("x")
+        waiter = asyncio.create_task(sched.acquire("y"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        sched.release("x", LANE_INTERACTIVE)
+        assert sched.stats()["active"] == 0
+        await asyncio.wait_for(sched.acquire("z"), 1)
+        assert sched.stats()["active"] == 1
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""
+Unit-тесты для имитации LLM (core.llm.simulator): ответы, ошибки, поток, HTTP-сервер.
+"""
+import asyncio
+import json
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import pytest
+
+from core.llm.simulator import SimulatedLLMError, SimulatedProvider, SimulationConfig, create_app
+
+_MSGS = [{"role": "system", "content": "sys"}, {"role": "user", "content": "Актуально?"}]
+
+
+def _provider(**kw):
+    base = dict(latency_ms=0, distribution="fixed", tokens_per_sec=0, reply_tokens=20, seed=1)
+    base.update(kw)
+    return SimulatedProvider(SimulationConfig(**base))
+
+
+def test_answers_are_deterministic_and_canned_wins():
+    async def main():
+        p = _provider(canned={"актуально": "Да, в наличии."})
+        assert await p.complete("m", _MSGS) == "Да, в наличии."
+        other = [{"role": "user", "content": "Где забрать?"}]
+        first = await p.complete("m", other)
+        assert first == await _provider().complete("m", other)
+        assert len(first.split()) == 20 and first.endswith(".")
+    asyncio.run(main())
+
+
+def test_error_rate_and_stream():
+    async def main():
+        with pytest.raises(SimulatedLLMError):
+            await _provider(error_rate=1.0).complete("m", _MSGS)
+        p = _provider()
+        parts = [d async for d in p.stream("m", _MSGS)]
+        assert len(parts) == 20 and "".join(parts) == await p.complete("m", _MSGS)
+    asyncio.run(main())
+
+
+def test_latency_distribution_per_model():
+    p = _provider(latency_ms=100, distribution="uniform", spread=0.5, model_latency_ms={"slow": 1000})
+    fast = [p.first_token_delay("m") for _ in range(200)]
+    assert 0.05 <= min(fast) and max(fast) <= 0.15
+    assert p.first_token_delay("slow") >= 0.5
+
+
+def test_openai_compatible_http_server():
+    async def main():
+        from aiohttp import ClientSession, web
+
+        runner = web.AppRunner(create_app(_provider()))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/v1/chat/completions"
+        try:
+            async with ClientSession() as s:
+                async with s.post(url, json={"model": "m", "messages": _MSGS}) as r:
+                    body = await r.json()
+                text = body["choices"][0]["message"]["content"]
+                async with s.post(url, json={"model": "m", "messages": _MSGS, "stream": True}) as r:
+                    raw = (await r.read()).decode("utf-8")
+        finally:
+            await runner.cleanup()
+        events = [line[len("data: "):] for line in raw.splitlines() if line.startswith("data: ")]
+        assert events[-1] == "[DONE]"
+        streamed = "".join(json.loads(e)["choices"][0]["delta"].get("content", "") for e in events[:-1])
+        assert streamed == text
+    asyncio.run(main())
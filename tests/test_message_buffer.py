@@ -0,0 +1,81 @@
+"""
+Unit-тесты для write-behind буфера сообщений (core.services.message_buffer).
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.services.message_buffer import DialogMessageBuffer, merge_rows
+
+
+class _RecordingBuffer(DialogMessageBuffer):
+    def __init__(self, *args, fail: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches: list = []
+        self.fail = fail
+
+    async def _write(self, rows):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("db down")
+        self.batches.append(list(rows))
+        return len(rows)
+
+
+def _add(buf, content, dialog="d1"):
+    buf.add(user_id=1, profile_id=2, dialog_id=dialog, role="user", content=content)
+
+
+class TestDialogMessageBuffer:
+    def test_rows_are_batched_by_size(self):
+        async def scenario():
+            buf = _RecordingBuffer(flush_interval_ms=10_000, max_rows=3)
+            for n in range(3):
+                _add(buf, str(n))
+            await asyncio.sleep(0.01)
+            return buf
+
+        buf = asyncio.run(scenario())
+        assert [len(b) for b in buf.batches] == [3]
+
+    def test_pending_visible_until_flushed(self):
+        async def scenario():
+            buf = _RecordingBuffer(flush_interval_ms=20, max_rows=100)
+            _add(buf, "a")
+            _add(buf, "b", dialog="other")
+            assert [r["content"] for r in buf.pending_messages(1, 2, "d1")] == ["a"]
+            await asyncio.sleep(0.05)
+            assert buf.pending_messages(1, 2, "d1") == []
+            return buf
+
+        buf = asyncio.run(scenario())
+        assert len(buf.batches) == 1 and len(buf.batches[0]) == 2
+
+    def test_failed_flush_keeps_rows(self):
+        async def scenario():
+            buf = _RecordingBuffer(flush_interval_ms=10, max_rows=100, fail=1)
+            _add(buf, "a")
+            assert await buf.flush() == 0
+            assert len(buf) == 1
+            await buf.stop()
+            return buf
+
+        buf = asyncio.run(scenario())
+        assert [r["content"] for r in buf.batches[0]] == ["a"]
+
+
+class TestMergeRows:
+    def test_dedup_and_limit(self):
+        t0 = datetime(2026, 1, 1)
+        db_rows = [SimpleNamespace(created_at=t0 + timedelta(seconds=n), role="user", content=str(n)) for n in range(3)]
+        pending = [
+            {"created_at": t0 + timedelta(seconds=2), "role": "user", "content": "2"},
+            {"created_at": t0 + timedelta(seconds=3), "role": "user", "content": "3"},
+        ]
+        merged = merge_rows(db_rows, pending, limit=3)
+        assert [content for _, _, content in merged] == ["1", "2", "3"]
+        assert merged[-1] == (t0 + timedelta(seconds=3), "user", "3")
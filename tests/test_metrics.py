@@ -0,0 +1,41 @@
+"""
+Unit-тесты для core.metrics: текстовый формат Prometheus и нормализация меток.
+"""
+from core.metrics import CallbackCounter, Counter, Gauge, Histogram, endpoint_label, job_label
+
+
+class TestExposition:
+    def test_histogram_buckets_are_cumulative(self):
+        h = Histogram("t_latency_seconds", "test", ("model",), buckets=(0.1, 1.0))
+        h.observe(0.05, model="m")
+        h.observe(0.5, model="m")
+        h.observe(5.0, model="m")
+        text = h.render()
+        assert 't_latency_seconds_bucket{model="m",le="0.1"} 1' in text
+        assert 't_latency_seconds_bucket{model="m",le="1"} 2' in text
+        assert 't_latency_seconds_bucket{model="m",le="+Inf"} 3' in text
+        assert 't_latency_seconds_count{model="m"} 3' in text
+        assert "# TYPE t_latency_seconds histogram" in text
+
+    def test_counter_and_gauge_function(self):
+        c = Counter("t_rate_limited_total", "test", ("service",))
+        c.inc(service="avito")
+        c.inc(2, service="avito")
+        g = Gauge("t_depth", "test")
+        g.set_function(lambda: 7)
+        assert 't_rate_limited_total{service="avito"} 3' in c.render()
+        assert "t_depth 7" in g.render()
+        events = CallbackCounter("t_events_total", "test", ("outcome",))
+        events.set_function(lambda: {("accepted",): 5})
+        assert "# TYPE t_events_total counter" in events.render()
+        assert 't_events_total{outcome="accepted"} 5' in events.render()
+
+
+class TestLabels:
+    def test_endpoint_label_strips_ids(self):
+        path = "/messenger/v1/accounts/123/chats/u2i-abc/messages"
+        assert endpoint_label(path) == "/messenger/v1/accounts/{id}/chats/{chat_id}/messages"
+
+    def test_job_label(self):
+        assert job_label("report_task_42") == "report_task"
+        assert job_label("ai_followups") == "ai_followups"
@@ -0,0 +1,44 @@
+"""
+Unit-тесты для стоп-слов и негативных фраз (core.services.phrase_matcher).
+"""
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.services.phrase_matcher import PhraseMatcher, get_matcher, parse_negative_phrases, parse_stop_words
+
+
+def _ai(profile_id=1, stop_words=None, negative_phrases=None):
+    return SimpleNamespace(profile_id=profile_id, stop_words=stop_words, negative_phrases=negative_phrases)
+
+
+def test_word_boundaries_case_and_yo():
+    m = PhraseMatcher(parse_stop_words("Доставка, надо"), parse_negative_phrases(None))
+    assert m.scan("Какая ДОСТАВКА?").stop_word == "доставка"
+    assert m.scan("доставками не занимаемся").stop_word is None
+    assert m.scan("мне  НЕ\nинтересно").negative is True
+    assert m.scan("не надоело").negative is False
+    assert PhraseMatcher([], parse_negative_phrases('["Ещё подумаю"]')).scan("еще подумаю").negative
+
+
+def test_stop_word_and_negative_in_one_pass():
+    m = PhraseMatcher(["надо", "надоело"], ["не хочу"])
+    found = m.scan("надоело, не хочу")
+    assert found.stop_word == "надоело" and found.negative
+    assert PhraseMatcher([], []).scan("что угодно").stop_word is None
+
+
+def test_bad_negative_json_falls_back_to_defaults():
+    assert parse_negative_phrases("не json") == parse_negative_phrases(None)
+
+
+def test_matcher_cached_per_settings_revision():
+    ai = _ai(stop_words="скидка")
+    first = get_matcher(ai)
+    assert get_matcher(_ai(stop_words="скидка")) is first
+    ai.stop_words = "скидка, торг"
+    second = get_matcher(ai)
+    assert second is not first
+    assert second.scan("будет торг?").stop_word == "торг"
@@ -0,0 +1,82 @@
+"""
+Unit-тесты для кэша профиля webhook (core.services.profile_cache): инвалидация после commit.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from core.database.models import AvitoProfile, Base, User
+from core.database.session import async_engine, get_session
+from core.services import profile_cache
+from core.services.profile_cache import CachedProfile, invalidate_on_commit
+
+
+def _put(avito_user_id: int, profile_id: int) -> None:
+    cached = CachedProfile(profile_id=profile_id, owner_id=1, avito_user_id=avito_user_id, ai=None)
+    profile_cache._entries[avito_user_id] = (time.monotonic() + 300, cached)
+
+
+class TestProfileCacheInvalidation:
+    def setup_method(self):
+        profile_cache._entries.clear()
+        self.engine = create_engine("sqlite://")
+
+    def test_invalidated_only_after_commit(self):
+        _put(100, 1)
+        _put(200, 2)
+        with Session(self.engine) as session:
+            invalidate_on_commit(session, 1)
+            assert 100 in profile_cache._entries
+            session.commit()
+        assert 100 not in profile_cache._entries
+        assert 200 in profile_cache._entries
+
+    def test_rollback_keeps_entry(self):
+        _put(100, 1)
+        with Session(self.engine) as session:
+            session.execute(text("SELECT 1"))
+            invalidate_on_commit(session, 1)
+            session.rollback()
+            session.commit()
+        assert 100 in profile_cache._entries
+
+    def test_invalidation_drops_negative_entries(self):
+        profile_cache._entries[300] = (time.monotonic() + 60, None)
+        profile_cache.invalidate_profile(5)
+        assert 300 not in profile_cache._entries
+
+
+class TestProfileCacheLoad:
+    def test_invalidation_during_load_is_not_stored(self):
+        @asynccontextmanager
+        async def session_with_concurrent_commit():
+            # Пока читаем профиль, хендлер коммитит изменение и инвалидирует кэш
+            profile_cache.invalidate_profile(1)
+            async with get_session() as session:
+                yield session
+
+        async def scenario():
+            async with async_engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+            async with get_session() as s:
+                s.add(User(telegram_id=1))
+                await s.flush()
+                s.add(AvitoProfile(id=1, owner_id=1, user_id=777, profile_name="p", client_id="c", client_secret="s"))
+            profile_cache._entries.clear()
+            with mock.patch.object(profile_cache, "get_session", session_with_concurrent_commit):
+                assert (await profile_cache.get_webhook_profile(777)).profile_id == 1
+            assert 777 not in profile_cache._entries
+            # Следующий промах без инвалидации кэшируется как обычно
+            assert (await profile_cache.get_webhook_profile(777)).profile_id == 1
+            assert 777 in profile_cache._entries
+
+        asyncio.run(scenario())
@@ -0,0 +1,55 @@
+"""
+Unit-тесты для кэша ответов LLM (core.llm.response_cache): ключ, LRU, TTL, статистика.
+"""
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.llm.response_cache import ResponseCache, cache_key
+
+
+def _msgs(question: str, prompt: str = "Вы продавец."):
+    return [{"role": "system", "content": prompt}, {"role": "user", "content": question}]
+
+
+class TestCacheKey:
+    def test_normalized_question_matches(self):
+        assert cache_key(1, "m", _msgs("Актуально?"), 1) == cache_key(1, "m", _msgs("  актуально "), 1)
+
+    def test_profile_prompt_and_model_are_part_of_key(self):
+        base = cache_key(1, "m", _msgs("актуально?"), 1)
+        assert base != cache_key(2, "m", _msgs("актуально?"), 1)
+        assert base != cache_key(1, "m", _msgs("актуально?", prompt="Другой промпт"), 1)
+        assert base != cache_key(1, "other", _msgs("актуально?"), 1)
+
+    def test_dialog_summary_is_not_part_of_key(self):
+        msgs = _msgs("актуально?")
+        with_summary = [msgs[0], {"role": "system", "content": "резюме диалога", "summary": True}, msgs[1]]
+        assert cache_key(1, "m", with_summary, 1) == cache_key(1, "m", msgs, 1)
+
+
+class TestResponseCache:
+    def test_hit_miss_and_lru(self):
+        async def scenario():
+            cache = ResponseCache(max_items=2)
+            assert await cache.get("a", 1, "m") is None
+            await cache.put("a", "m", "A", ttl_seconds=60)
+            await cache.put("b", "m", "B", ttl_seconds=60)
+            assert await cache.get("a", 1, "m") == "A"
+            await cache.put("c", "m", "C", ttl_seconds=60)  # вытесняет "b"
+            assert await cache.get("b", 1, "m") is None
+            return cache.stats(1)
+
+        stats = asyncio.run(scenario())
+        assert stats["hit"] == 1 and stats["miss"] == 2
+
+    def test_ttl_expiry(self):
+        async def scenario():
+            cache = ResponseCache(max_items=10)
+            await cache.put("a", "m", "A", ttl_seconds=1)
+            cache._items["a"] = (0.0, "A")  # срок истёк
+            return await cache.get("a", 1, "m")
+
+        assert asyncio.run(scenario()) is None
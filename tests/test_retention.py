@@ -0,0 +1,93 @@
+"""
+Тесты чистки старых строк (core.retention) на SQLite в памяти.
+"""
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import func, select
+
+from core.database.models import (
+    AIDialogMessage,
+    AIDialogState,
+    AISettings,
+    AvitoProfile,
+    Base,
+    FollowupStep,
+    ScheduledFollowup,
+    User,
+)
+from core.database.session import async_engine, get_session
+from core.retention import run_retention
+
+NOW = datetime(2026, 10, 19, 12, 0)
+
+
+def _profile(profile_id):
+    return AvitoProfile(id=profile_id, owner_id=1, profile_name=f"p{profile_id}", client_id="c", client_secret="s")
+
+
+async def _seed():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with get_session() as s:
+        s.add(User(telegram_id=1))
+        await s.flush()
+        # Профиль 1: свой срок 30 дней; профиль 2 срок не задавал — его история не трогается
+        s.add_all([_profile(1), _profile(2)])
+        await s.flush()
+        s.add(AISettings(profile_id=1, context_retention_days=30))
+        s.add(FollowupStep(id=1, profile_id=1, order_index=0, delay_seconds=60, send_mode="always", content_type="text"))
+        for profile_id in (1, 2):
+            for days in (400, 40, 1):
+                s.add(AIDialogMessage(user_id=1, profile_id=profile_id, dialog_id=f"d{days}", role="user",
+                                      content=f"msg {days}", created_at=NOW - timedelta(days=days)))
+        for dialog, days in (("d40", 40), ("busy", 40), ("d1", 1)):
+            s.add(AIDialogState(user_id=1, profile_id=1, dialog_id=dialog, last_client_message_at=NOW - timedelta(days=days)))
+        for status, days in (("sent", 60), ("dead", 60), ("sent", 5), ("pending", 60)):
+            s.add(ScheduledFollowup(user_id=1, profile_id=1, step_id=1, dialog_id="busy" if status == "pending" else "x",
+                                    execute_at=NOW - timedelta(days=days), status=status))
+
+
+async def _count(model, *where):
+    async with get_session() as s:
+        return await s.scalar(select(func.count()).select_from(model).where(*where))
+
+
+def test_retention_archives_and_deletes_old_rows():
+    async def scenario(archive_dir):
+        await _seed()
+        dry = await run_retention(dry_run=True, now=NOW)
+        report = await run_retention(now=NOW, archive_dir=archive_dir, batch_size=1)
+        again = await run_retention(now=NOW, archive_dir=archive_dir)
+        left = (
+            await _count(AIDialogMessage, AIDialogMessage.profile_id == 1),
+            await _count(AIDialogMessage, AIDialogMessage.profile_id == 2),
+            await _count(AIDialogState),
+            await _count(ScheduledFollowup),
+        )
+        return dry, report, again, left
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        dry, report, again, left = asyncio.run(scenario(archive_dir))
+        # Профиль 1 хранит 30 дней, профиль 2 — всё; у "busy" есть pending-фоллоу-ап
+        assert left == (1, 3, 2, 2)
+        expected = {"ai_dialog_messages": 2, "ai_dialog_state": 1, "scheduled_followups": 2}
+        assert {name: t.rows for name, t in dry.tables.items()} == expected
+        assert {name: t.rows for name, t in report.tables.items()} == expected
+        assert report.bytes > 0 and again.rows == 0
+        archived = [
+            json.loads(line)
+            for path in Path(archive_dir).glob("ai_dialog_messages-*.jsonl.gz")
+            for line in gzip.open(path, "rt", encoding="utf-8")
+        ]
+        assert sorted(row["content"] for row in archived) == ["msg 40", "msg 400"]
+        assert "ai_dialog_messages: 2 row(s)" in report.format()
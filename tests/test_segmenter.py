@@ -0,0 +1,49 @@
+"""
+Unit-тесты для разбиения потокового ответа на группы предложений (core.llm.segmenter).
+"""
+import asyncio
+import os
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from core.llm.segmenter import SentenceSegmenter, sentence_groups
+
+
+async def _deltas(text: str, size: int = 3):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class TestSentenceSegmenter:
+    def test_group_emitted_as_soon_as_complete(self):
+        seg = SentenceSegmenter(2)
+        assert seg.feed("Здравствуйте! Да, ") == []
+        assert seg.feed("товар в наличии. Цена") == ["Здравствуйте! Да, товар в наличии."]
+        assert seg.finish() == "Цена"
+
+    def test_decimal_point_is_not_a_boundary(self):
+        seg = SentenceSegmenter(1)
+        assert seg.feed("Вес 3.5 кг. Доставка") == ["Вес 3.5 кг."]
+
+    def test_stream_groups(self):
+        text = "Один. Два? Три! Четыре."
+
+        async def collect():
+            return [g async for g in sentence_groups(_deltas(text), 2)]
+
+        assert asyncio.run(collect()) == ["Один. Два?", "Три! Четыре."]
+
+    def test_abbreviations_and_lowercase_continuation_do_not_split(self):
+        seg = SentenceSegmenter(1)
+        assert seg.feed("Это б/у, т.е. уже с пробегом. Цена 500 руб. в месяц. Адрес: ул. Ленина. ") == [
+            "Это б/у, т.е. уже с пробегом.",
+            "Цена 500 руб. в месяц.",
+        ]
+        # Граница подтверждается только следующей буквой
+        assert seg.feed("Ж") == ["Адрес: ул. Ленина."]
+        assert seg.finish() == "Ж"
+
+    def test_paragraph_break_always_splits(self):
+        seg = SentenceSegmenter(1)
+        assert seg.feed("Список\n\nдалее. а") == ["Список"]
@@ -0,0 +1,43 @@
+"""
+release_connection (core.database.session): соединение возвращается в пул до долгого ожидания.
+"""
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from core.database.models import Base, User
+from core.database.session import release_connection
+
+
+def test_release_connection_returns_it_to_pool_and_keeps_objects():
+    async def scenario(path):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        factory = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with factory() as session:
+                session.add(User(telegram_id=7, current_mode="ai_seller"))
+                await session.flush()
+                user = (await session.execute(select(User))).scalar_one()
+                held = engine.pool.checkedout()
+                await release_connection(session)
+                released = engine.pool.checkedout()
+                # Изменения уже зафиксированы, объект доступен без запроса
+                user.current_mode = "reports"
+                await session.commit()
+                mode = await session.scalar(select(User.current_mode).where(User.telegram_id == 7))
+            return held, released, mode, engine.pool.checkedout()
+        finally:
+            await engine.dispose()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        held, released, mode, after = asyncio.run(scenario(Path(tmp) / "s.db"))
+    assert (held, released, mode, after) == (1, 0, "reports", 0)